@@ -0,0 +1,216 @@
+# ff_agent/admission.py
+"""
+/chat 准入控制
+
+- 同一个 thread_id 的请求串行（asyncio.Lock，按到达顺序）：同一会话的轮次不会在 checkpoint 上互相覆盖
+- 全局 in-flight 上限 + 有界等待队列：满了 / 等太久直接拒绝（503 + Retry-After），
+  而不是把突发流量全部压给 OpenAI 变成 429
+- 单个 thread 排队的请求数也有上限（429 + Retry-After），一个会话狂点不会占满全局队列
+
+先拿 thread 锁再占全局名额：排在同一会话后面的请求不占全局 slot。
+/chat/batch 有自己的并发上限，只用 thread_lock() 拿同一把 thread 锁（不占全局名额、不超时），
+这样批量条目和 /chat 落在同一个会话上时也是串行的。
+所有计数只在 event loop 线程里改，不需要额外加锁。
+"""
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from ff_agent.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_THREAD_MAX_PENDING = int(os.getenv("ADMISSION_THREAD_MAX_PENDING", "4"))
+RETRY_AFTER_MAX_SECONDS = 30
+
+
+class AdmissionRejected(Exception):
+    """status：503（全局排满 / 等待超时）或 429（同一 thread 排队过多 / 等待超时）"""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+async def _acquire(primitive, timeout: float) -> None:
+    """Lock / Semaphore 的 acquire，最多等 timeout 秒（空闲时直接拿，不受 timeout<=0 影响）"""
+    if not primitive.locked():
+        await primitive.acquire()
+        return
+    await asyncio.wait_for(primitive.acquire(), timeout)
+
+
+class _ThreadSlot:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0  # 持有 + 等待这个锁的请求数
+
+
+class Ticket:
+    """一次已准入的请求；release() 可重复调用（流式响应可能从两条路径释放）"""
+
+    __slots__ = ("_controller", "thread_id", "_slot", "_t0", "_released")
+
+    def __init__(self, controller: "AdmissionController", thread_id: str, slot: _ThreadSlot):
+        self._controller = controller
+        self.thread_id = thread_id
+        self._slot = slot
+        self._t0 = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self, time.perf_counter() - self._t0)
+
+    async def __aenter__(self) -> "Ticket":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+        thread_max_pending: int = ADMISSION_THREAD_MAX_PENDING,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.thread_max_pending = thread_max_pending
+
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._threads: Dict[str, _ThreadSlot] = {}
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "thread_busy": 0, "thread_timeout": 0}
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._avg_turn_seconds = 1.0  # 指数滑动平均，用来估 Retry-After
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+            self._threads = {}
+        return self._sem
+
+    def _retry_after(self) -> int:
+        """按当前排队量和平均每轮耗时，估计多久后大概率能进"""
+        backlog = (self.queued + self.in_flight) / max(1, self.max_concurrent)
+        return max(1, min(RETRY_AFTER_MAX_SECONDS, math.ceil(backlog * self._avg_turn_seconds)))
+
+    def _reject(self, status: int, reason: str, retry_after: Optional[int] = None) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        return AdmissionRejected(status, reason, retry_after or self._retry_after())
+
+    async def acquire(self, thread_id: str) -> Ticket:
+        sem = self._semaphore()
+        t0 = time.perf_counter()
+        deadline = t0 + self.max_wait_seconds
+
+        slot = self._threads.get(thread_id)
+        if slot is None:
+            slot = self._threads[thread_id] = _ThreadSlot()
+        if slot.pending >= self.thread_max_pending:
+            raise self._reject(429, "thread_busy")
+
+        slot.pending += 1
+        try:
+            # 1) 同一会话按顺序
+            try:
+                await _acquire(slot.lock, max(0.0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                raise self._reject(429, "thread_timeout", max(1, math.ceil(self._avg_turn_seconds)))
+
+            # 2) 全局名额：队列满直接拒绝，否则最多等到 deadline
+            try:
+                if sem.locked() and self.queued >= self.max_queue:
+                    raise self._reject(503, "queue_full")
+                self.queued += 1
+                try:
+                    await _acquire(sem, max(0.0, deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    raise self._reject(503, "queue_timeout")
+                finally:
+                    self.queued -= 1
+            except BaseException:
+                slot.lock.release()
+                raise
+        except BaseException:
+            self._drop_thread_ref(thread_id, slot)
+            raise
+
+        wait = time.perf_counter() - t0
+        self.in_flight += 1
+        self.admitted += 1
+        self.total_wait_ms += wait * 1000
+        self.max_wait_ms = max(self.max_wait_ms, wait * 1000)
+        ADMISSION_WAIT_SECONDS.observe(wait)
+        return Ticket(self, thread_id, slot)
+
+    @asynccontextmanager
+    async def thread_lock(self, thread_id: str) -> AsyncIterator[None]:
+        """只拿 thread 锁（批量用）：一直等，不占全局名额，不受 thread_max_pending 限制、不计入准入统计"""
+        self._semaphore()  # 换了 event loop 时重建 _threads
+        slot = self._threads.get(thread_id)
+        if slot is None:
+            slot = self._threads[thread_id] = _ThreadSlot()
+        slot.pending += 1
+        try:
+            async with slot.lock:
+                yield
+        finally:
+            self._drop_thread_ref(thread_id, slot)
+
+    def _drop_thread_ref(self, thread_id: str, slot: _ThreadSlot) -> None:
+        slot.pending -= 1
+        if slot.pending == 0 and self._threads.get(thread_id) is slot:
+            del self._threads[thread_id]
+
+    def _release(self, ticket: Ticket, turn_seconds: float) -> None:
+        self._avg_turn_seconds = 0.9 * self._avg_turn_seconds + 0.1 * turn_seconds
+        self.in_flight -= 1
+        if self._sem is not None:
+            self._sem.release()
+        ticket._slot.lock.release()
+        self._drop_thread_ref(ticket.thread_id, ticket._slot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait_seconds,
+            "thread_max_pending": self.thread_max_pending,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "active_threads": len(self._threads),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_ms": round(self.total_wait_ms / self.admitted, 1) if self.admitted else None,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+            "avg_turn_ms": round(self._avg_turn_seconds * 1000, 1),
+        }
+
+
+admission = AdmissionController()
+ADMISSION_QUEUE_DEPTH.set_function(lambda: admission.queued)
+ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
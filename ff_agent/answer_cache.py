@@ -0,0 +1,129 @@
+# ff_agent/answer_cache.py
+"""
+answer_node 的回答缓存（LRU + TTL）
+
+很多访客问的几乎是同一件事（"urn under $60"）。只缓存有明确品类（search_kw 非空）的 product 轮次，key 是：
+intent、search_kw、预算档位、occasion、语言 + 消息签名（去掉停用词和数字后的词集合）。
+- 消息签名：同一个品类下的不同问题（"多大" vs "什么材质"）不能共用回答；"urn under $60" 和 "under $55 urn" 可以
+- 预算按档位（BUDGET_BANDS）而不是精确金额：同一档内的预算共用一条；命中时 graph 再确认缓存里的商品都不超过
+  本次预算，超了按 miss 处理
+- policy / other 等 intent 不缓存：回答取决于具体问题，签名覆盖不了（policy 的常见问题走 FAQ 快速路径）
+- 商品列表变化（catalog version 变化）时整体清空
+- 带刻字内容的消息不走缓存（回答要引用具体刻字）
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from ff_agent.catalog import catalog
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "600"))
+
+# 预算档位（美元，上界）：常见的 "under $X" 说法落在同一档；超过最后一档的都算一档
+BUDGET_BANDS = (25, 50, 75, 100, 150, 200, 300, 500)
+
+# 不影响回答的词：签名里去掉
+_STOPWORDS = frozenset("""
+a an the i im i'm me my we our you your it its it's this that these those is are am was be been do does did
+can could would will should please thanks thank hi hello hey for to of and or in on at with from by
+under below less than over above about around within budget dollars dollar usd some something any
+want need looking look find get buy have has just really very so also pet pets
+我 你 的 了 吗 呢 吧 啊 想 要 买 一 个 请 在 以 内 下 刀 块 美 元 预 算
+""".split())
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?|[\u4e00-\u9fff]")  # 中文按单字
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存；value 附带生成它花的时间，用来统计命中省下的延迟"""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple[float, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_ms = 0.0
+
+    def get(self, key: Hashable, valid: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """valid：命中后再检查一次（不通过按 miss 算，条目保留给别的请求）"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now or (valid is not None and not valid(item[2])):
+                if item is not None and item[0] < now:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += item[1]
+            return item[2]
+
+    def set(self, key: Hashable, value: Any, cost_ms: float = 0.0) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, cost_ms, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "saved_ms": round(self.saved_ms, 1),
+        }
+
+
+answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS)
+
+# 商品列表变了：所有缓存的推荐都可能过期
+catalog.on_change(answer_cache.clear)
+
+
+def budget_band(budget: Optional[float]) -> Optional[int]:
+    """预算所在档位的上界；超过最后一档返回 0（"500 以上"）"""
+    if not budget:
+        return None
+    return next((band for band in BUDGET_BANDS if budget <= band), 0)
+
+
+def message_signature(message: str) -> frozenset:
+    """去掉停用词和数字（预算已经单独分档）后的词集合，与词序无关"""
+    return frozenset(w for w in _WORD.findall((message or "").lower()) if w not in _STOPWORDS)
+
+
+def answer_cache_key(
+    intent: str,
+    search_kw: Optional[str],
+    budget: Optional[float],
+    occasion: Optional[str],
+    is_cn: bool,
+    message: str,
+) -> Optional[tuple]:
+    """不可缓存（不是 product 轮次 / 没有明确品类）时返回 None"""
+    if intent != "product" or not search_kw:
+        return None
+    occasion = (str(occasion).strip().lower() or None) if occasion else None
+    return (intent, search_kw, budget_band(budget), occasion, "zh" if is_cn else "en", message_signature(message))
@@ -1,19 +1,59 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from typing import List, Optional
 from pathlib import Path
 from dotenv import load_dotenv
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
-from ff_agent.graph import build_graph
+# 只导入轻量模块：langgraph / langchain_openai / openai 在 lifespan 预热里（线程中）才导入，端口先开
+from ff_agent.catalog import catalog, CATALOG_ENABLED
+from ff_agent.shopify_storefront import aclose_async_client, awarm_up as shopify_awarm_up, coalesce_stats
+from ff_agent.profile_rules import profile_stats
+from ff_agent.llm_gateway import gateway
+from ff_agent.answer_cache import answer_cache
+from ff_agent.knowledge import KnowledgeIndex
+from ff_agent import metrics, request_timings
+from ff_agent.warmup import WARMUP_CONNECTIONS, WARMUP_WAIT_SECONDS, warmup
+from ff_agent.admission import AdmissionRejected, admission
+from ff_agent.faq import faq_table
+from ff_agent.batch import BATCH_MAX_ITEMS, abatch_chat, summarize
+from ff_agent.http_responses import StaticAssets, json_response, response_stats
 
 # ------------------------
 # 基础初始化
 # ------------------------
 
 load_dotenv()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不在这里 await：端口先开，后台预热完成后 /health 才报 ready
+    # - 线程里构建 graph（含重依赖 import、知识稿索引、checkpointer）
+    # - 并行：预先打开 OpenAI / Shopify 连接池里的连接；全量拉一次商品快照 + 启动后台刷新
+    #   （都是 best-effort：失败不阻塞 ready，search_products 会走线上兜底，连接按需再建）
+    steps = {
+        "openai": lambda: gateway.awarm_up(connections=WARMUP_CONNECTIONS),
+        "shopify": lambda: shopify_awarm_up(WARMUP_CONNECTIONS),
+    }
+    if CATALOG_ENABLED:
+        steps["catalog"] = lambda: asyncio.to_thread(catalog.start)
+    warmup.start(warm_build, steps)
+    yield
+    await warmup.stop()
+    catalog.stop()
+    await aclose_async_client()
+    await gateway.aclose()
+
+app = FastAPI(lifespan=lifespan)
 # ✅ NEW: CORS (必须放在路由定义前)
 app.add_middleware(
     CORSMiddleware,
@@ -39,15 +79,17 @@ API_VERSION = "0.4.0"
 # ------------------------
 # 静态页面（前端聊天）
 # ------------------------
-@app.get("/")
-def root():
-    return FileResponse(STATIC_DIR / "chat.html")
+# 内存里预压缩的 gzip / br 变体 + ETag / Last-Modified（304）；见 ff_agent/http_responses.py
+static_assets = StaticAssets(STATIC_DIR)
 
-app.mount(
-    "/static",
-    StaticFiles(directory=STATIC_DIR),
-    name="static"
-)
+@app.api_route("/", methods=["GET", "HEAD"])
+def root(request: Request):
+    # HTML 入口不长缓存：每次用 ETag 验证（没改就是 304），改版立刻生效
+    return static_assets.response(request, "chat.html", cache_control="no-cache")
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+def static(request: Request, path: str):
+    return static_assets.response(request, path)
 
 # ------------------------
 # 数据结构
@@ -56,38 +98,94 @@ app.mount(
 class ChatRequest(BaseModel):
     message: str
     thread_id: str = "default"
+    # true（或请求头 X-Debug-Timings: 1）时返回 timings 耗时明细，并写一行结构化日志
+    debug: bool = False
+
+class BatchItem(BaseModel):
+    message: str
+    # 不给就每条一个新会话；同一个 thread_id 的条目按顺序串行（多轮脚本）
+    thread_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    # 不超过 BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = None
+
+DEBUG_HEADER = "x-debug-timings"
+
+def wants_timings(req: ChatRequest, request: Request) -> bool:
+    return req.debug or request.headers.get(DEBUG_HEADER, "").lower() in ("1", "true", "yes")
 
 # ------------------------
 # 加载知识 + 构建 Agent
 # ------------------------
 
 KNOWLEDGE_PATH = DOCS_DIR / "01_store_knowledge.md"
+# 1 = 按 intent / 消息只带相关知识小节；0 = 整份知识稿（旧行为，便于对比）
+KNOWLEDGE_SCOPED = os.getenv("KNOWLEDGE_SCOPED", "1") != "0"
 
 def load_store_knowledge() -> str:
     if KNOWLEDGE_PATH.exists():
         return KNOWLEDGE_PATH.read_text(encoding="utf-8")
     return ""
 
-def build_system_prompt(store_knowledge: str) -> str:
-    return (
+def build_system_prompt(store_knowledge: str = "") -> str:
+    prompt = (
         "You are a compassionate assistant for an English-first pet memorial store (ForeverFurEver).\n"
         "Default to English unless user writes in Chinese.\n"
-        "Personalization is TEXT-ONLY.\n\n"
-        f"{store_knowledge}"
+        "Personalization is TEXT-ONLY."
     )
+    return f"{prompt}\n\n{store_knowledge}" if store_knowledge else prompt
+
+knowledge: KnowledgeIndex | None = None
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_graph():
+    """✅ 只初始化一次 Graph（很重要）：lifespan 预热时在线程里构建；没跑 lifespan（脚本 / 测试）时第一次用到再建"""
+    global _graph, knowledge
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                from ff_agent.graph import build_graph
+
+                store_knowledge = load_store_knowledge()
+                knowledge = KnowledgeIndex(store_knowledge)
+                system_prompt = build_system_prompt() if KNOWLEDGE_SCOPED else build_system_prompt(store_knowledge)
+                _graph = build_graph(system_prompt, knowledge if KNOWLEDGE_SCOPED else None)
+    return _graph
+
+def warm_build():
+    """预热的 CPU 部分（同一个线程里顺序做）：langgraph + graph 构建，openai / langchain_openai 导入，静态文件预压缩"""
+    get_graph()
+    gateway.preload()
+    static_assets.preload()
 
-store_knowledge = load_store_knowledge()
-system_prompt = build_system_prompt(store_knowledge)
+def __getattr__(name: str):
+    # `api_server.graph`（脚本 / 测试里直接用）
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# ✅ 只初始化一次 Graph（很重要）
-graph = build_graph(system_prompt)
+async def ready_graph():
+    """
+    预热中进来的请求等预热完成（最多 WARMUP_WAIT_SECONDS），超时 / 构建失败返回 503 + Retry-After；
+    没有启动预热（没跑 lifespan）时在线程里按需构建
+    """
+    if _graph is not None:
+        return _graph
+    if not warmup.started:
+        return await asyncio.to_thread(get_graph)
+    if not await warmup.wait(WARMUP_WAIT_SECONDS) or _graph is None:
+        raise AdmissionRejected(503, "warming_up", 5)
+    return _graph
 
 # ------------------------
 # 统一返回结构
 # ------------------------
 
-def make_response(result: dict, resp_type: str) -> dict:
-    return {
+def make_response(result: dict, resp_type: str, timings: request_timings.RequestTimings | None = None) -> dict:
+    resp = {
         "type": resp_type,
         "intent": result.get("intent", "other"),
         "content": (
@@ -101,6 +199,31 @@ def make_response(result: dict, resp_type: str) -> dict:
         "tool_error": result.get("tool_error", None),
         "version": API_VERSION,
     }
+    if timings is not None:
+        resp["timings"] = timings.log(type=resp_type, intent=resp["intent"])
+    return resp
+
+def make_error_response(e: Exception) -> dict:
+    return {
+        "type": "error",
+        "intent": "other",
+        "content": "Server error. Please try again.",
+        "profile": {},
+        "actions": [],
+        "products_debug": [],
+        "tool_error": str(e),
+        "version": API_VERSION,
+    }
+
+def make_busy_response(e: AdmissionRejected) -> JSONResponse:
+    """准入控制拒绝：429（同一会话请求太多）/ 503（全局排满），带 Retry-After，不进 graph"""
+    body = {
+        **make_error_response(e),
+        "type": "busy",
+        "content": "We're helping a lot of people right now. Please try again in a moment.",
+        "retry_after": e.retry_after,
+    }
+    return JSONResponse(body, status_code=e.status, headers={"Retry-After": str(e.retry_after)})
 
 # ------------------------
 # Health check
@@ -108,33 +231,198 @@ def make_response(result: dict, resp_type: str) -> dict:
 
 @app.get("/health")
 def health():
+    # readiness：预热完成前 503（负载均衡先不导流量），body 里有各阶段耗时 / 错误
+    body = {"ok": warmup.ready, "ready": warmup.ready, "version": API_VERSION, "warmup": warmup.stats()}
+    return body if warmup.ready else JSONResponse(body, status_code=503)
+
+@app.get("/health/live")
+def health_live():
+    # liveness：进程在就 200（预热中也是），平台据此判断要不要重启
     return {"ok": True, "version": API_VERSION}
 
+# ------------------------
+# Runtime stats（快照年龄 / 刷新耗时等）
+# ------------------------
+
+@app.get("/stats")
+def stats():
+    prefetch = checkpointer = None
+    if _graph is not None:
+        from ff_agent.graph import prefetch_stats
+        from ff_agent.checkpointer import checkpointer_stats
+        prefetch, checkpointer = prefetch_stats(), checkpointer_stats(_graph.checkpointer)
+    return {
+        "warmup": warmup.stats(),
+        "catalog": catalog.stats(),
+        "profile_extraction": profile_stats(),
+        "prefetch": prefetch,
+        "llm": gateway.stats(),
+        "storefront": coalesce_stats(),
+        "answer_cache": answer_cache.stats(),
+        "faq": faq_table.stats(),
+        "admission": admission.stats(),
+        "responses": response_stats(static_assets),
+        "checkpointer": checkpointer,
+        "knowledge": {"scoped": KNOWLEDGE_SCOPED, **(knowledge.stats() if knowledge else {})},
+        "version": API_VERSION,
+    }
+
+# ------------------------
+# Prometheus 指标（节点 / LLM / Storefront 延迟直方图、token、错误、intent）
+# ------------------------
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # ------------------------
 # Chat API（唯一入口）
 # ------------------------
 
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request):
+    timings = request_timings.start(req.thread_id) if wants_timings(req, request) else None
+    # 预热中先等 graph；同一 thread 串行 + 全局并发上限；排不上直接 429 / 503
     try:
-        result = graph.invoke(
-            {"user_message": req.message},
-            config={"configurable": {"thread_id": req.thread_id}}
-        )
+        graph = await ready_graph()
+        ticket = await admission.acquire(req.thread_id)
+    except AdmissionRejected as e:
+        return make_busy_response(e)
+
+    from ff_agent.checkpointer import CHECKPOINT_DURABILITY  # graph 建好后才 import（已加载，不再是重依赖）
+
+    async with ticket:
+        try:
+            # async 全链路：不占用 threadpool，一个 worker 可同时挂起大量会话
+            result = await graph.ainvoke(
+                {"user_message": req.message},
+                config={"configurable": {"thread_id": req.thread_id}},
+                durability=CHECKPOINT_DURABILITY,
+            )
 
-        if result.get("needs_clarification"):
-            return make_response(result, "clarify")
+            resp_type = "clarify" if result.get("needs_clarification") else "answer"
+            return json_response(request, make_response(result, resp_type, timings))
 
-        return make_response(result, "answer")
+        except Exception as e:
+            resp = make_error_response(e)
+            if timings is not None:
+                resp["timings"] = timings.log(type="error", error=str(e))
+            return json_response(request, resp)
+
+# ------------------------
+# Chat streaming（SSE）
+# ------------------------
+# 只把这些节点的 LLM token 推给前端（extract_profile 的 JSON 不推）
+STREAM_TOKEN_NODES = {"answer", "clarify"}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_chat_events(req: ChatRequest, graph, ticket, debug: bool = False):
+    """
+    事件顺序：
+    - progress {stage: "intent"} → progress {stage: "products"} → token × N
+    - done：和 /chat 相同的 response 结构（含 actions / products_debug）+ ttft_ms / total_ms
+    - error：出错时的 error response
+    """
+    t0 = time.perf_counter()
+    ttft_ms = None
+    final: dict = {}
+    timings = request_timings.start(req.thread_id) if debug else None
+    from ff_agent.checkpointer import CHECKPOINT_DURABILITY
+
+    try:
+        async for mode, chunk in graph.astream(
+            {"user_message": req.message},
+            config={"configurable": {"thread_id": req.thread_id}},
+            stream_mode=["updates", "custom", "messages", "values"],
+            durability=CHECKPOINT_DURABILITY,
+        ):
+            if mode == "updates":
+                if "router" in chunk:
+                    yield sse_event("progress", {"stage": "intent", "intent": chunk["router"].get("intent")})
+            elif mode == "custom":
+                yield sse_event("progress", chunk)
+            elif mode == "messages":
+                msg, meta = chunk
+                if meta.get("langgraph_node") in STREAM_TOKEN_NODES and msg.content:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - t0) * 1000
+                    yield sse_event("token", {"text": msg.content})
+            elif mode == "values":
+                final = chunk
+
+        total_ms = (time.perf_counter() - t0) * 1000
+        resp = make_response(final, "clarify" if final.get("needs_clarification") else "answer", timings)
+        # 规则追问（不走 LLM）没有 token：首字时间就是整轮时间
+        resp["ttft_ms"] = round(ttft_ms if ttft_ms is not None else total_ms, 1)
+        resp["total_ms"] = round(total_ms, 1)
+        yield sse_event("done", resp)
 
     except Exception as e:
-        return {
-            "type": "error",
-            "intent": "other",
-            "content": "Server error. Please try again.",
-            "profile": {},
-            "actions": [],
-            "products_debug": [],
-            "tool_error": str(e),
-            "version": API_VERSION,
-        }
+        resp = make_error_response(e)
+        if timings is not None:
+            resp["timings"] = timings.log(type="error", error=str(e))
+        yield sse_event("error", resp)
+
+    finally:
+        # 准入名额在流结束（或客户端断开）时释放
+        ticket.release()
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    # 在开始推流之前做准入：拒绝时还能返回 429 / 503 状态码
+    try:
+        graph = await ready_graph()
+        ticket = await admission.acquire(req.thread_id)
+    except AdmissionRejected as e:
+        return make_busy_response(e)
+    return StreamingResponse(
+        stream_chat_events(req, graph, ticket, wants_timings(req, request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 流一个字节都没发出去就断开时，生成器不会被迭代；后台任务兜底释放（release 可重复调用）
+        background=BackgroundTask(ticket.release),
+    )
+
+# ------------------------
+# Batch chat（NDJSON：离线评测 / answer cache 预热）
+# ------------------------
+
+def batch_line(data: dict) -> bytes:
+    return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+async def batch_chat_lines(req: BatchRequest, graph):
+    """
+    每条完成时一行：{index, thread_id, ...和 /chat 相同的 response, timings}
+    最后一行：{type: "batch_done", items, errors, elapsed_ms, items_per_second, p50_ms, p95_ms,
+              cache_hits: {faq, answer, catalog}}
+    """
+    t0 = time.perf_counter()
+    results = []
+    async for r in abatch_chat(graph, [item.model_dump() for item in req.items], req.max_concurrency):
+        results.append({"error": r["error"], "timings": r["timings"]})  # 汇总只要这些，不留整份 state
+        if r["error"] is not None:
+            resp = make_error_response(RuntimeError(r["error"]))
+        else:
+            result = r["result"]
+            resp = make_response(result, "clarify" if result.get("needs_clarification") else "answer")
+        yield batch_line({"index": r["index"], "thread_id": r["thread_id"], **resp, "timings": r["timings"]})
+    yield batch_line({"type": "batch_done", **summarize(results, time.perf_counter() - t0)})
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchRequest):
+    # 不走 /chat 的准入控制：批量有自己的并发上限，LLM 调用仍受 gateway 限流
+    if len(req.items) > BATCH_MAX_ITEMS:
+        body = {**make_error_response(ValueError(f"at most {BATCH_MAX_ITEMS} items per batch")),
+                "content": "Batch too large."}
+        return JSONResponse(body, status_code=413)
+    try:
+        graph = await ready_graph()
+    except AdmissionRejected as e:
+        return make_busy_response(e)
+    return StreamingResponse(
+        batch_chat_lines(req, graph),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
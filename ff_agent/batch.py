@@ -0,0 +1,128 @@
+# ff_agent/batch.py
+"""
+批量跑 chat 轮次（夜间离线评测 / 热门问题预热 answer cache）
+
+- abatch_chat(graph, items)：并发跑一批 {message, thread_id}，哪个先跑完先 yield 哪个
+- batch_chat(graph, items)：同步版，按输入顺序返回列表（脚本里直接用）
+- 并发上限 = 独立的 semaphore（BATCH_MAX_CONCURRENCY），不占 /chat 的准入名额；
+  LLM 调用照样经过 llm_gateway 的并发 / RPM / TPM 限制，批量不会把线上流量挤到 429
+- 同一个 thread_id 的条目按输入顺序串行（多轮对话脚本），不同 thread 之间并发；
+  每轮还拿 admission 的同一把 thread 锁，和同一会话上的 /chat 请求也不会并发
+- 每条都带耗时明细：排队时间 + request_timings 的节点 / LLM / Shopify 拆分
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from ff_agent import request_timings
+from ff_agent.admission import admission
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+
+# 汇总里按层计命中：summary 名 → request_timings.cache 里的名字
+# faq / answer 是整轮回答直接出自缓存；catalog 是商品搜索查的本地快照（不是回答缓存，单独计）
+CACHE_LAYERS = {"faq": "faq", "answer": "answer_cache", "catalog": "catalog"}
+
+
+def _normalize(items: Iterable[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """没给 thread_id 的条目各自一个新会话（否则都落在 "default" 上互相串状态）"""
+    prefix = f"batch-{uuid.uuid4().hex[:8]}"
+    out = []
+    for i, item in enumerate(items):
+        out.append({"message": item["message"], "thread_id": item.get("thread_id") or f"{prefix}-{i}"})
+    return out
+
+
+async def abatch_chat(
+    graph,
+    items: Iterable[Dict[str, Any]],
+    max_concurrency: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    每条完成时 yield：
+    {index, thread_id, result（graph 最终 state，出错时 None）, error（str 或 None）, timings}
+    timings = request_timings 的明细 + queue_ms（等并发名额 / 等同一 thread 前一轮的时间）
+    调用方中途停止迭代（客户端断开）时，没跑完的条目会被取消。
+    """
+    from ff_agent.checkpointer import CHECKPOINT_DURABILITY  # graph 已建好，langgraph 已加载
+
+    items = _normalize(items)
+    limit = max(1, min(max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    sem = asyncio.Semaphore(limit)
+    thread_locks: Dict[str, asyncio.Lock] = {}
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int, item: Dict[str, str]) -> None:
+        thread_id = item["thread_id"]
+        lock = thread_locks.setdefault(thread_id, asyncio.Lock())
+        t0 = time.perf_counter()
+        # task 按输入顺序创建，Lock 的等待者 FIFO：同一 thread 的轮次按输入顺序执行
+        # 先批内排队，再和 /chat 抢同一会话的锁，最后占批量并发名额（和 /chat 准入同样的顺序）
+        async with lock, admission.thread_lock(thread_id):
+            async with sem:
+                queue_ms = round((time.perf_counter() - t0) * 1000, 1)
+                timings = request_timings.start(thread_id)  # 每个 task 有自己的 context
+                result, error = None, None
+                try:
+                    result = await graph.ainvoke(
+                        {"user_message": item["message"]},
+                        config={"configurable": {"thread_id": thread_id}},
+                        durability=CHECKPOINT_DURABILITY,
+                    )
+                except Exception as e:
+                    error = str(e)
+        finished.put_nowait({
+            "index": index,
+            "thread_id": thread_id,
+            "result": result,
+            "error": error,
+            "timings": {"queue_ms": queue_ms, **timings.to_dict()},
+        })
+
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for _ in range(len(tasks)):
+            yield await finished.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def batch_chat(
+    graph,
+    items: Iterable[Dict[str, Any]],
+    max_concurrency: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """同步版：跑完整批，按输入顺序返回（不能在已有 event loop 里调用，那种情况用 abatch_chat）"""
+
+    async def collect() -> List[Dict[str, Any]]:
+        return [r async for r in abatch_chat(graph, items, max_concurrency)]
+
+    return sorted(asyncio.run(collect()), key=lambda r: r["index"])
+
+
+def summarize(results: List[Dict[str, Any]], elapsed_seconds: float) -> Dict[str, Any]:
+    """整批的汇总：条数、失败数、吞吐、单条耗时分位数、每层缓存的命中条数"""
+    totals = sorted(r["timings"]["total_ms"] for r in results)
+
+    def pct(p: float) -> Optional[float]:
+        if not totals:
+            return None
+        return totals[min(len(totals) - 1, int(round(p / 100 * (len(totals) - 1))))]
+
+    return {
+        "items": len(results),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "elapsed_ms": round(elapsed_seconds * 1000, 1),
+        "items_per_second": round(len(results) / elapsed_seconds, 2) if elapsed_seconds > 0 else None,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "cache_hits": {
+            layer: sum(1 for r in results if r["timings"].get("cache", {}).get(name) == "hit")
+            for layer, name in CACHE_LAYERS.items()
+        },
+    }
@@ -0,0 +1,175 @@
+# ff_agent/catalog.py
+"""
+本地商品快照（catalog mirror）
+
+店铺商品很少，所以启动时把整个 catalog 分页拉到内存里，后台线程按间隔刷新。
+search_products 在快照就绪时直接查内存：热路径上不再有 Shopify 请求。
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from ff_agent.metrics import CATALOG_REFRESH_DURATION_SECONDS, CATALOG_SNAPSHOT_AGE_SECONDS
+from ff_agent.products import Product
+from ff_agent.shopify_storefront import storefront_query, product_from_node
+
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "1") != "0"
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+CATALOG_PAGE_SIZE = 250  # Storefront API 单页上限
+
+CATALOG_QUERY = """
+query CatalogPage($first: Int!, $after: String) {
+  products(first: $first, after: $after, sortKey: UPDATED_AT, reverse: true) {
+    pageInfo { hasNextPage endCursor }
+    edges {
+      node {
+        title
+        handle
+        availableForSale
+        productType
+        tags
+        priceRange {
+          minVariantPrice { amount currencyCode }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def fetch_all_products() -> List[Dict[str, Any]]:
+    """分页拉取全部商品 node（按 UPDATED_AT 倒序，和线上搜索排序一致）"""
+    nodes: List[Dict[str, Any]] = []
+    after: Optional[str] = None
+    while True:
+        data = storefront_query(CATALOG_QUERY, {"first": CATALOG_PAGE_SIZE, "after": after})
+        products = data.get("products", {})
+        nodes.extend(e["node"] for e in products.get("edges", []))
+        page = products.get("pageInfo") or {}
+        if not page.get("hasNextPage"):
+            return nodes
+        after = page.get("endCursor")
+
+
+class Catalog:
+    def __init__(self, refresh_seconds: float = CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        # 快照整体替换（不原地修改），读路径不用加锁
+        self._items: Optional[List[Product]] = None
+        self._loaded_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 商品列表变化时 version +1 并通知订阅者（例如 answer cache 清空）
+        self.version = 0
+        self._fingerprint: Optional[tuple] = None
+        self._listeners: List[Callable[[], None]] = []
+
+        # Observability
+        self.refresh_count = 0
+        self.refresh_errors = 0
+        self.last_refresh_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ---------- 刷新 ----------
+    def refresh(self) -> bool:
+        """拉一次全量快照；失败时保留旧快照。返回是否成功。"""
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            try:
+                nodes = fetch_all_products()
+            except Exception as e:
+                self.refresh_errors += 1
+                self.last_error = str(e)
+                return False
+            finally:
+                self.last_refresh_ms = (time.perf_counter() - t0) * 1000
+
+            # Product 里预先算好了小写的 title/product_type/tags，匹配时不用每次 lower()
+            items = [product_from_node(node) for node in nodes]
+
+            self._items = items
+            self._loaded_at = time.time()
+            self.refresh_count += 1
+            self.last_error = None
+
+            fingerprint = tuple(p.key() for p in items)
+            if fingerprint != self._fingerprint:
+                self._fingerprint = fingerprint
+                self.version += 1
+                for fn in list(self._listeners):
+                    fn()
+            return True
+
+    def on_change(self, fn: Callable[[], None]):
+        """注册商品列表变化回调（在刷新线程里调用）"""
+        self._listeners.append(fn)
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def start(self):
+        """启动时全量拉一次，然后起后台刷新线程"""
+        self.refresh()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ---------- 查询 ----------
+    def is_ready(self) -> bool:
+        return CATALOG_ENABLED and self._items is not None
+
+    def match(self, keyword: str, first: int = 6) -> List[Product]:
+        """title/product_type/tag 子串匹配（对应 Shopify 的 *keyword*），按 UPDATED_AT 倒序取前 first 个"""
+        kw = (keyword or "").strip().lower()
+        results: List[Product] = []
+        if not kw:
+            return results
+        for p in self._items or []:
+            title, ptype, tags = p.match
+            if kw in title or kw in ptype or any(kw in t for t in tags):
+                results.append(p)
+                if len(results) >= first:
+                    break
+        return results
+
+    def latest(self, first: int = 6) -> List[Product]:
+        return (self._items or [])[:first]
+
+    def snapshot_age_seconds(self) -> Optional[float]:
+        return (time.time() - self._loaded_at) if self._loaded_at else None
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.snapshot_age_seconds()
+        return {
+            "ready": self.is_ready(),
+            "products": len(self._items or []),
+            "version": self.version,
+            "snapshot_age_seconds": round(age, 1) if age is not None else None,
+            "refresh_interval_seconds": self.refresh_seconds,
+            "last_refresh_ms": round(self.last_refresh_ms, 1) if self.last_refresh_ms is not None else None,
+            "refresh_count": self.refresh_count,
+            "refresh_errors": self.refresh_errors,
+            "last_error": self.last_error,
+        }
+
+
+catalog = Catalog()
+
+
+def _or_nan(value: Optional[float]) -> float:
+    return float("nan") if value is None else value
+
+
+CATALOG_SNAPSHOT_AGE_SECONDS.set_function(lambda: _or_nan(catalog.snapshot_age_seconds()))
+CATALOG_REFRESH_DURATION_SECONDS.set_function(
+    lambda: _or_nan(None if catalog.last_refresh_ms is None else catalog.last_refresh_ms / 1000)
+)
@@ -0,0 +1,462 @@
+# ff_agent/checkpointer.py
+"""
+SQLite（WAL）checkpointer，替代 MemorySaver
+
+MemorySaver 把每个 thread 的每一步 checkpoint 都留在进程内存里：只增不减，重启即丢，多 worker 之间也不共享。
+这里换成一个有上限的持久化存储：
+- 一个 SQLite 文件，WAL 模式 + busy_timeout：多进程（多个 uvicorn worker）可以同时读写同一个库
+- 每个 thread 只保留最近 CHECKPOINT_KEEP_PER_THREAD 个 checkpoint（对话只需要最新状态；不用 DeltaChannel）
+- 空闲超过 CHECKPOINT_TTL_SECONDS 的 thread 过期删除
+- thread 数超过 CHECKPOINT_MAX_THREADS 时按最近写入时间做 LRU 淘汰
+- 读写延迟计数，/stats 可见
+
+CHECKPOINT_MODE=turn（默认）：一轮对话（一次 invoke）只在结束时写一次 checkpoint
+（调用方传 durability=CHECKPOINT_DURABILITY，即 LangGraph 的 durability="exit"），
+而且只存跨轮需要的字段（profile、上一轮 intent）；answer / products_debug / actions 等本轮临时字段
+每轮开头由 router 重置，不落盘。CHECKPOINT_MODE=step 是 LangGraph 默认行为：每个节点之后都存一份完整 state。
+
+sqlite3 连接不能跨线程共享，所以每个线程一个连接；async 方法放到线程池里跑。
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Collection, Dict, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", "sqlite")  # sqlite | memory
+CHECKPOINT_MODE = os.getenv("CHECKPOINT_MODE", "turn")  # turn | step
+# 调用方传给 graph.invoke / ainvoke / astream 的 durability：exit = 一轮结束时写一次；async = LangGraph 默认（每步之后）
+CHECKPOINT_DURABILITY = "exit" if CHECKPOINT_MODE == "turn" else "async"
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", str(Path(__file__).resolve().parents[1] / "data" / "checkpoints.sqlite"))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600)))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "10000"))
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))
+CHECKPOINT_SWEEP_SECONDS = float(os.getenv("CHECKPOINT_SWEEP_SECONDS", "60"))
+CHECKPOINT_BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_last_access ON threads(last_access);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class _Timer:
+    """累计次数 / 平均 / 最大耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+def slim_checkpoint(checkpoint: Checkpoint, drop: Collection[str]) -> Checkpoint:
+    """去掉不需要跨轮保存的 channel 值（版本号保留；下一轮读回时这些 channel 为空，由 router 重置）"""
+    if not drop:
+        return checkpoint
+    return {**checkpoint, "channel_values": {
+        k: v for k, v in checkpoint["channel_values"].items() if k not in drop
+    }}
+
+
+class TurnMemorySaver(MemorySaver):
+    """MemorySaver + 去掉本轮临时字段（CHECKPOINTER=memory 且 CHECKPOINT_MODE=turn）"""
+
+    def __init__(self, drop_channels: Collection[str] = ()):
+        super().__init__()
+        self.drop_channels = frozenset(drop_channels)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return super().put(config, slim_checkpoint(checkpoint, self.drop_channels), metadata, new_versions)
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver):
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB,
+        *,
+        ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        keep_per_thread: int = CHECKPOINT_KEEP_PER_THREAD,
+        sweep_seconds: float = CHECKPOINT_SWEEP_SECONDS,
+        drop_channels: Collection[str] = (),
+    ):
+        super().__init__()
+        self.path = path
+        self.drop_channels = frozenset(drop_channels)
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.keep_per_thread = max(1, keep_per_thread)
+        self.sweep_seconds = sweep_seconds
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._new_threads = 0  # 上次清理以来新出现的 thread 数
+
+        # Observability
+        self.reads = _Timer()
+        self.writes = _Timer()
+        self.bytes_written = 0  # 序列化后的 checkpoint + metadata + pending writes
+        self.expired = 0
+        self.evicted = 0
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    # ---------- 连接 ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：事务由这里显式 BEGIN IMMEDIATE 控制，避免多进程写时的锁升级死锁
+            conn = sqlite3.connect(self.path, timeout=CHECKPOINT_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={CHECKPOINT_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL 下 NORMAL 足够：断电最多丢最后几次提交
+            self._local.conn = conn
+        return conn
+
+    def _write_txn(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(conn)
+            conn.execute("COMMIT")
+            return out
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- 读 ----------
+    def _row_to_tuple(self, conn: sqlite3.Connection, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, ctype, cblob, mtype, mblob = row
+        writes = conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=self.serde.loads_typed((ctype, cblob)),
+            metadata=self.serde.loads_typed((mtype, mblob)),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_id,
+                }}
+                if parent_id else None
+            ),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        t0 = time.perf_counter()
+        conf = config["configurable"]
+        thread_id = conf["thread_id"]
+        checkpoint_ns = conf.get("checkpoint_ns", "")
+        cols = "thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        conn = self._conn()
+        if checkpoint_id := get_checkpoint_id(config):
+            row = conn.execute(
+                f"SELECT {cols} FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                f"SELECT {cols} FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns),
+            ).fetchone()
+        try:
+            return self._row_to_tuple(conn, row) if row else None
+        finally:
+            self.reads.add((time.perf_counter() - t0) * 1000)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config is not None:
+            where.append("thread_id=?")
+            params.append(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                where.append("checkpoint_ns=?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id=?")
+                params.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id<?")
+            params.append(before_id)
+
+        sql = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            "FROM checkpoints"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY checkpoint_id DESC"
+        )
+        conn = self._conn()
+        n = 0
+        for row in conn.execute(sql, params).fetchall():
+            tup = self._row_to_tuple(conn, row)
+            if filter and not all(tup.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield tup
+            n += 1
+            if limit is not None and n >= limit:
+                return
+
+    # ---------- 写 ----------
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        t0 = time.perf_counter()
+        conf = config["configurable"]
+        thread_id = conf["thread_id"]
+        checkpoint_ns = conf.get("checkpoint_ns", "")
+        parent_id = conf.get("checkpoint_id")
+        ctype, cblob = self.serde.dumps_typed(slim_checkpoint(checkpoint, self.drop_channels))
+        mtype, mblob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        def txn(conn: sqlite3.Connection) -> bool:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], parent_id, ctype, cblob, mtype, mblob),
+            )
+            # 只留最近 keep_per_thread 个 checkpoint（及其 writes）
+            stale = conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? "
+                "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                (thread_id, checkpoint_ns, self.keep_per_thread),
+            ).fetchall()
+            if stale:
+                ids = [(thread_id, checkpoint_ns, cid) for (cid,) in stale]
+                conn.executemany("DELETE FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=?", ids)
+                conn.executemany("DELETE FROM writes WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=?", ids)
+            is_new = conn.execute(
+                "INSERT OR IGNORE INTO threads VALUES (?, ?)", (thread_id, time.time())
+            ).rowcount == 1
+            if not is_new:
+                conn.execute("UPDATE threads SET last_access=? WHERE thread_id=?", (time.time(), thread_id))
+            return is_new
+
+        is_new = self._write_txn(txn)
+        with self._lock:
+            self._new_threads += is_new
+            self.bytes_written += len(cblob) + len(mblob)
+        self.writes.add((time.perf_counter() - t0) * 1000)
+        self._maybe_sweep()
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        t0 = time.perf_counter()
+        conf = config["configurable"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            vtype, vblob = self.serde.dumps_typed(value)
+            rows.append((
+                conf["thread_id"], conf.get("checkpoint_ns", ""), conf["checkpoint_id"],
+                task_id, WRITES_IDX_MAP.get(channel, idx), channel, vtype, vblob, task_path,
+            ))
+        # 和 MemorySaver 一致：特殊 channel（idx < 0）可覆盖，普通 write 已存在时保留旧值
+        all_special = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        verb = "INSERT OR REPLACE" if all_special else "INSERT OR IGNORE"
+        self._write_txn(lambda conn: conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows))
+        with self._lock:
+            self.bytes_written += sum(len(r[7]) for r in rows)
+        self.writes.add((time.perf_counter() - t0) * 1000)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._write_txn(lambda conn: self._delete_threads(conn, [thread_id]))
+
+    @staticmethod
+    def _delete_threads(conn: sqlite3.Connection, thread_ids: Sequence[str]):
+        rows = [(t,) for t in thread_ids]
+        conn.executemany("DELETE FROM checkpoints WHERE thread_id=?", rows)
+        conn.executemany("DELETE FROM writes WHERE thread_id=?", rows)
+        conn.executemany("DELETE FROM threads WHERE thread_id=?", rows)
+
+    # ---------- 过期 / 淘汰 ----------
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            due = (
+                now - self._last_sweep >= self.sweep_seconds
+                or self._new_threads >= max(1, self.max_threads // 100)
+            )
+            if not due:
+                return
+            self._last_sweep = now
+            self._new_threads = 0
+        self.sweep()
+
+    def sweep(self) -> Dict[str, int]:
+        """删除过期 thread；thread 数仍超上限时按 last_access 淘汰最旧的"""
+        def txn(conn: sqlite3.Connection) -> Dict[str, int]:
+            expired = [t for (t,) in conn.execute(
+                "SELECT thread_id FROM threads WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+            ).fetchall()]
+            self._delete_threads(conn, expired)
+
+            (count,) = conn.execute("SELECT COUNT(*) FROM threads").fetchone()
+            evicted = []
+            if count > self.max_threads:
+                evicted = [t for (t,) in conn.execute(
+                    "SELECT thread_id FROM threads ORDER BY last_access LIMIT ?", (count - self.max_threads,)
+                ).fetchall()]
+                self._delete_threads(conn, evicted)
+            return {"expired": len(expired), "evicted": len(evicted)}
+
+        out = self._write_txn(txn)
+        self.expired += out["expired"]
+        self.evicted += out["evicted"]
+        return out
+
+    # ---------- async：sqlite 调用很短，放到线程池里跑 ----------
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self) -> Dict[str, Any]:
+        (threads,) = self._conn().execute("SELECT COUNT(*) FROM threads").fetchone()
+        return {
+            "backend": "sqlite",
+            "mode": CHECKPOINT_MODE,
+            "path": self.path,
+            "threads": threads,
+            "max_threads": self.max_threads,
+            "ttl_seconds": self.ttl_seconds,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "read": self.reads.stats(),
+            "write": self.writes.stats(),
+            "bytes_written": self.bytes_written,
+        }
+
+
+def make_checkpointer(drop_channels: Collection[str] = ()) -> BaseCheckpointSaver:
+    """
+    CHECKPOINTER=memory 时退回进程内 MemorySaver（本地调试 / 单测）。
+    drop_channels：CHECKPOINT_MODE=turn 时不落盘的本轮临时字段；step 模式下忽略（中途的 checkpoint 要能完整恢复）。
+    """
+    drop = drop_channels if CHECKPOINT_MODE == "turn" else ()
+    if CHECKPOINTER == "memory":
+        return TurnMemorySaver(drop) if drop else MemorySaver()
+    return SQLiteCheckpointer(drop_channels=drop)
+
+
+def checkpointer_stats(saver: BaseCheckpointSaver) -> Dict[str, Any]:
+    if isinstance(saver, SQLiteCheckpointer):
+        return saver.stats()
+    return {"backend": "memory", "mode": CHECKPOINT_MODE}
@@ -0,0 +1,174 @@
+# ff_agent/faq.py
+"""
+policy 问题的预生成回答（不调 LLM）
+
+退换 / 发货 / 物流这类问题最多、也最重复，以前每次都要走 extract_profile + answer 两次 LLM。
+data/faq_answers.json 里是从知识稿生成好的中英文回答（scripts/build_faq_answers.py），
+router 之后如果 intent=policy 且命中置信度够高，直接走 faq_answer 节点结束，不经过任何 LLM 节点。
+
+置信度（0~1）：只命中一个主题 = 1.0，每个扣分项 -0.5：
+- ambiguous：命中多个具体主题（"退货运费谁出"，要 LLM 组合回答）
+- specific：带订单号 / 邮箱等具体信息（要看具体订单）
+- complaint：破损、寄错、没收到、取消等（要共情 + 个别处理）
+- product：同时在问具体商品 / 刻字 / 价格
+- long：消息很长，通常不止一个问题
+- general：只命中泛泛的 policies 总览条目（"warranty policy"、"payment policy" 也会命中，总览答不了），
+  单这一项就低于 FAQ_MIN_CONFIDENCE，交给 LLM
+知识稿改了但没重新生成（source_sha256 对不上）时整张表停用，避免回答和新政策不一致。
+回答 / 按钮里的链接必须原样出现在知识稿里（unknown_urls），否则该条目不加载：不给访客发可能不存在的链接。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ff_agent.faq")
+
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "1") != "0"
+FAQ_MIN_CONFIDENCE = float(os.getenv("FAQ_MIN_CONFIDENCE", "0.8"))
+FAQ_MAX_CHARS = int(os.getenv("FAQ_MAX_CHARS", "160"))
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+FAQ_ANSWERS_PATH = Path(os.getenv("FAQ_ANSWERS_PATH", str(Path(__file__).resolve().parent / "data" / "faq_answers.json")))
+
+# 扣分项：(reason, pattern)
+PENALTIES: List[Tuple[str, re.Pattern]] = [
+    ("specific", re.compile(r"#\s?\d|\d{4,}|\S+@\S+\.\w+|订单号", re.I)),
+    ("complaint", re.compile(
+        r"damaged|broken|wrong|missing|never (arrived|came|received)|not (arrived|received)|hasn'?t (arrived|come)"
+        r"|late\b|cancel|complain|损坏|破损|坏了|发错|寄错|没收到|还没到|取消|投诉",
+        re.I,
+    )),
+    ("product", re.compile(r"\burn|night ?light|keepsake|engrav|personali[sz]|\$\s?\d|骨灰|夜灯|刻字|定制|价格", re.I)),
+]
+
+
+_URL = re.compile(r"https?://[^\s<>\"'()，。）]+")
+
+
+def source_sha256(path: Path) -> Optional[str]:
+    return hashlib.sha256(path.read_bytes()).hexdigest() if path.exists() else None
+
+
+def unknown_urls(entry: Dict[str, Any], source_text: str) -> List[str]:
+    """条目的 url 和回答里出现、但知识稿里没有的链接"""
+    found = _URL.findall(" ".join(str(entry.get(k) or "") for k in ("url", "answer_en", "answer_zh")))
+    known = {u.rstrip(".,;:!?") for u in _URL.findall(source_text)}
+    return [u for u in dict.fromkeys(f.rstrip(".,;:!?") for f in found) if u not in known]
+
+
+class FaqEntry:
+    __slots__ = ("id", "general", "patterns", "answer_en", "answer_zh", "actions")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data["id"]
+        self.general = bool(data.get("general"))
+        self.patterns = [re.compile(p, re.I) for p in data.get("patterns", [])]
+        self.answer_en = data.get("answer_en", "")
+        self.answer_zh = data.get("answer_zh", "")
+        self.actions = []
+        if data.get("url"):
+            self.actions.append({"type": "open_page", "label": data.get("label") or "Learn more", "url": data["url"]})
+
+    def hit(self, text: str) -> bool:
+        return any(p.search(text) for p in self.patterns)
+
+
+class FaqTable:
+    def __init__(self, entries: List[FaqEntry], stale: bool = False):
+        self.entries = entries
+        self.by_id = {e.id: e for e in entries}
+        self.stale = stale
+        self._lock = threading.Lock()
+
+        # Observability
+        self.lookups = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    @classmethod
+    def from_file(cls, path: Path = FAQ_ANSWERS_PATH) -> "FaqTable":
+        if not path.exists():
+            return cls([], stale=True)
+        data = json.loads(path.read_text(encoding="utf-8"))
+        source = PROJECT_ROOT / data.get("source", "")
+        source_text = source.read_text(encoding="utf-8") if source.is_file() else ""
+        entries = []
+        for e in data.get("entries", []):
+            if not (e.get("answer_en") and e.get("answer_zh")):
+                continue
+            bad = unknown_urls(e, source_text)
+            if bad:
+                logger.warning("FAQ entry %r links to %s, which is not in %s; entry skipped",
+                               e.get("id"), bad, data.get("source"))
+                continue
+            entries.append(FaqEntry(e))
+        stale = data.get("source_sha256") != source_sha256(source)
+        if stale:
+            logger.warning("%s was built from an older %s; FAQ fast path disabled until "
+                           "scripts/build_faq_answers.py is re-run", path.name, data.get("source"))
+        return cls(entries, stale=stale)
+
+    @property
+    def active(self) -> bool:
+        return FAQ_ENABLED and not self.stale and bool(self.entries)
+
+    # ---------- 匹配 ----------
+    def match(self, message: str) -> Tuple[Optional[FaqEntry], float, List[str]]:
+        """返回 (最佳条目, 置信度, 扣分原因)；没命中任何主题时条目为 None"""
+        text = (message or "").strip()
+        topics = [e for e in self.entries if e.hit(text)]
+        if not topics:
+            return None, 0.0, ["no_topic"]
+        # "return policy" 同时命中 returns 和泛泛的 policies：以具体主题为准
+        specific = [e for e in topics if not e.general]
+        reasons = [reason for reason, pat in PENALTIES if pat.search(text)]
+        if not specific:
+            reasons.append("general")
+        topics = specific or topics
+        if len(topics) > 1:
+            reasons.append("ambiguous")
+        if len(text) > FAQ_MAX_CHARS:
+            reasons.append("long")
+        confidence = 1.0 - 0.5 * len(reasons)
+        if "general" in reasons:
+            confidence = min(confidence, FAQ_MIN_CONFIDENCE / 2)
+        return topics[0], max(0.0, confidence), reasons
+
+    def lookup(self, intent: str, message: str) -> Optional[str]:
+        """policy 轮次的快速路径：置信度够高时返回条目 id，否则 None（照常走 LLM）"""
+        if intent != "policy" or not self.active:
+            return None
+        entry, confidence, reasons = self.match(message)
+        with self._lock:
+            self.lookups += 1
+            if entry is not None and confidence >= FAQ_MIN_CONFIDENCE:
+                self.hits[entry.id] = self.hits.get(entry.id, 0) + 1
+                return entry.id
+            for reason in reasons:
+                self.misses[reason] = self.misses.get(reason, 0) + 1
+        return None
+
+    def answer(self, entry_id: str, chinese: bool) -> Tuple[str, List[Dict[str, Any]]]:
+        entry = self.by_id[entry_id]
+        return (entry.answer_zh if chinese else entry.answer_en), [dict(a) for a in entry.actions]
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        return {
+            "enabled": self.active,
+            "stale": self.stale,
+            "entries": len(self.entries),
+            "min_confidence": FAQ_MIN_CONFIDENCE,
+            "policy_turns": self.lookups,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": round(hits / self.lookups, 3) if self.lookups else None,
+        }
+
+
+faq_table = FaqTable.from_file()
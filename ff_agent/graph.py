@@ -1,13 +1,35 @@
 # ff_agent/graph.py
+import functools
 import json
+import os
 import re
-from typing import TypedDict, Dict, Any, List, Literal, Optional
+import threading
+import time
+from decimal import ROUND_FLOOR
+from typing import Callable, TypedDict, Dict, Any, List, Literal, Optional
 
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
-
-from ff_agent.shopify_storefront import search_products
+from langchain_core.runnables import RunnableLambda
+
+from ff_agent import llm_gateway, request_timings
+from ff_agent.checkpointer import make_checkpointer
+from ff_agent.knowledge import KnowledgeIndex
+from ff_agent.metrics import FAQ_LOOKUPS, INTENTS, LLM_DEGRADED, NODE_SECONDS
+from ff_agent.faq import faq_table
+from ff_agent.intent_router import intent_router
+from ff_agent.products import Product, to_cents
+from ff_agent.answer_cache import ANSWER_CACHE_ENABLED, answer_cache, answer_cache_key
+from ff_agent.shopify_storefront import search_products_with_latest, asearch_products_with_latest
+from ff_agent.profile_rules import (
+    RULE_CONFIDENT,
+    RULE_MIN_CONFIDENCE,
+    extract_profile_rules,
+    has_real_content,
+    missing_required,
+    profile_confidence,
+    record_profile_turn,
+)
 
 # =========================
 # 固定商品 URL（当前只有两个产品时最实用）
@@ -28,75 +50,111 @@ class GraphState(TypedDict):
 
     # Debug / Observability
     products_debug: List[Dict[str, Any]]
+    # 和 products_debug 一一对应的 Product.price_cents（answer cache 判断预算划分用，不再解析 "47.0 USD"）
+    products_price_cents: List[Optional[int]]
     tool_error: Optional[str]
 
     # Frontend actions
     actions: List[Dict[str, Any]]
 
+    # 和 extract_profile 并行的投机商品搜索：{"search_kw": ..., "rows": [Product.to_row()]}
+    prefetch: Optional[Dict[str, Any]]
+
+    # policy 问题命中预生成 FAQ 回答时的条目 id（本轮直接 faq_answer，不走 LLM 节点）
+    faq_id: Optional[str]
+
+
+# 跨轮保留的字段只有 profile 和上一轮 intent；其余都是本轮临时值：
+# 每轮开头由 router 重置（上一轮的 actions / products_debug 不能带进新的一轮），CHECKPOINT_MODE=turn 时也不落盘
+PERSISTED_FIELDS = ("profile", "intent")
+TRANSIENT_FIELDS = tuple(k for k in GraphState.__annotations__ if k not in PERSISTED_FIELDS)
+
+
+def _reset_turn_fields(state: GraphState) -> None:
+    state["answer"] = ""
+    state["needs_clarification"] = False
+    state["clarification_question"] = ""
+    state["products_debug"] = []
+    state["products_price_cents"] = []
+    state["tool_error"] = None
+    state["actions"] = []
+    state["prefetch"] = None
+    state["faq_id"] = None
+
 
 # =========================
 # 2) Router：识别意图
 # =========================
 def route_intent(state: GraphState) -> GraphState:
-    msg_raw = state["user_message"]
-    msg_lower = msg_raw.lower()
-
-    # English routing
-    if any(k in msg_lower for k in ["shipping", "return", "refund", "policy", "exchange", "warranty"]):
-        state["intent"] = "policy"
-    elif any(k in msg_lower for k in ["custom", "personal", "engrave", "engraving", "text", "wording", "message"]):
-        state["intent"] = "customization"
-    elif any(k in msg_lower for k in ["price", "size", "material", "order", "product", "box", "recommend", "suggest", "gift"]):
-        state["intent"] = "product"
-    else:
-        # Chinese lightweight routing
-        if any(k in msg_raw for k in ["运费", "退换", "退款", "政策", "质保"]):
-            state["intent"] = "policy"
-        elif any(k in msg_raw for k in ["定制", "刻字", "文字", "个性化"]):
-            state["intent"] = "customization"
-        elif any(k in msg_raw for k in ["推荐", "送人", "礼物", "价格", "尺寸", "材质", "下单", "产品", "盒子"]):
-            state["intent"] = "product"
-        else:
-            state["intent"] = "other"
+    # 中英文关键词表都在 data/intent_rules.json，一个自动机一遍扫描
+    state["intent"] = intent_router.route(state["user_message"])
+    INTENTS.labels(state["intent"]).inc()
 
     state.setdefault("profile", {})
-    # Always init these to avoid missing fields downstream
-    state.setdefault("products_debug", [])
-    state.setdefault("tool_error", None)
-    state.setdefault("actions", [])
-    state.setdefault("answer", "")
-    state.setdefault("needs_clarification", False)
-    state.setdefault("clarification_question", "")
+    _reset_turn_fields(state)
+
+    # 高置信度的 policy 问题：本轮直接用预生成回答
+    state["faq_id"] = faq_table.lookup(state["intent"], state["user_message"])
+    if state["intent"] == "policy":
+        FAQ_LOOKUPS.labels(state["faq_id"] or "miss").inc()
+        timings = request_timings.current()
+        if timings:
+            timings.cache_result("faq", "hit" if state["faq_id"] else "miss")
+
+    return state
+
 
+def faq_answer(state: GraphState) -> GraphState:
+    """预生成的中英文 policy 回答（data/faq_answers.json），跳过 extract_profile / answer 的两次 LLM"""
+    answer, actions = faq_table.answer(state["faq_id"], is_chinese(state["user_message"]))
+    state["answer"] = answer
+    state["actions"] = actions + [{
+        "type": "open_collection",
+        "label": "Browse all products",
+        "url": "https://foreverfurever.org/collections/all"
+    }]
+    state["products_debug"] = []
+    state["products_price_cents"] = []
+    state["tool_error"] = None
+    state["needs_clarification"] = False
+    state["clarification_question"] = ""
     return state
 
 
 # =========================
 # 3) Extract profile
 # =========================
-def extract_profile(state: GraphState) -> GraphState:
-    state.setdefault("profile", {})
+def _apply_profile_rules(state: GraphState) -> bool:
+    """
+    ✅ 规则优先：先用确定性规则抽 budget/occasion/deadline/engraving。
+    缺的字段直接填；已有的字段只在规则很确定（>= RULE_CONFIDENT）时才覆盖。
+    返回是否还需要 LLM：消息有实际内容（#choice 清空后的空消息不算），并且
+    intent 需要的字段仍缺失，或规则命中了但整体置信度不够（让 LLM 判断是不是在改已有的值）。
+    """
     msg = state["user_message"]
     profile = state["profile"]
 
-    # ---------- ✅ 规则兜底：先稳定抽 budget ----------
-    import re
-    m = re.search(r"(under|below|less than)\s*\$?\s*(\d+(\.\d+)?)", msg.lower())
-    if m and not profile.get("budget"):
-        profile["budget"] = f"under ${m.group(2)}"
-
-    m2 = re.search(r"\$\s*(\d+(\.\d+)?)", msg)
-    if m2 and not profile.get("budget"):
-        profile["budget"] = f"${m2.group(1)}"
-
-    m3 = re.search(r"\b(\d+(\.\d+)?)\b", msg)
-    if ("budget" in msg.lower() or "under" in msg.lower() or "below" in msg.lower()) and m3 and not profile.get("budget"):
-        profile["budget"] = f"under ${m3.group(1)}"
+    fields, confidence = extract_profile_rules(msg)
+    kept_existing = 0
+    for k, v in fields.items():
+        if confidence[k] < RULE_MIN_CONFIDENCE:
+            continue
+        if profile.get(k) and profile[k] != v and confidence[k] < RULE_CONFIDENT:
+            kept_existing += 1
+            continue
+        profile[k] = v
+
+    score = profile_confidence(confidence)
+    low_confidence = bool(confidence) and score < RULE_CONFIDENT
+    need_llm = has_real_content(msg) and (
+        low_confidence or bool(missing_required(state.get("intent", "other"), profile))
+    )
+    record_profile_turn(need_llm, score, low_confidence and need_llm, kept_existing)
+    return need_llm
 
-    # ---------- 原来的 LLM 抽取（保留） ----------
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
-    prompt = (
+def _profile_prompt(msg: str) -> str:
+    return (
         "Extract shopping preferences from the user's message.\n"
         "Return ONLY valid JSON with these keys (use null if unknown):\n"
         "{"
@@ -110,8 +168,8 @@ def extract_profile(state: GraphState) -> GraphState:
         f"User message:\n{msg}"
     )
 
-    resp = llm.invoke(prompt).content
 
+def _merge_extracted(profile: Dict[str, Any], resp: str) -> None:
     try:
         extracted = json.loads(resp)
         for k, v in extracted.items():
@@ -120,8 +178,40 @@ def extract_profile(state: GraphState) -> GraphState:
     except Exception:
         pass
 
-    state["profile"] = profile
-    return state
+
+def extract_profile(state: GraphState) -> Dict[str, Any]:
+    state.setdefault("profile", {})
+    msg = state["user_message"]
+    profile = state["profile"]
+
+    # ---------- LLM 抽取：只在规则不够时调用 ----------
+    if _apply_profile_rules(state):
+        try:
+            resp = llm_gateway.invoke(_profile_prompt(msg), temperature=0).content
+        except llm_gateway.LLMUnavailable:
+            # LLM 限流 / 不可用：只用规则抽到的字段，缺的交给 check_clarify 追问
+            LLM_DEGRADED.labels("extract_profile").inc()
+        else:
+            _merge_extracted(profile, resp)
+
+    # 和 prefetch 并行：只返回自己改的 key，避免同一 step 里重复写其他 channel
+    return {"profile": profile}
+
+
+async def aextract_profile(state: GraphState) -> Dict[str, Any]:
+    state.setdefault("profile", {})
+    msg = state["user_message"]
+    profile = state["profile"]
+
+    if _apply_profile_rules(state):
+        try:
+            resp = (await llm_gateway.ainvoke(_profile_prompt(msg), temperature=0)).content
+        except llm_gateway.LLMUnavailable:
+            LLM_DEGRADED.labels("extract_profile").inc()
+        else:
+            _merge_extracted(profile, resp)
+
+    return {"profile": profile}
 
 def apply_choice(state: GraphState) -> GraphState:
     msg = (state.get("user_message") or "").strip().lower()
@@ -137,6 +227,25 @@ def apply_choice(state: GraphState) -> GraphState:
         state["user_message"] = ""
 
     return state
+# =========================
+# Helpers: language
+# =========================
+def is_chinese(text: str) -> bool:
+    return any('\u4e00' <= ch <= '\u9fff' for ch in text or "")
+
+
+# =========================
+# Helpers: streaming progress
+# =========================
+def emit_progress(payload: Dict[str, Any]) -> None:
+    """graph.astream(stream_mode="custom") 时推送进度事件；其他情况下是 no-op"""
+    try:
+        get_stream_writer()(payload)
+    except RuntimeError:
+        # 不在 graph 运行上下文里（例如脚本里直接调用节点函数）
+        pass
+
+
 # =========================
 # Helpers: budget parsing + filtering
 # =========================
@@ -154,33 +263,22 @@ def parse_budget_usd(budget_value: Any) -> Optional[float]:
         return None
 
 
-def _price_amount(p: Dict[str, Any]) -> Optional[float]:
-    """p['price'] like '47.00 USD'"""
-    try:
-        return float(str(p.get("price", "")).split()[0])
-    except Exception:
-        return None
-
-
 def filter_products_by_budget(
-    products: List[Dict[str, Any]],
+    products: List[Product],
     max_usd: Optional[float]
-) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    """Return (within_budget, over_budget)"""
+) -> tuple[List[Product], List[Product]]:
+    """
+    Return (within_budget, over_budget)：within 保持搜索顺序（价格未知的算预算内，宁可多给也不丢）；
+    over 按价格升序（第一个是预算以上最近的）。列表只有几个商品，线性扫一遍就够，不建索引
+    """
     if not max_usd:
         return products, []
 
-    ok: List[Dict[str, Any]] = []
-    over: List[Dict[str, Any]] = []
-    for p in products:
-        amt = _price_amount(p)
-        if amt is None:
-            ok.append(p)  # keep unknown price rather than dropping
-        elif amt <= max_usd:
-            ok.append(p)
-        else:
-            over.append(p)
-    return ok, over
+    limit = to_cents(max_usd, ROUND_FLOOR)
+    within = [p for p in products if p.price_cents is None or p.price_cents <= limit]
+    over = sorted((p for p in products if p.price_cents is not None and p.price_cents > limit),
+                  key=lambda p: p.price_cents)
+    return within, over
 
 
 # =========================
@@ -218,41 +316,39 @@ def needs_clarification(state: GraphState) -> GraphState:
 # =========================
 # 5) Clarify Node
 # =========================
-def clarify_node(state: GraphState, system_prompt: str) -> GraphState:
-    user_msg = state["user_message"]
+def _guided_occasion_question(state: GraphState) -> bool:
+    """
+    ✅ 4.2：导购分流（Gift vs Personal keepsake）
+    条件：用户提到了预算，但 profile 里还没有 occasion。命中则直接写好 state 并返回 True。
+    """
     profile = state.get("profile", {}) or {}
+    if not (profile.get("budget") and not profile.get("occasion")):
+        return False
 
     # 简单判断语言：用户包含中文就用中文追问
-    is_cn = any('\u4e00' <= ch <= '\u9fff' for ch in user_msg)
-
-    # ✅ 4.2：导购分流（Gift vs Personal keepsake）
-    # 条件：用户提到了预算，但 profile 里还没有 occasion
-    if profile.get("budget") and not profile.get("occasion"):
-        state["needs_clarification"] = True
-
-        if is_cn:
-            state["clarification_question"] = "这是送礼（Gift）还是给自己留作纪念（Personal keepsake）呢？"
-            state["actions"] = [
-                {"type": "reply", "label": "🎁 送礼 Gift", "value": "It's a gift."},
-                {"type": "reply", "label": "🐾 自用纪念 Personal keepsake", "value": "For myself / personal keepsake."},
-            ]
-        else:
-            state["clarification_question"] = "Is this for a gift, or for your own keepsake?"
-            state["actions"] = [
-                {"type": "reply", "label": "🎁 Gift", "value": "It's a gift."},
-                {"type": "reply", "label": "🐾 Personal keepsake", "value": "For myself / personal keepsake."},
-            ]
+    is_cn = is_chinese(state["user_message"])
+    state["needs_clarification"] = True
+
+    if is_cn:
+        state["clarification_question"] = "这是送礼（Gift）还是给自己留作纪念（Personal keepsake）呢？"
+        state["actions"] = [
+            {"type": "reply", "label": "🎁 送礼 Gift", "value": "It's a gift."},
+            {"type": "reply", "label": "🐾 自用纪念 Personal keepsake", "value": "For myself / personal keepsake."},
+        ]
+    else:
+        state["clarification_question"] = "Is this for a gift, or for your own keepsake?"
+        state["actions"] = [
+            {"type": "reply", "label": "🎁 Gift", "value": "It's a gift."},
+            {"type": "reply", "label": "🐾 Personal keepsake", "value": "For myself / personal keepsake."},
+        ]
 
-        state["answer"] = ""
-        return state
+    state["answer"] = ""
+    return True
 
-    # ---------------------------
-    # 原来的 LLM 追问（保留兜底）
-    # ---------------------------
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
 
-    intent = state["intent"]
-    prompt = (
+def _clarify_prompt(state: GraphState, system_prompt: str) -> str:
+    profile = state.get("profile", {}) or {}
+    return (
         f"{system_prompt}\n\n"
         "Task: Ask concise clarification question(s) only.\n"
         "Rules:\n"
@@ -262,78 +358,266 @@ def clarify_node(state: GraphState, system_prompt: str) -> GraphState:
         "- Do NOT answer the user yet.\n"
         "- Ask ONLY for missing critical info based on the profile.\n\n"
         f"Known user profile (may be incomplete): {profile}\n"
-        f"User intent: {intent}\n"
-        f"User message: {user_msg}\n\n"
+        f"User intent: {state['intent']}\n"
+        f"User message: {state['user_message']}\n\n"
         "Output ONLY the question(s)."
     )
 
-    resp = llm.invoke(prompt)
-    state["clarification_question"] = resp.content
+
+def _finish_clarify(state: GraphState, question: str) -> GraphState:
+    state["clarification_question"] = question
     state["answer"] = ""
     state["actions"] = [
         {"type": "set_profile", "label": "🎁 Gift", "patch": {"occasion": "gift"}},
         {"type": "set_profile", "label": "🐾 Personal keepsake", "patch": {"occasion": "self"}},
     ]
-
     return state
 
+
+def _fallback_question(state: GraphState) -> str:
+    """LLM 限流 / 不可用时的固定追问"""
+    if is_chinese(state["user_message"]):
+        return "可以多告诉我一些吗？比如想找哪类纪念品、预算大概多少，以及是送礼还是自己留作纪念？"
+    return ("Could you tell me a little more: what kind of memorial item you have in mind, "
+            "your budget, and whether it's a gift or for yourself?")
+
+
+def clarify_node(state: GraphState, system_prompt: str) -> GraphState:
+    _drop_prefetch(state)
+    if _guided_occasion_question(state):
+        return state
+
+    # ---------------------------
+    # 原来的 LLM 追问（保留兜底）
+    # ---------------------------
+    try:
+        question = llm_gateway.invoke(_clarify_prompt(state, system_prompt), temperature=0.3).content
+    except llm_gateway.LLMUnavailable:
+        LLM_DEGRADED.labels("clarify_node").inc()
+        question = _fallback_question(state)
+    return _finish_clarify(state, question)
+
+
+async def aclarify_node(state: GraphState, system_prompt: str) -> GraphState:
+    _drop_prefetch(state)
+    if _guided_occasion_question(state):
+        return state
+
+    try:
+        question = (await llm_gateway.ainvoke(_clarify_prompt(state, system_prompt), temperature=0.3)).content
+    except llm_gateway.LLMUnavailable:
+        LLM_DEGRADED.labels("clarify_node").inc()
+        question = _fallback_question(state)
+    return _finish_clarify(state, question)
+
 # =========================
 # 6) Answer Node
 # =========================
-def answer_node(state: GraphState, system_prompt: str) -> GraphState:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.4)
+def _answer_search_kw(state: GraphState) -> Optional[str]:
+    """
+    Step 1: keyword strategy
+    返回 None 表示这个 intent 不查 Shopify；"" 表示没有明确品类（兜底最新商品）
+    """
+    # We only call Shopify for these intents
+    if state["intent"] not in ["product", "other", "customization"]:
+        return None
 
-    intent = state["intent"]
-    user_msg = state["user_message"]
     profile = state.get("profile", {})
+    text = (state["user_message"] + " " + json.dumps(profile, ensure_ascii=False)).lower()
 
-    # --- Step 1: keyword strategy ---
-    products: List[Dict[str, Any]] = []
-    state["tool_error"] = None
+    if any(k in text for k in ["ash", "ashes", "urn", "memorial", "tribute"]):
+        return "memorial"
+    if any(k in text for k in ["engrave", "engraving", "custom", "personal", "personalize", "text", "message"]):
+        return "personalized"
+    # no clear category => use empty query => fallback latest
+    return ""
 
-    # We only call Shopify for these intents
-    if intent in ["product", "other", "customization"]:
-        text = (user_msg + " " + json.dumps(profile, ensure_ascii=False)).lower()
 
-        if any(k in text for k in ["ash", "ashes", "urn", "memorial", "tribute"]):
-            search_kw = "memorial"
-        elif any(k in text for k in ["engrave", "engraving", "custom", "personal", "personalize", "text", "message"]):
-            search_kw = "personalized"
-        else:
-            # no clear category => use empty query => fallback latest
-            search_kw = ""
+# =========================
+# 6a) 投机商品搜索（和 extract_profile 并行）
+# =========================
+# 搜索关键词大多已经在原始消息里：extract_profile 等 LLM 的同时先把商品搜出来。
+# answer 时如果最终 profile 算出的关键词变了，投机结果作废，重新搜。
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") != "0"
+PREFETCH_STATS = {"started": 0, "used": 0, "discarded": 0, "unused": 0}
+_prefetch_stats_lock = threading.Lock()  # sync graph 的并行分支（prefetch / extract_profile）跑在不同线程
+
+
+def _count_prefetch(outcome: str) -> None:
+    with _prefetch_stats_lock:
+        PREFETCH_STATS[outcome] += 1
+
+
+def _speculative_search_kw(state: GraphState) -> Optional[str]:
+    # extract_profile 可能同时在原地改 profile：先拷一份再算
+    return _answer_search_kw({**state, "profile": dict(state.get("profile") or {})})
+
+
+LATEST_FALLBACK_N = 12  # 和 keyword 搜索同一个请求取回的最新商品数（搜不到 / 预算内没有时兜底）
+
+
+def _search_first(search_kw: str) -> int:
+    return 12 if search_kw == "" else 6
+
+
+def prefetch_products(state: GraphState) -> Dict[str, Any]:
+    search_kw = _speculative_search_kw(state) if PREFETCH_ENABLED else None
+    if search_kw is None:
+        return {"prefetch": None}
+    _count_prefetch("started")
+    try:
+        matches, latest = search_products_with_latest(search_kw, first=_search_first(search_kw), latest=LATEST_FALLBACK_N)
+    except Exception:
+        return {"prefetch": None}  # answer 时正常搜索（并记录错误）
+    return {"prefetch": _prefetch_value(search_kw, matches, latest)}
+
+
+async def aprefetch_products(state: GraphState) -> Dict[str, Any]:
+    search_kw = _speculative_search_kw(state) if PREFETCH_ENABLED else None
+    if search_kw is None:
+        return {"prefetch": None}
+    _count_prefetch("started")
+    try:
+        matches, latest = await asearch_products_with_latest(
+            search_kw, first=_search_first(search_kw), latest=LATEST_FALLBACK_N
+        )
+    except Exception:
+        return {"prefetch": None}
+    return {"prefetch": _prefetch_value(search_kw, matches, latest)}
+
+
+def _prefetch_value(search_kw: str, matches: List[Product], latest: List[Product]) -> Dict[str, Any]:
+    return {
+        "search_kw": search_kw,
+        "matches": [p.to_row() for p in matches],
+        "latest": [p.to_row() for p in latest],
+    }
+
+
+def _take_prefetch(state: GraphState, search_kw: Optional[str]) -> Optional[tuple[List[Product], List[Product]]]:
+    """关键词和投机搜索一致时返回投机结果 (matches, latest)；否则作废。state 里的 prefetch 用完即清（不留到下一轮）"""
+    prefetch = state.get("prefetch")
+    state["prefetch"] = None
+    if not prefetch:
+        return None
+    outcome = "unused" if search_kw is None else "discarded" if prefetch["search_kw"] != search_kw else "used"
+    _count_prefetch(outcome)
+    timings = request_timings.current()
+    if timings:
+        timings.cache_result("prefetch", outcome)
+    if outcome != "used":
+        return None
+    return (
+        [Product.from_row(r) for r in prefetch["matches"]],
+        [Product.from_row(r) for r in prefetch["latest"]],
+    )
+
+
+def _drop_prefetch(state: GraphState) -> None:
+    """这一轮没走到商品搜索（追问 / answer cache 命中）：投机结果没用上"""
+    if state.get("prefetch"):
+        _count_prefetch("unused")
+    state["prefetch"] = None
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    with _prefetch_stats_lock:
+        counts = dict(PREFETCH_STATS)
+    started = counts["started"]
+    return {
+        "enabled": PREFETCH_ENABLED,
+        **counts,
+        "use_rate": round(counts["used"] / started, 3) if started else None,
+    }
+
+
+def _needs_search(search_kw: Optional[str], max_budget: Optional[float]) -> bool:
+    # 不查 Shopify 的 intent 如果带了预算，仍然要用最新商品做预算兜底
+    return search_kw is not None or bool(max_budget)
+
+
+def _pick_products(
+    state: GraphState,
+    search_kw: Optional[str],
+    matches: List[Product],
+    latest: List[Product],
+    max_budget: Optional[float],
+) -> None:
+    """Step 2：在一次请求取回的 (keyword 结果, 最新 N 个) 里本地挑选 + 预算过滤"""
+    products: List[Product] = []
+    if search_kw is not None:
+        # keyword 搜不到就兜底最新商品
+        products = matches or latest[:_search_first(search_kw)]
+    products_in_budget, products_over_budget = filter_products_by_budget(products, max_budget)
+
+    # If user has a budget but budget list empty, fall back to the latest products
+    if max_budget and len(products_in_budget) == 0:
+        products_in_budget, products_over_budget = filter_products_by_budget(latest, max_budget)
+
+    _set_products_for_llm(state, products_in_budget, products_over_budget)
+
 
+def _gather_products(state: GraphState) -> Optional[float]:
+    """
+    Step 1 + 2：查 Shopify（最多一个请求，可能已被 prefetch 取回）+ 预算过滤，结果写入 products_debug；
+    返回解析出的预算
+    """
+    state["tool_error"] = None
+    search_kw = _answer_search_kw(state)
+    max_budget = parse_budget_usd(state.get("profile", {}).get("budget"))
+
+    found = _take_prefetch(state, search_kw)
+    if found is None and _needs_search(search_kw, max_budget):
         try:
-            products = search_products(search_kw, first=12 if search_kw == "" else 6)
+            kw = search_kw or ""
+            found = search_products_with_latest(kw, first=_search_first(kw), latest=LATEST_FALLBACK_N)
         except Exception as e:
-            products = []
             state["tool_error"] = str(e)
 
-    # --- Step 2: budget filtering ---
-    max_budget = parse_budget_usd(profile.get("budget"))
-    products_in_budget, products_over_budget = filter_products_by_budget(products, max_budget)
+    matches, latest = found or ([], [])
+    _pick_products(state, search_kw, matches, latest, max_budget)
+    return max_budget
 
-    # If user has a budget but budget list empty, do another safe fallback query
-    if max_budget and len(products_in_budget) == 0:
+
+async def _agather_products(state: GraphState) -> Optional[float]:
+    state["tool_error"] = None
+    search_kw = _answer_search_kw(state)
+    max_budget = parse_budget_usd(state.get("profile", {}).get("budget"))
+
+    found = _take_prefetch(state, search_kw)
+    if found is None and _needs_search(search_kw, max_budget):
         try:
-            products_fallback = search_products("", first=12)
-            products_in_budget, products_over_budget = filter_products_by_budget(products_fallback, max_budget)
-            products = products_fallback
+            kw = search_kw or ""
+            found = await asearch_products_with_latest(kw, first=_search_first(kw), latest=LATEST_FALLBACK_N)
         except Exception as e:
-            # keep original products empty, record error
-            state["tool_error"] = state["tool_error"] or str(e)
+            state["tool_error"] = str(e)
 
-    # LLM sees: within budget first, plus at most 1 over-budget alternative
-    products_for_llm = (products_in_budget[:3] + products_over_budget[:1]) if (products_in_budget or products_over_budget) else []
-    state["products_debug"] = products_for_llm
+    matches, latest = found or ([], [])
+    _pick_products(state, search_kw, matches, latest, max_budget)
+    return max_budget
+
+
+def _set_products_for_llm(state: GraphState, products_in_budget: List[Product], products_over_budget: List[Product]) -> None:
+    # LLM sees: within budget first, plus at most 1 over-budget alternative (the nearest above budget)
+    products_for_llm = products_in_budget[:3] + products_over_budget[:1]
+    # API 边界：products_debug / prompt 用对外的 dict 形状
+    state["products_debug"] = [p.to_dict() for p in products_for_llm]
+    state["products_price_cents"] = [p.price_cents for p in products_for_llm]
+    emit_progress({
+        "stage": "products",
+        "count": len(products_for_llm),
+        "titles": [p.title for p in products_for_llm],
+    })
 
-    # --- Step 3: prompt ---
-    prompt = (
+
+def _answer_prompt(state: GraphState, system_prompt: str, max_budget: Optional[float]) -> str:
+    """Step 3: prompt"""
+    return (
         f"{system_prompt}\n\n"
-        f"User intent: {intent}\n"
-        f"User message: {user_msg}\n"
-        f"Known user profile: {profile}\n\n"
-        f"Shopify products (ground truth, budget-filtered): {products_for_llm}\n"
+        f"User intent: {state['intent']}\n"
+        f"User message: {state['user_message']}\n"
+        f"Known user profile: {state.get('profile', {})}\n\n"
+        f"Shopify products (ground truth, budget-filtered): {state['products_debug']}\n"
         f"User budget parsed (USD): {max_budget}\n\n"
         "STRICT RULES (must follow):\n"
         "1) If Shopify products list is NOT empty, recommend ONLY from that list.\n"
@@ -350,15 +634,14 @@ def answer_node(state: GraphState, system_prompt: str) -> GraphState:
         "Respond accordingly."
     )
 
-    resp = llm.invoke(prompt)
-    state["answer"] = resp.content
 
-    # --- Step 4: actions (3.9.5) ---
+def _answer_actions(state: GraphState) -> GraphState:
+    """Step 4: actions (3.9.5)"""
     if state.get("actions"):
         return state
     actions: List[Dict[str, Any]] = []
     content_lc = (state.get("answer") or "").lower()
-    user_lc = (user_msg or "").lower()
+    user_lc = (state["user_message"] or "").lower()
 
     # detect binary choice either from model output or user message
     needs_choice = (
@@ -393,23 +676,220 @@ def answer_node(state: GraphState, system_prompt: str) -> GraphState:
     return state
 
 
+def _answer_cache_key(state: GraphState) -> Optional[tuple]:
+    """
+    Step 0: answer cache key（None = 不走缓存）
+    带刻字内容的对话不缓存：回答会引用具体刻字，不能复用给别的访客。
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    profile = state.get("profile", {}) or {}
+    if profile.get("engraving_text") or extract_profile_rules(state["user_message"])[0].get("engraving_text"):
+        answer_cache.bypass()
+        return None
+    key = answer_cache_key(
+        state["intent"],
+        _answer_search_kw(state),
+        parse_budget_usd(profile.get("budget")),
+        profile.get("occasion"),
+        is_chinese(state["user_message"]),
+        state["user_message"],
+    )
+    if key is None:
+        answer_cache.bypass()
+    return key
+
+
+def _budget_cents(state: GraphState) -> Optional[int]:
+    return to_cents(parse_budget_usd((state.get("profile", {}) or {}).get("budget")), ROUND_FLOOR)
+
+
+def _same_budget_split(state: GraphState) -> Callable[[Dict[str, Any]], bool]:
+    """
+    预算是按档位进 key 的：只有当缓存里的商品按本次预算划分"预算内 / 预算外"和生成时一样
+    （没有商品价格落在两个预算之间）才能复用
+    """
+    now = _budget_cents(state)
+
+    def valid(cached: Dict[str, Any]) -> bool:
+        then = cached.get("budget_cents")
+        if now == then:
+            return True
+        if now is None or then is None:
+            return False
+        low, high = min(now, then), max(now, then)
+        return not any(c is not None and low < c <= high for c in cached["price_cents"])
+
+    return valid
+
+
+def _answer_from_cache(state: GraphState, key: Optional[tuple]) -> bool:
+    cached = answer_cache.get(key, _same_budget_split(state)) if key else None
+    timings = request_timings.current()
+    if timings:
+        timings.cache_result("answer_cache", "bypass" if not key else "miss" if cached is None else "hit")
+    if cached is None:
+        return False
+    _drop_prefetch(state)
+    state["answer"] = cached["answer"]
+    state["products_debug"] = [dict(p) for p in cached["products_debug"]]
+    state["products_price_cents"] = list(cached["price_cents"])
+    state["tool_error"] = None
+    return True
+
+
+def _store_answer(state: GraphState, key: Optional[tuple], t0: float) -> None:
+    # Shopify 出错时的回答不缓存
+    if key and not state.get("tool_error"):
+        answer_cache.set(
+            key,
+            {"answer": state["answer"], "products_debug": [dict(p) for p in state["products_debug"]],
+             "price_cents": list(state.get("products_price_cents") or []), "budget_cents": _budget_cents(state)},
+            cost_ms=(time.perf_counter() - t0) * 1000,
+        )
+
+
+def _fallback_answer(state: GraphState, err: Exception) -> str:
+    """
+    LLM 限流 / 不可用时的模板回答：已经查到的商品照样列出来（标题 / 价格 / 链接都来自 Shopify，不会编造）。
+    tool_error 记下原因：这种回答不进 answer cache。
+    """
+    LLM_DEGRADED.labels("answer_node").inc()
+    state["tool_error"] = f"LLM unavailable: {err}"
+    cn = is_chinese(state["user_message"])
+    products = state.get("products_debug") or []
+    if not products:
+        if cn:
+            return "抱歉，现在咨询的人比较多，我暂时没法详细回答。请稍后再试一次，或者先浏览我们的全部商品。"
+        return ("Sorry, I'm helping a lot of people right now and can't give you a detailed answer. "
+                "Please try again in a minute, or browse all of our products in the meantime.")
+    lines = [f"- {p['title']} — {p['price']}\n  {p['url']}" for p in products]
+    if cn:
+        head = "现在咨询的人比较多，先给你列几个可能合适的商品："
+    else:
+        head = "I'm helping a lot of people right now, so here is a quick list of products that may fit:"
+    return head + "\n" + "\n".join(lines)
+
+
+def answer_node(state: GraphState, system_prompt: str) -> GraphState:
+    key = _answer_cache_key(state)
+    if _answer_from_cache(state, key):
+        return _answer_actions(state)
+
+    t0 = time.perf_counter()
+    max_budget = _gather_products(state)
+    try:
+        resp = llm_gateway.invoke(_answer_prompt(state, system_prompt, max_budget), temperature=0.4)
+        state["answer"] = resp.content
+    except llm_gateway.LLMUnavailable as e:
+        state["answer"] = _fallback_answer(state, e)
+    _store_answer(state, key, t0)
+
+    return _answer_actions(state)
+
+
+async def aanswer_node(state: GraphState, system_prompt: str) -> GraphState:
+    key = _answer_cache_key(state)
+    if _answer_from_cache(state, key):
+        return _answer_actions(state)
+
+    t0 = time.perf_counter()
+    max_budget = await _agather_products(state)
+    try:
+        resp = await llm_gateway.ainvoke(_answer_prompt(state, system_prompt, max_budget), temperature=0.4)
+        state["answer"] = resp.content
+    except llm_gateway.LLMUnavailable as e:
+        state["answer"] = _fallback_answer(state, e)
+    _store_answer(state, key, t0)
+
+    return _answer_actions(state)
+
+
 # =========================
-# 7) Build Graph
+# 7) 节点耗时（/metrics 的 ff_graph_node_duration_seconds{node}）
 # =========================
-def build_graph(system_prompt: str):
+def _timed_node(name: str, func, afunc=None):
+    """
+    包一层计时。只有 sync 实现的节点仍返回普通函数（async graph 里直接调用，不额外切线程）；
+    有 async 实现的返回 RunnableLambda(sync, afunc)。
+    """
+    hist = NODE_SECONDS.labels(name)
+
+    def done(t0: float, token) -> None:
+        elapsed = time.perf_counter() - t0
+        hist.observe(elapsed)
+        if token is not None:
+            request_timings.exit_node(token)
+            request_timings.current().node(name, elapsed)
+
+    def enter():
+        # 开了 debug timings 才记当前节点名（LLM / Shopify 调用归属到节点）
+        return request_timings.enter_node(name) if request_timings.current() else None
+
+    @functools.wraps(func)
+    def timed(state):
+        t0, token = time.perf_counter(), enter()
+        try:
+            return func(state)
+        finally:
+            done(t0, token)
+
+    if afunc is None:
+        return timed
+
+    async def atimed(state):
+        t0, token = time.perf_counter(), enter()
+        try:
+            return await afunc(state)
+        finally:
+            done(t0, token)
+
+    return RunnableLambda(timed, afunc=atimed, name=name)
+
+
+# =========================
+# 8) Build Graph
+# =========================
+def build_graph(system_prompt: str, knowledge: Optional[KnowledgeIndex] = None):
+    """
+    knowledge 为空时 system_prompt 原样用于每次调用；
+    否则每次 clarify / answer 只拼上和 intent / 用户消息相关的知识小节。
+    """
     g = StateGraph(GraphState)
 
-    g.add_node("router", route_intent)
-    g.add_node("extract_profile", extract_profile)
-    g.add_node("check_clarify", needs_clarification)
-    g.add_node("clarify", lambda s: clarify_node(s, system_prompt))
-    g.add_node("answer", lambda s: answer_node(s, system_prompt))
-    g.add_node("apply_choice", apply_choice)
+    def node_prompt(s: GraphState) -> str:
+        if knowledge is None:
+            return system_prompt
+        return f"{system_prompt}\n\n{knowledge.context(s.get('intent', 'other'), s.get('user_message', ''))}"
+
+    # IO 节点同时提供 sync / async 实现：graph.invoke 走 sync，graph.ainvoke 走 async
+    async def aclarify(s):
+        return await aclarify_node(s, node_prompt(s))
+
+    async def aanswer(s):
+        return await aanswer_node(s, node_prompt(s))
+
+    g.add_node("router", _timed_node("route_intent", route_intent))
+    g.add_node("extract_profile", _timed_node("extract_profile", extract_profile, aextract_profile))
+    g.add_node("prefetch", _timed_node("prefetch_products", prefetch_products, aprefetch_products))
+    g.add_node("check_clarify", _timed_node("needs_clarification", needs_clarification))
+    g.add_node("clarify", _timed_node("clarify_node", lambda s: clarify_node(s, node_prompt(s)), aclarify))
+    g.add_node("answer", _timed_node("answer_node", lambda s: answer_node(s, node_prompt(s)), aanswer))
+    g.add_node("apply_choice", _timed_node("apply_choice", apply_choice))
+    g.add_node("faq", _timed_node("faq_answer", faq_answer))
 
     g.set_entry_point("router")
-    g.add_edge("router", "apply_choice")
+    # 命中 FAQ 的 policy 问题直接回答结束；其余照常
+    g.add_conditional_edges(
+        "router",
+        lambda state: "faq" if state.get("faq_id") else "apply_choice",
+        {"faq": "faq", "apply_choice": "apply_choice"},
+    )
+    g.add_edge("faq", END)
+    # fan-out：extract_profile（可能要等 LLM）和投机商品搜索并行，两者都完成后再 check_clarify
     g.add_edge("apply_choice", "extract_profile")
-    g.add_edge("extract_profile", "check_clarify")
+    g.add_edge("apply_choice", "prefetch")
+    g.add_edge(["extract_profile", "prefetch"], "check_clarify")
 
     def route_after_check(state: GraphState):
         return "clarify" if state.get("needs_clarification") else "answer"
@@ -423,5 +903,6 @@ def build_graph(system_prompt: str):
     g.add_edge("clarify", END)
     g.add_edge("answer", END)
 
-    checkpointer = MemorySaver()
+    # CHECKPOINT_MODE=turn 时调用方要传 durability=CHECKPOINT_DURABILITY（一轮结束才写 checkpoint）
+    checkpointer = make_checkpointer(drop_channels=TRANSIENT_FIELDS)
     return g.compile(checkpointer=checkpointer)
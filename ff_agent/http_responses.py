@@ -0,0 +1,243 @@
+# ff_agent/http_responses.py
+"""
+响应体积 / 序列化（手机上慢网络的访客）
+
+静态文件（GET / 和 /static/*）：
+- 文件读进内存时预先压好 br + gzip 变体（brotli 在 requirements.txt 里；没装时只有 gzip），只保留比原文小的；按 Accept-Encoding 选
+- ETag（内容 hash，每个编码一个）+ Last-Modified；If-None-Match / If-Modified-Since 命中返回 304，不重发内容
+- /static/* 长缓存（STATIC_MAX_AGE_SECONDS）；URL 带 ?v=<内容 hash>（asset_version()）时 immutable 一年。
+  GET / 的 HTML 入口用 no-cache：每次用 ETag 验证，改版立刻生效
+- 文件 mtime 变了就重新读 + 压缩；启动预热时 preload() 先把整个目录压好，第一个访客不用等 brotli
+
+/chat 的 JSON：
+- orjson 序列化（没装时退回 json），直接返回 Response，跳过 FastAPI 对返回 dict 的 jsonable_encoder 遍历
+- 超过 RESPONSE_COMPRESS_MIN_BYTES 且客户端接受时 gzip / br 压缩（小响应压缩省不了几个字节，只多花 CPU）
+
+SSE（/chat/stream）和 NDJSON（/chat/batch）不压缩：gzip 会攒数据，破坏逐条推送。
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Collection, Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli  # requirements.txt 里有；精简安装没装时退回只用 gzip（/stats 的 responses.static.encodings 可见）
+except ImportError:
+    brotli = None
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+STATIC_MAX_AGE_SECONDS = int(os.getenv("STATIC_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+
+# 同等 q 值时的优先顺序：br 比 gzip 小
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+# =========================
+# 编码 / 压缩
+# =========================
+def dumps(obj: Any) -> bytes:
+    """JSON → UTF-8 bytes（紧凑、不转义中文）；非常规类型按 str 处理"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def choose_encoding(accept_encoding: str, available: Collection[str]) -> Optional[str]:
+    """按 Accept-Encoding 的 q 值在 available 里挑一个；都不接受时返回 None（发原文）"""
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """静态文件只压一次，用最高压缩比；动态响应用较快的级别"""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 4)
+    return gzip.compress(body, compresslevel=9 if static else RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+# =========================
+# JSON 响应（/chat）
+# =========================
+_json_lock = threading.Lock()
+_json_stats = {"responses": 0, "compressed": 0, "bytes_raw": 0, "bytes_sent": 0}
+
+
+def json_response(request: Request, body: Any, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    data = dumps(body)
+    raw = len(data)
+    headers = dict(headers or {})
+    encoding = None
+    if raw >= RESPONSE_COMPRESS_MIN_BYTES:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), ENCODINGS)
+        if encoding:
+            data = compress(data, encoding)
+            headers["Content-Encoding"] = encoding
+    with _json_lock:
+        _json_stats["responses"] += 1
+        _json_stats["compressed"] += encoding is not None
+        _json_stats["bytes_raw"] += raw
+        _json_stats["bytes_sent"] += len(data)
+    return Response(data, status_code=status_code, headers=headers, media_type="application/json")
+
+
+# =========================
+# 静态文件
+# =========================
+class _Asset:
+    __slots__ = ("mtime_ns", "digest", "last_modified", "media_type", "variants")
+
+    def __init__(self, path: Path, mtime_ns: int):
+        body = path.read_bytes()
+        self.mtime_ns = mtime_ns
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.last_modified = formatdate(mtime_ns / 1e9, usegmt=True)
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        self.media_type = media_type
+        self.variants: Dict[str, bytes] = {"identity": body}
+        for encoding in ENCODINGS:
+            packed = compress(body, encoding, static=True)
+            if len(packed) < len(body):
+                self.variants[encoding] = packed
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+
+def _not_modified(request: Request, etag: str, mtime_ns: int) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # 弱比较：W/"x" 和 "x" 视为同一个
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime_ns / 1e9) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class StaticAssets:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory).resolve()
+        self._assets: Dict[Path, _Asset] = {}
+        self._lock = threading.Lock()
+
+        # Observability
+        self.sent: Dict[str, int] = {}  # encoding → 完整响应次数
+        self.not_modified = 0
+
+    def _path(self, name: str) -> Optional[Path]:
+        path = (self.directory / name).resolve()
+        return path if self.directory in path.parents and path.is_file() else None
+
+    def _asset(self, path: Path) -> _Asset:
+        mtime_ns = path.stat().st_mtime_ns
+        asset = self._assets.get(path)
+        if asset is None or asset.mtime_ns != mtime_ns:
+            asset = _Asset(path, mtime_ns)
+            with self._lock:
+                self._assets[path] = asset
+        return asset
+
+    def preload(self) -> int:
+        """把目录下所有文件读入内存并压好（启动预热时调用）；返回文件数"""
+        files = [p.resolve() for p in self.directory.rglob("*") if p.is_file()]
+        for path in files:
+            self._asset(path)
+        return len(files)
+
+    def asset_version(self, name: str) -> Optional[str]:
+        """内容 hash：页面里引用 /static/<name>?v=<hash> 时可以 immutable 缓存"""
+        path = self._path(name)
+        return self._asset(path).digest if path else None
+
+    def response(self, request: Request, name: str, cache_control: Optional[str] = None) -> Response:
+        path = self._path(name)
+        if path is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        asset = self._asset(path)
+
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), asset.variants) or "identity"
+        if cache_control is None:
+            if request.query_params.get("v") == asset.digest:
+                cache_control = f"public, max-age={IMMUTABLE_MAX_AGE_SECONDS}, immutable"
+            else:
+                cache_control = f"public, max-age={STATIC_MAX_AGE_SECONDS}"
+        headers = {
+            "ETag": asset.etag(encoding),
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if _not_modified(request, headers["ETag"], asset.mtime_ns):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        with self._lock:
+            self.sent[encoding] = self.sent.get(encoding, 0) + 1
+        return Response(asset.variants[encoding], headers=headers, media_type=asset.media_type)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            assets = {
+                str(path.relative_to(self.directory)): {enc: len(body) for enc, body in a.variants.items()}
+                for path, a in self._assets.items()
+            }
+            return {"encodings": list(ENCODINGS), "assets": assets, "sent": dict(self.sent),
+                    "not_modified": self.not_modified}
+
+
+def response_stats(static: StaticAssets) -> Dict[str, Any]:
+    with _json_lock:
+        json_stats = dict(_json_stats)
+    raw = json_stats["bytes_raw"]
+    return {
+        "json_encoder": "orjson" if orjson is not None else "json",
+        "compress_min_bytes": RESPONSE_COMPRESS_MIN_BYTES,
+        "json": {**json_stats, "saved_ratio": round(1 - json_stats["bytes_sent"] / raw, 3) if raw else None},
+        "static": static.stats(),
+    }
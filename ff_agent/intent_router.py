@@ -0,0 +1,110 @@
+# ff_agent/intent_router.py
+"""
+关键词 → intent 路由（Aho-Corasick 自动机）
+
+规则在 data/intent_rules.json：每组 {intent, priority, keywords}，中英文关键词放在一起；
+单个关键词也可以写成 {"keyword": ..., "priority": ...} 覆盖组内优先级。
+启动时编译成一个自动机，对消息只扫一遍：每个字符 O(1) 状态转移，和关键词表大小无关。
+多个关键词命中时取 priority 最高的；同优先级取最先出现的。匹配是子串匹配（大小写不敏感），和旧的 `k in msg` 一致。
+"""
+import json
+import os
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+INTENT_RULES_PATH = Path(os.getenv("INTENT_RULES_PATH", str(Path(__file__).resolve().parent / "data" / "intent_rules.json")))
+
+# (priority, intent, keyword)
+Rule = Tuple[int, str, str]
+
+
+def _better(a: Optional[Rule], b: Optional[Rule]) -> Optional[Rule]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if b[0] > a[0] else a
+
+
+class IntentRouter:
+    def __init__(self, rules: Iterable[Rule], default_intent: str = "other"):
+        self.default_intent = default_intent
+        self.size = 0
+
+        # goto[state] = {char: next_state}；fail = 失配链接；out = 以该状态结尾的最佳规则（含失配链上的后缀）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[Rule]] = [None]
+
+        for priority, intent, keyword in rules:
+            self._add(keyword.lower(), (priority, intent, keyword.lower()))
+        self._link()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "IntentRouter":
+        rules: List[Rule] = []
+        for group in config.get("rules", []):
+            for kw in group.get("keywords", []):
+                if isinstance(kw, dict):
+                    rules.append((int(kw.get("priority", group.get("priority", 0))), group["intent"], kw["keyword"]))
+                else:
+                    rules.append((int(group.get("priority", 0)), group["intent"], kw))
+        return cls(rules, config.get("default_intent", "other"))
+
+    @classmethod
+    def from_file(cls, path: Path = INTENT_RULES_PATH) -> "IntentRouter":
+        return cls.from_config(json.loads(path.read_text(encoding="utf-8")))
+
+    # ---------- 构建 ----------
+    def _add(self, keyword: str, rule: Rule):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+            state = nxt
+        if self._out[state] is None:
+            self.size += 1
+        self._out[state] = _better(self._out[state], rule)
+
+    def _link(self):
+        """BFS 建失配链接，并把后缀状态上的规则合并进来（匹配时不用再沿失配链找输出）"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = _better(self._out[nxt], self._out[self._fail[nxt]])
+                queue.append(nxt)
+
+    # ---------- 匹配 ----------
+    def match(self, text: str) -> Optional[Rule]:
+        """一遍扫描，返回命中的最佳规则 (priority, intent, keyword)；没有命中返回 None"""
+        goto, fail, out = self._goto, self._fail, self._out
+        best: Optional[Rule] = None
+        state = 0
+        for ch in (text or "").lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hit = out[state]
+            if hit is not None and (best is None or hit[0] > best[0]):
+                best = hit
+        return best
+
+    def route(self, text: str) -> str:
+        hit = self.match(text)
+        return hit[1] if hit else self.default_intent
+
+
+intent_router = IntentRouter.from_file()
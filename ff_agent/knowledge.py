@@ -0,0 +1,144 @@
+# ff_agent/knowledge.py
+"""
+店铺知识稿（docs/01_store_knowledge.md）的按需检索
+
+以前每次 clarify / answer 都把整份知识稿塞进 prompt。现在启动时按 markdown 标题切成小节并建索引，
+每次调用只带和当前 intent / 用户消息相关的小节：
+- 每个小节按标题 + 内容打上 intent 标签（KNOWLEDGE_TAGS）
+- 用户消息里的词（英文单词 / 中文二字词）命中小节内容时，该小节也带上
+  （出现在一半以上小节里的词不算，太泛）
+"""
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from ff_agent.llm_gateway import estimate_tokens
+
+INTENTS = ("product", "policy", "customization", "other")
+
+# (scope, pattern, intents)：小节标题（含上级标题）/ 正文命中 pattern 就打上这些 intent 标签
+KNOWLEDGE_TAGS: List[Tuple[str, re.Pattern, Tuple[str, ...]]] = [
+    ("heading", re.compile(r"品牌|brand", re.I), INTENTS),
+    ("heading", re.compile(r"产品|product", re.I), ("product", "customization", "other")),
+    ("heading", re.compile(r"FAQ|政策|policy", re.I), ("policy",)),
+    ("text", re.compile(r"刻字|个性化|定制|personali[sz]|engrav|custom", re.I), ("customization",)),
+    ("text", re.compile(r"退款|退换|发货|物流|运输|联系|refund|return|shipping|contact", re.I), ("policy",)),
+]
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+_ASCII_WORD = re.compile(r"[a-z][a-z0-9]{3,}")
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]{2,}")
+
+
+def _query_terms(text: str) -> set:
+    """英文单词（>=4 字母）+ 中文连续字的二字组合"""
+    text = (text or "").lower()
+    terms = set(_ASCII_WORD.findall(text))
+    for run in _CJK_RUN.findall(text):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class Section:
+    __slots__ = ("level", "heading", "parents", "text", "search_text", "intents", "tokens")
+
+    def __init__(self, level: int, heading: str, parents: Tuple[str, ...], body: List[str]):
+        self.level = level
+        self.heading = heading
+        self.parents = parents  # 祖先标题行（渲染时保留层级）
+        self.text = "\n".join([heading] + body).strip()
+        self.search_text = self.text.lower()
+        scopes = {"heading": " ".join(parents + (heading,)), "text": self.text}
+        self.intents = frozenset(
+            i for scope, pat, intents in KNOWLEDGE_TAGS if pat.search(scopes[scope]) for i in intents
+        )
+        self.tokens = estimate_tokens(self.text)
+
+
+class KnowledgeIndex:
+    def __init__(self, markdown: str):
+        self.full_text = markdown.strip()
+        self.full_tokens = estimate_tokens(self.full_text)
+        self.sections = self._split(markdown)
+
+        # 文档频率：太常见的词不用来召回
+        df: Dict[str, int] = {}
+        for s in self.sections:
+            for t in _query_terms(s.search_text):
+                df[t] = df.get(t, 0) + 1
+        limit = max(1, len(self.sections) // 2)
+        self._common = {t for t, n in df.items() if n > limit}
+
+        self._rendered: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+        # Observability
+        self.calls = 0
+        self.tokens_sent = 0
+
+    @classmethod
+    def from_file(cls, path) -> "KnowledgeIndex":
+        return cls(path.read_text(encoding="utf-8") if path.exists() else "")
+
+    @staticmethod
+    def _split(markdown: str) -> List[Section]:
+        """按标题切成叶子小节；只有标题没有正文的小节（例如只包含子标题）不单独成节"""
+        sections: List[Section] = []
+        stack: List[Tuple[int, str]] = []  # (level, heading line)
+        heading: Optional[Tuple[int, str]] = None
+        body: List[str] = []
+
+        def flush():
+            if heading is not None and any(line.strip() for line in body):
+                parents = tuple(h for lvl, h in stack if lvl < heading[0])
+                sections.append(Section(heading[0], heading[1], parents, body))
+
+        for line in markdown.splitlines():
+            m = _HEADING.match(line)
+            if not m:
+                body.append(line)
+                continue
+            flush()
+            level = len(m.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, line.strip()))
+            heading, body = (level, line.strip()), []
+        flush()
+        return sections
+
+    def select(self, intent: str, message: str = "") -> List[int]:
+        terms = _query_terms(message) - self._common
+        return [
+            i for i, s in enumerate(self.sections)
+            if intent in s.intents or any(t in s.search_text for t in terms)
+        ]
+
+    def context(self, intent: str, message: str = "") -> str:
+        """当前 intent / 消息需要的知识小节（保持原文顺序和标题层级）"""
+        key = tuple(self.select(intent, message))
+        text = self._rendered.get(key)
+        if text is None:
+            lines: List[str] = []
+            emitted = set()
+            for i in key:
+                s = self.sections[i]
+                for p in s.parents:
+                    if p not in emitted:
+                        emitted.add(p)
+                        lines.append(p)
+                lines.append(s.text)
+            text = "\n\n".join(lines)
+            with self._lock:
+                self._rendered[key] = text
+        self.calls += 1
+        self.tokens_sent += sum(self.sections[i].tokens for i in key)
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sections": len(self.sections),
+            "full_tokens": self.full_tokens,
+            "calls": self.calls,
+            "avg_tokens_per_call": round(self.tokens_sent / self.calls, 1) if self.calls else None,
+        }
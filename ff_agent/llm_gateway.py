@@ -0,0 +1,507 @@
+# ff_agent/llm_gateway.py
+"""
+进程级 LLM gateway
+
+- 每个 (model, temperature) 一个长生命周期的 ChatOpenAI，共享 httpx 连接池（不再每次调用新建 client）
+- 每个 model 一个并发上限（semaphore），超出的请求在这里排队
+  （同时也让 httpx 连接池里的排队保持很短：httpcore 分配连接的开销随排队数 × 连接数增长）
+- 队列深度 / in-flight / 延迟计数，/stats 可见；延迟直方图和 token 用量进 /metrics（ff_agent.metrics）
+- 每个 model 一对 RPM / TPM token bucket（按 prompt 估算 token 预留，调用后按实际用量多退少补），
+  把突发流量摊平到账号额度以内；429 / 连接错误 / 5xx 按指数退避重试。
+  排队超过上限、重试用尽、额度用光（insufficient_quota）、超时 / 连接错误、5xx 都抛 LLMUnavailable，
+  graph 节点据此降级而不是整轮报错；鉴权 / 权限 / 模型不存在 / 请求本身有错这类配置或代码问题
+  降级也救不了，记 error 日志 + ff_llm_client_errors 后原样抛出
+
+所有 graph 节点都通过 invoke / ainvoke 调 LLM。
+openai / langchain_openai 很重（import 约 0.4s），第一次建 client 时才导入；server 在 lifespan 预热里做（awarm_up）。
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import httpx
+
+from ff_agent import request_timings
+from ff_agent.metrics import (
+    LLM_CLIENT_ERRORS, LLM_QUEUE_SECONDS, LLM_RATE_LIMITED, LLM_RATE_WAIT_SECONDS, LLM_SECONDS, LLM_TOKENS,
+)
+
+logger = logging.getLogger("ff_agent.llm_gateway")
+
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# ---------- 账号额度（每个 model）；0 = 不限 ----------
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+# bucket 容量 = 每秒额度 × 这么多秒：最多允许这么大的突发，其余按额度匀速放行
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "6"))
+# 估算要等更久就不排了，直接降级
+LLM_RATE_MAX_WAIT_SECONDS = float(os.getenv("LLM_RATE_MAX_WAIT_SECONDS", "10"))
+# 预留给输出的 token（调用完按实际用量结算）
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = 0.5
+LLM_BACKOFF_MAX_SECONDS = 8.0
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+
+def _chat_openai_cls():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略 token 数（不依赖 tokenizer 文件）：中日韩字符约 1 字 1 token，其余约 4 字符 1 token。
+    用于 prompt 大小对比，不用于计费。
+    """
+    text = text or ""
+    cjk = sum(1 for ch in text if '\u4e00' <= ch <= '\u9fff')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class LLMUnavailable(RuntimeError):
+    """限流排队超过上限 / 重试用尽 / 不可重试的上游错误：调用方应降级（规则兜底、模板回答），而不是整轮失败"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _prompt_text(prompt: Any) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return "\n".join(str(getattr(m, "content", m)) for m in prompt)
+    return str(prompt)
+
+
+def _is_retryable(err: Exception) -> bool:
+    import openai  # 走到这里时 openai 早已导入（client 建好了）
+
+    if isinstance(err, openai.RateLimitError):
+        # 额度用光（insufficient_quota）重试也没用
+        return getattr(err, "code", None) != "insufficient_quota"
+    return isinstance(err, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def _upstream_failure(model: str, err: Exception, attempts: int) -> Optional[LLMUnavailable]:
+    """
+    不再重试的 OpenAI 错误 → LLMUnavailable：只有上游暂时不可用才降级（重试用尽的 429 / 连接错误 / 超时 / 5xx、额度用光）；
+    其他错误返回 None，调用方原样抛出：鉴权 / 权限 / 404 / 400 等是配置或代码问题，降级只会把它藏起来
+    """
+    import openai
+
+    if not isinstance(err, openai.APIError):
+        return None
+    status_code = getattr(err, "status_code", None)
+    if not (isinstance(err, (openai.RateLimitError, openai.APIConnectionError))
+            or (status_code is not None and status_code >= 500)):
+        LLM_CLIENT_ERRORS.labels(model, type(err).__name__).inc()
+        logger.error("LLM call to %s failed with a non-retryable error (%s): %s",
+                     model, status_code or type(err).__name__, err)
+        return None
+    if _is_retryable(err):
+        LLM_RATE_LIMITED.labels(model, "retries_exhausted").inc()
+    elif isinstance(err, openai.RateLimitError):
+        LLM_RATE_LIMITED.labels(model, "insufficient_quota").inc()
+    status = getattr(err, "status_code", None) or type(err).__name__
+    return LLMUnavailable(f"LLM unavailable after {attempts} attempt(s) ({status}): {err}")
+
+
+def _retry_delay(err: Exception, attempt: int) -> float:
+    """优先用服务端给的 retry-after-ms / retry-after，否则 full jitter 指数退避"""
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            value = headers.get(name)
+            if value is not None:
+                return min(LLM_BACKOFF_MAX_SECONDS, float(value) * scale) + random.uniform(0, LLM_BACKOFF_BASE_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+class _TokenBucket:
+    """
+    按 per_minute / 60 每秒匀速补充，容量 = 每秒额度 × burst_seconds。
+    reserve 先扣后等（余额可以为负）：后来的请求自然排在前面的预留之后，不会同时醒来抢额度。
+    """
+
+    def __init__(self, per_minute: int, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _RateLimiter:
+    """单个 model 的 RPM + TPM bucket；sync / async 共用（锁内只做算术，不等待）"""
+
+    def __init__(self, model: str, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 burst_seconds: Optional[float] = None, max_wait_seconds: Optional[float] = None):
+        rpm = LLM_RPM_LIMIT if rpm is None else rpm
+        tpm = LLM_TPM_LIMIT if tpm is None else tpm
+        burst_seconds = LLM_RATE_BURST_SECONDS if burst_seconds is None else burst_seconds
+        self.model = model
+        self.rpm = _TokenBucket(rpm, burst_seconds) if rpm > 0 else None
+        self.tpm = _TokenBucket(tpm, burst_seconds) if tpm > 0 else None
+        self.max_wait_seconds = LLM_RATE_MAX_WAIT_SECONDS if max_wait_seconds is None else max_wait_seconds
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0  # 收到 429 后整个 model 暂停到这个时间
+
+        self.reserved_calls = 0
+        self.delayed_calls = 0
+        self.total_wait_ms = 0.0
+        self.rejected = 0
+        self.rate_limit_errors = 0
+        self.retries = 0
+
+    def reserve(self, tokens: int) -> float:
+        """预留一次调用的额度，返回需要先等多少秒；预计要等超过 max_wait_seconds 时抛 LLMUnavailable"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self.rpm:
+                wait = max(wait, self.rpm.wait_for(1, now))
+            if self.tpm:
+                wait = max(wait, self.tpm.wait_for(tokens, now))
+            if wait > self.max_wait_seconds:
+                self.rejected += 1
+                LLM_RATE_LIMITED.labels(self.model, "wait_exceeded").inc()
+                raise LLMUnavailable(f"LLM rate limit: estimated wait {wait:.1f}s for {self.model}", retry_after=wait)
+            if self.rpm:
+                self.rpm.take(1)
+            if self.tpm:
+                self.tpm.take(tokens)
+            self.reserved_calls += 1
+            if wait > 0:
+                self.delayed_calls += 1
+                self.total_wait_ms += wait * 1000
+        LLM_RATE_WAIT_SECONDS.labels(self.model).observe(wait)
+        return wait
+
+    def settle(self, reserved_tokens: int, actual_tokens: Optional[int]) -> None:
+        """按实际 token 用量结算（失败的调用 actual=0，全部退回）"""
+        if self.tpm is None or actual_tokens is None:
+            return
+        with self._lock:
+            diff = reserved_tokens - actual_tokens
+            if diff >= 0:
+                self.tpm.give_back(diff)
+            else:
+                self.tpm.take(-diff)
+
+    def backoff(self, err: Exception, delay: float) -> None:
+        """429：整个 model 暂停 delay 秒（其他请求也排到之后），避免一起撞墙"""
+        import openai
+
+        self.retries += 1
+        if isinstance(err, openai.RateLimitError):
+            self.rate_limit_errors += 1
+            LLM_RATE_LIMITED.labels(self.model, "http_429").inc()
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm_limit": round(self.rpm.rate * 60) if self.rpm else None,
+            "tpm_limit": round(self.tpm.rate * 60) if self.tpm else None,
+            "calls": self.reserved_calls,
+            "delayed_calls": self.delayed_calls,
+            "avg_delay_ms": round(self.total_wait_ms / self.delayed_calls, 1) if self.delayed_calls else None,
+            "rejected": self.rejected,
+            "rate_limit_errors": self.rate_limit_errors,
+            "retries": self.retries,
+        }
+
+
+def _usage_tokens(resp: Any) -> Optional[int]:
+    usage = getattr(resp, "usage_metadata", None)
+    if not usage:
+        return None
+    return usage.get("total_tokens") or (usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+
+
+def _count_tokens(model: str, resp: Any) -> None:
+    usage = getattr(resp, "usage_metadata", None)
+    if usage:
+        LLM_TOKENS.labels(model, "prompt").inc(usage.get("input_tokens", 0))
+        LLM_TOKENS.labels(model, "completion").inc(usage.get("output_tokens", 0))
+
+
+def _trace_call(model: str, t_queued: float, t0: float, ok: bool, resp: Any) -> None:
+    """开了 debug timings 的请求：记下这次调用（所在节点 / 排队 / 耗时 / token）"""
+    timings = request_timings.current()
+    if timings:
+        timings.llm(model, time.perf_counter() - t0, t0 - t_queued, ok, getattr(resp, "usage_metadata", None))
+
+
+class _ModelLimiter:
+    """单个 model 的并发上限 + 计数（sync 用线程信号量，async 用 asyncio 信号量）"""
+
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.rate = _RateLimiter(model)
+        self._sync_sem = threading.BoundedSemaphore(limit)
+        self._count_lock = threading.Lock()  # sync 路径多线程更新计数
+        self._async_sem: asyncio.Semaphore | None = None
+        self._async_loop: asyncio.AbstractEventLoop | None = None
+
+        self.queued = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.total_wait_ms = 0.0
+
+    def async_sem(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._async_sem is None or self._async_loop is not loop:
+            self._async_sem = asyncio.Semaphore(self.limit)
+            self._async_loop = loop
+        return self._async_sem
+
+    def record(self, wait_ms: float, call_ms: float, ok: bool):
+        LLM_QUEUE_SECONDS.labels(self.model).observe(wait_ms / 1000)
+        LLM_SECONDS.labels(self.model, "ok" if ok else "error").observe(call_ms / 1000)
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        self.total_wait_ms += wait_ms
+        self.total_ms += call_ms
+        self.max_ms = max(self.max_ms, call_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else None,
+            "max_ms": round(self.max_ms, 1),
+            "avg_queue_wait_ms": round(self.total_wait_ms / self.calls, 1) if self.calls else None,
+            "rate_limit": self.rate.stats(),
+        }
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._limiters: Dict[str, _ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+        # sync：进程内共享一个 httpx.Client
+        self._clients: Dict[Tuple[str, float], "ChatOpenAI"] = {}
+        self._http_client = httpx.Client(limits=self._limits(), timeout=LLM_TIMEOUT_SECONDS)
+
+        # async：httpx.AsyncClient 的连接绑定 event loop，所以每个 loop 一套（server 里只有一个 loop）
+        self._async_clients: Dict[Tuple[str, float], "ChatOpenAI"] = {}
+        self._http_async_client: httpx.AsyncClient | None = None
+        self._async_loop: asyncio.AbstractEventLoop | None = None
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)
+
+    def _new_llm(self, model: str, temperature: float, **http) -> "ChatOpenAI":
+        # stream_usage：流式调用（/chat/stream）也带回 token 用量
+        # max_retries=0：重试在 gateway 里做（要先过 rate limiter，且 429 时整个 model 一起退避）
+        return _chat_openai_cls()(model=model, temperature=temperature, timeout=LLM_TIMEOUT_SECONDS,
+                                  stream_usage=True, max_retries=0, **http)
+
+    def client(self, model: str = DEFAULT_MODEL, temperature: float = 0.0) -> "ChatOpenAI":
+        key = (model, float(temperature))
+        llm = self._clients.get(key)
+        if llm is None:
+            with self._lock:
+                llm = self._clients.get(key)
+                if llm is None:
+                    llm = self._new_llm(model, temperature, http_client=self._http_client)
+                    self._clients[key] = llm
+        return llm
+
+    def async_client(self, model: str = DEFAULT_MODEL, temperature: float = 0.0) -> "ChatOpenAI":
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop or self._http_async_client is None:
+            self._async_clients = {}
+            self._http_async_client = httpx.AsyncClient(limits=self._limits(), timeout=LLM_TIMEOUT_SECONDS)
+            self._async_loop = loop
+
+        key = (model, float(temperature))
+        llm = self._async_clients.get(key)
+        if llm is None:
+            llm = self._new_llm(model, temperature, http_async_client=self._http_async_client)
+            self._async_clients[key] = llm
+        return llm
+
+    def limiter(self, model: str) -> _ModelLimiter:
+        lim = self._limiters.get(model)
+        if lim is None:
+            with self._lock:
+                lim = self._limiters.setdefault(model, _ModelLimiter(model, self.max_concurrency))
+        return lim
+
+    # ---------- 调用（限流 + 重试）----------
+    def invoke(self, prompt: Any, *, model: str = DEFAULT_MODEL, temperature: float = 0.0):
+        rate = self.limiter(model).rate
+        tokens = estimate_tokens(_prompt_text(prompt)) + LLM_COMPLETION_TOKENS_ESTIMATE
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            wait = rate.reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                resp = self._invoke_once(prompt, model, temperature)
+            except Exception as e:
+                rate.settle(tokens, 0)
+                if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                    unavailable = _upstream_failure(model, e, attempt + 1)
+                    if unavailable is None:
+                        raise
+                    raise unavailable from e
+                delay = _retry_delay(e, attempt)
+                rate.backoff(e, delay)
+                time.sleep(delay)
+                continue
+            rate.settle(tokens, _usage_tokens(resp))
+            return resp
+
+    async def ainvoke(self, prompt: Any, *, model: str = DEFAULT_MODEL, temperature: float = 0.0):
+        rate = self.limiter(model).rate
+        tokens = estimate_tokens(_prompt_text(prompt)) + LLM_COMPLETION_TOKENS_ESTIMATE
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            wait = rate.reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                resp = await self._ainvoke_once(prompt, model, temperature)
+            except Exception as e:
+                rate.settle(tokens, 0)
+                if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                    unavailable = _upstream_failure(model, e, attempt + 1)
+                    if unavailable is None:
+                        raise
+                    raise unavailable from e
+                delay = _retry_delay(e, attempt)
+                rate.backoff(e, delay)
+                await asyncio.sleep(delay)
+                continue
+            rate.settle(tokens, _usage_tokens(resp))
+            return resp
+
+    # ---------- 单次调用（并发上限 + 计数）----------
+    def _invoke_once(self, prompt: Any, model: str, temperature: float):
+        lim = self.limiter(model)
+        llm = self.client(model, temperature)
+
+        t_queued = time.perf_counter()
+        with lim._count_lock:
+            lim.queued += 1
+        lim._sync_sem.acquire()
+        with lim._count_lock:
+            lim.queued -= 1
+            lim.in_flight += 1
+        t0 = time.perf_counter()
+        ok = False
+        resp = None
+        try:
+            resp = llm.invoke(prompt)
+            ok = True
+            _count_tokens(model, resp)
+            return resp
+        finally:
+            lim._sync_sem.release()
+            with lim._count_lock:
+                lim.in_flight -= 1
+                lim.record((t0 - t_queued) * 1000, (time.perf_counter() - t0) * 1000, ok)
+            _trace_call(model, t_queued, t0, ok, resp)
+
+    async def _ainvoke_once(self, prompt: Any, model: str, temperature: float):
+        lim = self.limiter(model)
+        llm = self.async_client(model, temperature)
+        sem = lim.async_sem()
+
+        t_queued = time.perf_counter()
+        lim.queued += 1
+        try:
+            await sem.acquire()
+        finally:
+            lim.queued -= 1
+        lim.in_flight += 1
+        t0 = time.perf_counter()
+        ok = False
+        resp = None
+        try:
+            resp = await llm.ainvoke(prompt)
+            ok = True
+            _count_tokens(model, resp)
+            return resp
+        finally:
+            lim.in_flight -= 1
+            sem.release()
+            lim.record((t0 - t_queued) * 1000, (time.perf_counter() - t0) * 1000, ok)
+            _trace_call(model, t_queued, t0, ok, resp)
+
+    def preload(self, model: str = DEFAULT_MODEL) -> None:
+        """导入 openai / langchain_openai 并构造一次 ChatOpenAI（第一次约 0.4s 纯 CPU；启动预热时在线程里调用）"""
+        _chat_openai_cls()(model=model, api_key="warmup")
+
+    async def awarm_up(self, model: str = DEFAULT_MODEL, connections: int = 1) -> None:
+        """
+        启动预热：建好 async client，并预先打开连接池里的连接（DNS + TCP + TLS）。
+        用 GET /models/{model}：不花 token，顺便验证 API key 和 model 名。
+        """
+        await asyncio.to_thread(self.preload, model)  # 已经 preload 过时很快
+        llm = self.async_client(model)
+        await asyncio.gather(*(llm.root_async_client.models.retrieve(model) for _ in range(connections)))
+
+    async def aclose(self):
+        """关闭当前 loop 的 async 连接池（lifespan shutdown）；之后再调用会重新建 client"""
+        http_async_client = self._http_async_client
+        self._async_clients = {}
+        self._http_async_client = None
+        self._async_loop = None
+        if http_async_client is not None:
+            await http_async_client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self._clients) + len(self._async_clients),
+            "models": {m: lim.stats() for m, lim in self._limiters.items()},
+        }
+
+
+gateway = LLMGateway()
+
+
+def invoke(prompt: Any, *, model: str = DEFAULT_MODEL, temperature: float = 0.0):
+    return gateway.invoke(prompt, model=model, temperature=temperature)
+
+
+async def ainvoke(prompt: Any, *, model: str = DEFAULT_MODEL, temperature: float = 0.0):
+    return await gateway.ainvoke(prompt, model=model, temperature=temperature)
@@ -0,0 +1,88 @@
+# ff_agent/metrics.py
+"""
+Prometheus 指标（GET /metrics，prometheus_client 的 generate_latest）
+
+- Counter / Histogram 用 prometheus_client；队列深度这类本来就有的计数用 Gauge.set_function，抓取时回调取值
+- 指标在进程内累计（默认 registry，顺带 process / python_gc 指标）；多 worker 时每个 worker 各自暴露
+
+所有指标在本模块定义，调用方 import 后 .labels(...).inc() / .observe()。
+"""
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# 秒；覆盖 µs 级的规则节点到几十秒的 LLM 调用
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render() -> bytes:
+    """所有指标的 Prometheus text format"""
+    return generate_latest()
+
+
+# =========================
+# 指标定义
+# =========================
+NODE_SECONDS = Histogram(
+    "ff_graph_node_duration_seconds", "Wall time of each graph node.", ["node"],
+    buckets=DEFAULT_BUCKETS,
+)
+INTENTS = Counter(
+    "ff_intents", "Turns routed to each intent.", ["intent"],
+)
+FAQ_LOOKUPS = Counter(
+    "ff_faq_lookups", "Policy turns answered from the precomputed FAQ table (result=entry id) or sent to the LLM (miss).", ["result"],
+)
+LLM_SECONDS = Histogram(
+    "ff_llm_call_duration_seconds", "LLM call latency (excluding gateway queue wait).", ["model", "outcome"],
+    buckets=DEFAULT_BUCKETS,
+)
+LLM_QUEUE_SECONDS = Histogram(
+    "ff_llm_queue_wait_seconds", "Time spent waiting for the per-model LLM concurrency limit.", ["model"],
+    buckets=DEFAULT_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "ff_llm_tokens", "LLM tokens reported by the API.", ["model", "kind"],
+)
+LLM_RATE_WAIT_SECONDS = Histogram(
+    "ff_llm_rate_limit_wait_seconds", "Delay imposed by the client-side RPM/TPM buckets before an LLM call.", ["model"],
+    buckets=DEFAULT_BUCKETS,
+)
+LLM_RATE_LIMITED = Counter(
+    "ff_llm_rate_limited", "LLM rate limiting events (http_429, wait_exceeded, retries_exhausted, insufficient_quota).", ["model", "reason"],
+)
+LLM_CLIENT_ERRORS = Counter(
+    "ff_llm_client_errors", "OpenAI errors re-raised instead of degrading (auth, permission, not found, bad request, ...).", ["model", "error"],
+)
+LLM_DEGRADED = Counter(
+    "ff_llm_degraded", "Graph nodes that fell back to a non-LLM answer because the LLM was unavailable.", ["node"],
+)
+STOREFRONT_SECONDS = Histogram(
+    "ff_storefront_query_duration_seconds", "Storefront GraphQL call latency, retries included.", ["outcome"],
+    buckets=DEFAULT_BUCKETS,
+)
+STOREFRONT_COALESCED = Counter(
+    "ff_storefront_coalesced", "Storefront calls that joined an identical in-flight request instead of sending one.", ["mode"],
+)
+SHOPIFY_ERRORS = Counter(
+    "ff_shopify_errors", "Failed Storefront attempts (each retry counts).", ["kind"],
+)
+CATALOG_SNAPSHOT_AGE_SECONDS = Gauge(
+    "ff_catalog_snapshot_age_seconds", "Age of the in-process product snapshot (NaN before the first load).",
+)
+CATALOG_REFRESH_DURATION_SECONDS = Gauge(
+    "ff_catalog_refresh_duration_seconds", "Duration of the last catalog refresh attempt, successful or not.",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "ff_admission_wait_seconds", "Time admitted /chat requests waited for their thread and a global slot.",
+    buckets=DEFAULT_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "ff_admission_rejections", "Requests rejected by admission control.", ["reason"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "ff_admission_queue_depth", "Requests waiting for a global /chat slot.",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "ff_admission_in_flight", "Admitted /chat requests currently running.",
+)
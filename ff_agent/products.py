@@ -0,0 +1,95 @@
+# ff_agent/products.py
+"""
+商品记录
+
+- Product：__slots__ 的紧凑记录，价格保留为 Decimal（和 Storefront 返回的字符串一致，不丢精度）+ 整数分
+  （预算过滤直接比较 price_cents，不再反复解析 "47.0 USD" 字符串）
+- 对外的 dict 形状（title/handle/available/price/url）只在 products_debug 这一层生成：Product.to_dict()
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+
+def to_cents(amount: Any, rounding: str = ROUND_HALF_UP) -> Optional[int]:
+    """'47.0' / 47 / Decimal('47.00') -> 4700；无法解析返回 None"""
+    if amount is None or amount == "":
+        return None
+    try:
+        return int((Decimal(str(amount)) * 100).to_integral_value(rounding))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+class Product:
+    __slots__ = ("title", "handle", "available", "price", "currency", "price_cents", "url", "match")
+
+    def __init__(
+        self,
+        title: str,
+        handle: str,
+        available: bool,
+        price: Optional[Decimal],
+        currency: str,
+        url: str,
+        match: Tuple[str, str, Tuple[str, ...]] = ("", "", ()),
+    ):
+        self.title = title
+        self.handle = handle
+        self.available = available
+        self.price = price
+        self.currency = currency
+        self.price_cents = to_cents(price)
+        self.url = url
+        # 预先算好的小写 (title, product_type, tags)，catalog 本地搜索用
+        self.match = match
+
+    @classmethod
+    def from_node(cls, node: Dict[str, Any], url_prefix: str) -> "Product":
+        """Storefront product node -> Product"""
+        price = (node.get("priceRange") or {}).get("minVariantPrice") or {}
+        try:
+            amount = Decimal(str(price["amount"]))
+        except (KeyError, InvalidOperation):
+            amount = None
+        return cls(
+            title=node["title"],
+            handle=node["handle"],
+            available=node["availableForSale"],
+            price=amount,
+            currency=price.get("currencyCode", ""),
+            url=f"{url_prefix}{node['handle']}",
+            match=(
+                node["title"].lower(),
+                (node.get("productType") or "").lower(),
+                tuple(t.lower() for t in node.get("tags") or []),
+            ),
+        )
+
+    def to_row(self) -> tuple:
+        """可序列化的紧凑形式（要放进 graph state / checkpoint 时用）"""
+        return (self.title, self.handle, self.available,
+                None if self.price is None else str(self.price), self.currency, self.url, self.match)
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "Product":
+        title, handle, available, price, currency, url, match = row
+        return cls(title, handle, available, None if price is None else Decimal(price), currency, url,
+                   (match[0], match[1], tuple(match[2])))
+
+    def key(self) -> tuple:
+        """内容指纹（catalog 用来判断商品列表是否变化）"""
+        return (self.handle, self.title, self.price, self.currency, self.available, self.match)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """对外返回的商品 dict（products_debug / prompt）"""
+        return {
+            "title": self.title,
+            "handle": self.handle,
+            "available": self.available,
+            "price": f"{self.price} {self.currency}" if self.price is not None else "",
+            "url": self.url,
+        }
+
+    def __repr__(self) -> str:
+        return f"Product({self.handle!r}, {self.price} {self.currency})"
+
@@ -0,0 +1,199 @@
+# ff_agent/profile_rules.py
+"""
+规则优先的 profile 抽取（中英双语，确定性）
+
+extract_profile 先跑这里的规则；消息有实际内容，并且 intent 需要的字段仍然缺失、
+或者这条消息的规则命中不够确定（profile_confidence < RULE_CONFIDENT）时才调用 LLM。
+已有的 profile 字段只有规则很确定时才会被覆盖。
+"""
+import re
+from typing import Any, Dict, Tuple
+
+# 规则结果的置信度低于这个值时，不算“已经拿到”，仍然交给 LLM
+RULE_MIN_CONFIDENCE = 0.7
+# 达到这个值才算确定：可以覆盖 profile 里已有的值；整条消息的置信度低于它时让 LLM 再看一遍
+RULE_CONFIDENT = 0.85
+
+# 每个 intent 回答前需要的字段（和 needs_clarification 的判断一致）
+REQUIRED_FIELDS = {
+    "product": ["budget", "occasion"],
+    "other": ["budget", "occasion"],
+    "customization": ["engraving_language", "engraving_text"],
+    "policy": [],
+}
+
+# =========================
+# Budget
+# =========================
+_NUM = r"(\d+(?:\.\d+)?)"
+_UP_TO = r"(?:under|below|less than|max|at most|up to)"
+_CN_UP_TO = r"(?:不超过|不要超过|最多|低于)"
+_CN_CURRENCY = r"(?:刀|美元|美金|块|元)"
+# 数字后面紧跟的不是天数 / 件数之类的单位（"under 5 days shipping" 不是预算）
+_NOT_UNIT = (r"(?!\.?\d)(?!\s*(?:days?|weeks?|months?|hours?|hrs?|years?|pcs|pieces|items?|inch(?:es)?|cm|lbs?|kg)\b)"
+             r"(?!\s*(?:天|周|个?星期|个?月|小时|年|件|个|寸|厘米|公斤))")
+BUDGET_RULES = [
+    # (输出格式, pattern, confidence)
+    ("under ${}", re.compile(_UP_TO + r"\s*\$\s*" + _NUM, re.I), 0.95),
+    ("under ${}", re.compile(_UP_TO + r"\s*" + _NUM + r"\s*(?:usd|dollars?|bucks)\b", re.I), 0.95),
+    ("under ${}", re.compile(r"budget\D{0,12}" + _NUM + _NOT_UNIT, re.I), 0.9),
+    ("${}", re.compile(r"\$\s*" + _NUM), 0.9),
+    ("${}", re.compile(_NUM + r"\s*(?:usd|dollars?|bucks)\b", re.I), 0.9),
+    # 中文：预算60 / 不超过60刀 / 60刀以内 / 60美元 / 60块
+    ("under ${}", re.compile(r"预算\D{0,4}" + _NUM + _NOT_UNIT), 0.9),
+    ("under ${}", re.compile(_CN_UP_TO + r"\D{0,4}" + _NUM + r"\s*" + _CN_CURRENCY), 0.9),
+    ("under ${}", re.compile(_NUM + r"\s*" + _CN_CURRENCY + r"\s*(?:以内|以下|之内)"), 0.9),
+    ("${}", re.compile(_NUM + r"\s*" + _CN_CURRENCY), 0.85),
+    # 没有货币单位（under 60 / 不超过60）：可能是预算也可能是别的数量，置信度低于 RULE_CONFIDENT，
+    # 只补缺失的 budget、不覆盖已有的，并且让 LLM 再判断
+    ("under ${}", re.compile(_UP_TO + r"\s*" + _NUM + _NOT_UNIT, re.I), 0.75),
+    ("under ${}", re.compile(_CN_UP_TO + r"\D{0,4}" + _NUM + _NOT_UNIT), 0.75),
+]
+
+# =========================
+# Occasion
+# =========================
+# (value, pattern, confidence) —— 下面几组规则同样格式；deadline / engraving 的值取匹配文本
+OCCASION_RULES = [
+    ("gift", re.compile(
+        r"\b(?:gift|present|for (?:my |a )?(?:friend|mom|mother|dad|father|sister|brother|wife|husband|"
+        r"partner|daughter|son|colleague|coworker|neighbor|neighbour|grandma|grandpa))\b", re.I), 0.9),
+    ("gift", re.compile(r"送人|送礼|礼物|送给|给朋友|给家人"), 0.9),
+    ("self", re.compile(r"\b(?:for myself|my own|personal keepsake|keep it myself)\b", re.I), 0.9),
+    ("self", re.compile(r"自己|自用|留作纪念"), 0.85),
+]
+
+# =========================
+# Deadline
+# =========================
+_WEEKDAYS = r"(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)"
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*"
+DEADLINE_RULES = [
+    (None, re.compile(
+        r"\b(?:by|before|until|no later than)\s+(?:next\s+|this\s+)?"
+        r"(?:" + _WEEKDAYS + r"|" + _MONTHS + r"\.?\s*\d{1,2}(?:st|nd|rd|th)?|\d{1,2}/\d{1,2}"
+        r"|christmas|thanksgiving|the end of (?:the )?(?:week|month)|tomorrow|next week)\b", re.I), 0.9),
+    (None, re.compile(r"\bwithin\s+(?:\d+|a|one|two|three)\s+(?:days?|weeks?)\b", re.I), 0.9),
+    (None, re.compile(r"\b(?:asap|urgent|next week|this week)\b", re.I), 0.75),
+    (None, re.compile(r"\d+\s*天(?:内|之内)|下周[一二三四五六日天]?(?:之前|前)?|本周|这周|月底(?:之前|前)?|圣诞(?:节)?(?:之前|前)|尽快"), 0.85),
+]
+
+# =========================
+# Engraving text
+# =========================
+_ENGRAVING_WORD = r"(?:engrav\w*|inscri\w*|wording|text|刻字|刻上|刻)\s*(?:with|as|:|：|is|=)?\s*"
+ENGRAVING_RULES = [
+    # engrave "Forever Max" / 刻字“永远爱你”
+    (None, re.compile(_ENGRAVING_WORD + r"[\"“「](.+?)[\"”」]", re.I), 0.95),
+    # engraving: 'Max 2010-2024'：单引号必须是真引号，不能是缩写里的撇号（engraving's / don't）
+    (None, re.compile(_ENGRAVING_WORD + r"(?<!\w)['‘](.+?)['’](?!\w)", re.I), 0.95),
+    # 没有引号：engrave with Max / 刻字：永远爱你
+    (None, re.compile(r"(?:engrave(?:d)? (?:it )?with|engraving (?:should )?(?:say|read)s?:?)\s+([^\n.,!?]{1,40})", re.I), 0.75),
+    (None, re.compile(r"(?:刻字|刻上)[:：]?\s*([^\s，。！？,.!?]{1,20})"), 0.75),
+]
+
+_CJK = re.compile(r"[\u4e00-\u9fff]")
+
+# 没有实际信息的短消息（按钮回执/寒暄），不值得一次 LLM 抽取
+_FILLER = {
+    "ok", "okay", "yes", "no", "thanks", "thank you", "thx", "hi", "hello", "hey", "sure", "cool",
+    "好的", "好", "谢谢", "是", "不是", "嗯", "你好",
+}
+
+
+def _first_match(rules, msg: str):
+    # 每条规则都是 (value, pattern, confidence)，按顺序取第一条命中的
+    for value, pattern, conf in rules:
+        m = pattern.search(msg)
+        if m:
+            return (value, conf), m
+    return None, None
+
+
+def extract_profile_rules(msg: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    返回 (fields, confidence)：
+    - fields：规则抽到的 profile 字段（格式和 LLM 抽取一致，例如 budget="under $60"）
+    - confidence：每个字段的置信度 0~1
+    """
+    msg = msg or ""
+    fields: Dict[str, Any] = {}
+    confidence: Dict[str, float] = {}
+
+    rule, m = _first_match(BUDGET_RULES, msg)
+    if m:
+        fields["budget"] = rule[0].format(m.group(1))
+        confidence["budget"] = rule[1]
+
+    rule, m = _first_match(OCCASION_RULES, msg)
+    if m:
+        fields["occasion"] = rule[0]
+        confidence["occasion"] = rule[1]
+
+    rule, m = _first_match(DEADLINE_RULES, msg)
+    if m:
+        fields["deadline"] = m.group(0).strip()
+        confidence["deadline"] = rule[1]
+
+    rule, m = _first_match(ENGRAVING_RULES, msg)
+    if m:
+        text = m.group(1).strip()
+        if text:
+            fields["engraving_text"] = text
+            confidence["engraving_text"] = rule[1]
+            fields["engraving_language"] = "Chinese" if _CJK.search(text) else "English"
+            confidence["engraving_language"] = rule[1]
+
+    return fields, confidence
+
+
+def profile_confidence(confidence: Dict[str, float]) -> float:
+    """整体置信度：抽到的字段里最弱的那个；什么都没抽到时为 0"""
+    return min(confidence.values()) if confidence else 0.0
+
+
+def has_real_content(msg: str) -> bool:
+    """空消息（#choice 被 apply_choice 清空）、纯寒暄不算实际内容"""
+    s = (msg or "").strip()
+    if not s or s.startswith("#choice:"):
+        return False
+    normalized = re.sub(r"[\s!.?,。！？，~]+", " ", s.lower()).strip()
+    if normalized in _FILLER:
+        return False
+    return len(re.findall(r"\w", normalized)) >= 2
+
+
+def missing_required(intent: str, profile: Dict[str, Any]) -> list:
+    return [k for k in REQUIRED_FIELDS.get(intent, ["budget", "occasion"]) if not profile.get(k)]
+
+
+# =========================
+# Stats：有多少轮跳过了 LLM
+# =========================
+# rule_matched_turns：规则抽到了字段的轮次；low_confidence：其中置信度 < RULE_CONFIDENT、因此调了 LLM 的；
+# kept_existing：规则不够确定、没有覆盖已有值的字段数
+PROFILE_STATS = {"turns": 0, "llm_calls": 0, "llm_skipped": 0,
+                 "rule_matched_turns": 0, "low_confidence": 0, "kept_existing": 0}
+_confidence_sum = 0.0
+
+
+def record_profile_turn(llm_called: bool, confidence: float = 0.0, low_confidence: bool = False,
+                        kept_existing: int = 0) -> None:
+    global _confidence_sum
+    PROFILE_STATS["turns"] += 1
+    PROFILE_STATS["llm_calls" if llm_called else "llm_skipped"] += 1
+    PROFILE_STATS["low_confidence"] += low_confidence
+    PROFILE_STATS["kept_existing"] += kept_existing
+    if confidence:
+        PROFILE_STATS["rule_matched_turns"] += 1
+        _confidence_sum += confidence
+
+
+def profile_stats() -> Dict[str, Any]:
+    turns = PROFILE_STATS["turns"]
+    matched = PROFILE_STATS["rule_matched_turns"]
+    return {
+        **PROFILE_STATS,
+        "llm_skip_share": round(PROFILE_STATS["llm_skipped"] / turns, 3) if turns else None,
+        "avg_rule_confidence": round(_confidence_sum / matched, 3) if matched else None,
+    }
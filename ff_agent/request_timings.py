@@ -0,0 +1,112 @@
+# ff_agent/request_timings.py
+"""
+单个请求的耗时明细（opt-in：/chat 的 debug 字段或 X-Debug-Timings 头）
+
+- 一个 contextvar 挂当前请求的 RequestTimings；LangGraph 的并行分支 / async 节点会复制 context，
+  所以节点、llm_gateway、shopify_storefront 里都能直接 current() 拿到
+- 没开 debug 时 current() 是 None，各记录点只多一次 contextvar 读取
+- 当前节点名也放在 contextvar 里，LLM / Shopify 调用据此归属到节点
+"""
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+_current: contextvars.ContextVar[Optional["RequestTimings"]] = contextvars.ContextVar("request_timings", default=None)
+_current_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_timings_node", default=None)
+
+logger = logging.getLogger("ff_agent.timings")
+if not logger.handlers:
+    # 一行一个 JSON（不依赖 uvicorn 的 logging 配置）
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class RequestTimings:
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()  # sync graph 的并行分支跑在不同线程
+        self.nodes: Dict[str, float] = {}
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.shopify_calls: List[Dict[str, Any]] = []
+        self.cache: Dict[str, str] = {}
+
+    # ---------- 记录点 ----------
+    def node(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.nodes[name] = self.nodes.get(name, 0.0) + seconds
+
+    def llm(self, model: str, seconds: float, wait_seconds: float, ok: bool, usage: Optional[Dict[str, Any]]) -> None:
+        call = {
+            "node": _current_node.get(),
+            "model": model,
+            "ms": _ms(seconds),
+            "queue_ms": _ms(wait_seconds),
+            "ok": ok,
+        }
+        if usage:
+            call["prompt_tokens"] = usage.get("input_tokens")
+            call["completion_tokens"] = usage.get("output_tokens")
+        with self._lock:
+            self.llm_calls.append(call)
+
+    def shopify(self, seconds: float, ok: bool, coalesced: bool = False) -> None:
+        call = {"node": _current_node.get(), "ms": _ms(seconds), "ok": ok}
+        if coalesced:
+            call["coalesced"] = True  # 等的是别的请求发出的同一个查询
+        with self._lock:
+            self.shopify_calls.append(call)
+
+    def cache_result(self, name: str, result: str) -> None:
+        """answer_cache / catalog：hit / miss / bypass；prefetch（投机搜索）：used / discarded / unused"""
+        self.cache[name] = result
+
+    # ---------- 输出 ----------
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_ms": _ms(time.perf_counter() - self.t0),
+                "nodes_ms": {name: _ms(s) for name, s in self.nodes.items()},
+                "shopify_ms": round(sum(c["ms"] for c in self.shopify_calls), 1),
+                "shopify_calls": list(self.shopify_calls),
+                "llm_ms": round(sum(c["ms"] for c in self.llm_calls), 1),
+                "llm_call_count": len(self.llm_calls),
+                "llm_calls": list(self.llm_calls),
+                "cache": dict(self.cache),
+            }
+
+    def log(self, timings: Optional[Dict[str, Any]] = None, **extra: Any) -> Dict[str, Any]:
+        timings = timings or self.to_dict()
+        logger.info(json.dumps({"event": "chat_timings", "thread_id": self.thread_id, **extra, **timings},
+                               ensure_ascii=False))
+        return timings
+
+
+def start(thread_id: str) -> RequestTimings:
+    """在当前 context 开始记录（请求 handler 里调用；handler 结束 context 随之丢弃）"""
+    timings = RequestTimings(thread_id)
+    _current.set(timings)
+    return timings
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def enter_node(name: str) -> contextvars.Token:
+    return _current_node.set(name)
+
+
+def exit_node(token: contextvars.Token) -> None:
+    _current_node.reset(token)
@@ -1,103 +1,436 @@
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from ff_agent import request_timings
+from ff_agent.metrics import SHOPIFY_ERRORS, STOREFRONT_COALESCED, STOREFRONT_SECONDS
+from ff_agent.products import Product
+
 load_dotenv()
 
 SHOP = os.getenv("SHOPIFY_STORE_DOMAIN")
 TOKEN = os.getenv("SHOPIFY_STOREFRONT_TOKEN")
 
 API_VERSION = "2024-07"
-ENDPOINT = f"https://{SHOP}/api/{API_VERSION}/graphql.json"
+# 可用 SHOPIFY_STOREFRONT_ENDPOINT 指向本地 stand-in server（benchmark / 回放）
+ENDPOINT = os.getenv("SHOPIFY_STOREFRONT_ENDPOINT") or f"https://{SHOP}/api/{API_VERSION}/graphql.json"
 
-def storefront_query(query: str, variables: dict | None = None) -> dict:
-    if not SHOP or not TOKEN:
+PRODUCT_URL_PREFIX = "https://foreverfurever.org/products/"
+
+# ---------- 连接池 / 重试参数 ----------
+TIMEOUT_SECONDS = float(os.getenv("SHOPIFY_TIMEOUT_SECONDS", "20"))
+POOL_SIZE = int(os.getenv("SHOPIFY_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("SHOPIFY_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 8.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 相同 (query, variables) 的并发请求共用一个上游请求（活动链接落地时大家同时搜同一个词）
+COALESCE_ENABLED = os.getenv("SHOPIFY_COALESCE", "1") != "0"
+
+
+class StorefrontRetryable(RuntimeError):
+    """429/5xx/THROTTLED：可以退避后重试的错误"""
+    def __init__(self, message: str, delay: float | None = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+def _headers() -> dict:
+    return {
+        "Content-Type": "application/json",
+        "X-Shopify-Storefront-Access-Token": TOKEN or "",
+    }
+
+
+def _check_config():
+    if not os.getenv("SHOPIFY_STOREFRONT_ENDPOINT") and (not SHOP or not TOKEN):
         raise RuntimeError("Missing SHOPIFY_STORE_DOMAIN or SHOPIFY_STOREFRONT_TOKEN in .env")
 
-    resp = requests.post(
-        ENDPOINT,
-        headers={
-            "Content-Type": "application/json",
-            "X-Shopify-Storefront-Access-Token": TOKEN,
-        },
-        json={"query": query, "variables": variables or {}},
-        timeout=20,
-    )
-    resp.raise_for_status()
-    data = resp.json()
 
+def _backoff_delay(attempt: int) -> float:
+    """Full jitter：random(0, base * 2^attempt)，上限 BACKOFF_MAX_SECONDS"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _throttle_delay(data: dict) -> float | None:
+    """
+    根据 extensions.cost.throttleStatus 估算需要等多久才有足够额度：
+    (requestedQueryCost - currentlyAvailable) / restoreRate
+    """
+    cost = (data.get("extensions") or {}).get("cost") or {}
+    status = cost.get("throttleStatus") or {}
+    requested = cost.get("requestedQueryCost")
+    available = status.get("currentlyAvailable")
+    restore = status.get("restoreRate")
+    if requested is None or available is None or not restore:
+        return None
+    return max(0.0, (requested - available) / restore)
+
+
+def _parse_response(status: int, headers, body_json) -> dict:
+    """统一处理 HTTP 状态 + GraphQL errors；可重试的抛 StorefrontRetryable"""
+    if status in RETRY_STATUS:
+        retry_after = headers.get("Retry-After")
+        try:
+            delay = float(retry_after) if retry_after else None
+        except ValueError:
+            delay = None
+        raise StorefrontRetryable(f"Shopify HTTP {status}", delay)
+    if status >= 400:
+        raise RuntimeError(f"Shopify HTTP {status}")
+
+    data = body_json()
     if "errors" in data:
+        codes = {((e.get("extensions") or {}).get("code")) for e in data["errors"]}
+        if "THROTTLED" in codes:
+            raise StorefrontRetryable(f"Shopify GraphQL errors: {data['errors']}", _throttle_delay(data))
         raise RuntimeError(f"Shopify GraphQL errors: {data['errors']}")
     return data["data"]
 
-def search_products(keyword: str, first: int = 6) -> list[dict]:
+
+def _error_kind(err: Exception) -> str:
+    """/metrics 的 ff_shopify_errors_total{kind}：throttled / http / transport / graphql"""
+    if isinstance(err, StorefrontRetryable):
+        return "throttled" if "GraphQL" in str(err) else "http"
+    if isinstance(err, (requests.RequestException, httpx.TransportError)):
+        return "transport"
+    return "http" if str(err).startswith("Shopify HTTP") else "graphql"
+
+
+def _observe_query(t0: float, ok: bool) -> None:
+    elapsed = time.perf_counter() - t0
+    STOREFRONT_SECONDS.labels("ok" if ok else "error").observe(elapsed)
+    timings = request_timings.current()
+    if timings:
+        timings.shopify(elapsed, ok)
+
+
+def _retry_delay(err: Exception, attempt: int) -> float:
+    delay = getattr(err, "delay", None)
+    if delay is not None:
+        # 服务端给了等待时间：在其基础上加一点抖动，避免大家同时醒来
+        return min(BACKOFF_MAX_SECONDS, delay) + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return _backoff_delay(attempt)
+
+
+# =========================
+# Sync client（共享 Session：keep-alive + 有界连接池）
+# =========================
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update(_headers())
+                _session = s
+    return _session
+
+
+def _storefront_request(query: str, variables: dict | None = None) -> dict:
+    _check_config()
+    payload = {"query": query, "variables": variables or {}}
+
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                resp = get_session().post(ENDPOINT, json=payload, timeout=TIMEOUT_SECONDS)
+                data = _parse_response(resp.status_code, resp.headers, resp.json)
+                ok = True
+                return data
+            except (StorefrontRetryable, requests.ConnectionError, requests.Timeout) as e:
+                SHOPIFY_ERRORS.labels(_error_kind(e)).inc()
+                if attempt >= MAX_RETRIES:
+                    raise
+                time.sleep(_retry_delay(e, attempt))
+            except Exception as e:
+                SHOPIFY_ERRORS.labels(_error_kind(e)).inc()
+                raise
+    finally:
+        _observe_query(t0, ok)
+
+
+# =========================
+# Async client（httpx.AsyncClient，每个 event loop 一个共享实例）
+# =========================
+_async_client: httpx.AsyncClient | None = None
+_async_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            headers=_headers(),
+            timeout=TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        _async_loop = loop
+    return _async_client
+
+
+async def aclose_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def _astorefront_request(query: str, variables: dict | None = None) -> dict:
+    _check_config()
+    payload = {"query": query, "variables": variables or {}}
+
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                resp = await get_async_client().post(ENDPOINT, json=payload)
+                data = _parse_response(resp.status_code, resp.headers, resp.json)
+                ok = True
+                return data
+            except (StorefrontRetryable, httpx.TransportError) as e:
+                SHOPIFY_ERRORS.labels(_error_kind(e)).inc()
+                if attempt >= MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_retry_delay(e, attempt))
+            except Exception as e:
+                SHOPIFY_ERRORS.labels(_error_kind(e)).inc()
+                raise
+    finally:
+        _observe_query(t0, ok)
+
+# =========================
+# Single-flight：相同 (query, variables) 的并发调用共用一个进行中的请求
+# =========================
+# - 第一个调用（leader）真正发请求，之后到达的相同调用（follower）等它的结果；请求结束就从表里移除，
+#   不缓存结果（缓存是 catalog / answer_cache 的事），之后的调用照常发新请求
+# - 成功时大家拿到同一个 dict（只读，不要原地修改），失败时大家收到同一个异常
+# - sync（线程）和 async（event loop）各一张表；async 的请求跑在独立 task 里（asyncio.shield），
+#   leader 的调用方被取消不会连累 follower
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_ainflight: dict[str, asyncio.Task] = {}
+_coalesce_stats = {"requests": 0, "coalesced": 0}
+
+
+def _flight_key(query: str, variables: dict | None) -> str:
+    return query + "\0" + json.dumps(variables or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _count_flight(joined: bool, mode: str) -> None:
+    with _inflight_lock:
+        _coalesce_stats["coalesced" if joined else "requests"] += 1
+    if joined:
+        STOREFRONT_COALESCED.labels(mode).inc()
+
+
+def _observe_joined(t0: float, ok: bool) -> None:
+    """follower 只记到本请求的 timings（标 coalesced），不进上游延迟直方图"""
+    timings = request_timings.current()
+    if timings:
+        timings.shopify(time.perf_counter() - t0, ok, coalesced=True)
+
+
+def storefront_query(query: str, variables: dict | None = None) -> dict:
+    if not COALESCE_ENABLED:
+        return _storefront_request(query, variables)
+
+    key = _flight_key(query, variables)
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = Future()
+    _count_flight(not leader, "sync")
+
+    if not leader:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            data = flight.result()
+            ok = True
+            return data
+        finally:
+            _observe_joined(t0, ok)
+
+    try:
+        data = _storefront_request(query, variables)
+    except BaseException as e:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.set_exception(e)
+        raise
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    flight.set_result(data)
+    return data
+
+
+def _forget_flight(key: str, task: asyncio.Task) -> None:
+    if _ainflight.get(key) is task:
+        del _ainflight[key]
+    if not task.cancelled():
+        task.exception()  # 调用方都被取消时也别报 "exception was never retrieved"
+
+
+async def astorefront_query(query: str, variables: dict | None = None) -> dict:
+    if not COALESCE_ENABLED:
+        return await _astorefront_request(query, variables)
+
+    key = _flight_key(query, variables)
+    loop = asyncio.get_running_loop()
+    task = _ainflight.get(key)
+    if task is not None and task.get_loop() is loop:
+        _count_flight(True, "async")
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            data = await asyncio.shield(task)
+            ok = True
+            return data
+        finally:
+            _observe_joined(t0, ok)
+
+    _count_flight(False, "async")
+    # create_task 复制当前 context：leader 的 request_timings / 节点名照常记录上游耗时
+    task = loop.create_task(_astorefront_request(query, variables))
+    _ainflight[key] = task
+    task.add_done_callback(lambda t: _forget_flight(key, t))
+    return await asyncio.shield(task)
+
+
+def coalesce_stats() -> dict:
+    with _inflight_lock:
+        sent, coalesced = _coalesce_stats["requests"], _coalesce_stats["coalesced"]
+        in_flight = len(_inflight)
+    total = sent + coalesced
+    return {
+        "enabled": COALESCE_ENABLED,
+        "upstream_requests": sent,
+        "coalesced_calls": coalesced,
+        "coalesced_rate": round(coalesced / total, 3) if total else None,
+        "in_flight": in_flight + len(_ainflight),
+    }
+
+# 最小的 Storefront 查询：只为建连接（启动预热）
+WARMUP_QUERY = "{ shop { name } }"
+
+
+async def awarm_up(connections: int = 1) -> None:
+    """预先打开 async 连接池里的 connections 条连接（并发发出去才会各占一条），第一个真实请求不用再握手；
+    绕过 single-flight，否则这几个相同的查询会合并成一个请求、只占一条连接"""
+    await asyncio.gather(*(_astorefront_request(WARMUP_QUERY) for _ in range(connections)))
+
+
+def product_from_node(p: dict) -> Product:
+    """Storefront product node -> Product（对外的 dict 由 Product.to_dict() 生成）"""
+    return Product.from_node(p, PRODUCT_URL_PREFIX)
+
+PRODUCT_FIELDS = """
+fragment ProductFields on ProductConnection {
+  edges {
+    node {
+      title
+      handle
+      availableForSale
+      priceRange {
+        minVariantPrice { amount currencyCode }
+      }
+    }
+  }
+}
+"""
+
+QUERY_LATEST = """
+query LatestProducts($first: Int!) {
+  products(first: $first, sortKey: UPDATED_AT, reverse: true) { ...ProductFields }
+}
+""" + PRODUCT_FIELDS
+
+# 一个请求同时拿 keyword 结果和最新 N 个（alias）：搜不到 / 预算内没有时的兜底在本地挑，不再追加请求
+QUERY_SEARCH_WITH_LATEST = """
+query SearchWithLatest($q: String!, $first: Int!, $latest: Int!) {
+  matches: products(first: $first, query: $q, sortKey: UPDATED_AT, reverse: true) { ...ProductFields }
+  latest: products(first: $latest, sortKey: UPDATED_AT, reverse: true) { ...ProductFields }
+}
+""" + PRODUCT_FIELDS
+
+def _search_q(keyword: str) -> str:
+    # query 可能命中 title/product_type/tag
+    return f'title:*{keyword}* OR product_type:*{keyword}* OR tag:*{keyword}*'
+
+def _products_from_data(data: dict, alias: str = "products") -> list[Product]:
+    edges = (data.get(alias) or {}).get("edges", [])
+    return [product_from_node(e["node"]) for e in edges]
+
+def _search_with_latest_request(keyword: str, first: int, latest: int) -> tuple[str, dict]:
+    if keyword:
+        return QUERY_SEARCH_WITH_LATEST, {"q": _search_q(keyword), "first": first, "latest": latest}
+    return QUERY_LATEST, {"first": latest}
+
+def _split_search_with_latest(keyword: str, data: dict) -> tuple[list[Product], list[Product]]:
+    if keyword:
+        return _products_from_data(data, "matches"), _products_from_data(data, "latest")
+    return [], _products_from_data(data)
+
+def _from_catalog(catalog) -> bool:
+    ready = catalog.is_ready()
+    timings = request_timings.current()
+    if timings:
+        timings.cache_result("catalog", "hit" if ready else "miss")
+    return ready
+
+def search_products_with_latest(keyword: str, first: int = 6, latest: int = 12) -> tuple[list[Product], list[Product]]:
     """
-    先按 keyword 搜索；如果搜不到结果，就兜底返回最新的 first 个商品。
+    返回 (keyword 命中的前 first 个, 最新的 latest 个)。
+    线上路径只发一个 GraphQL 请求；本地商品快照就绪时直接查内存。keyword 为空时 matches 为空。
     """
+    from ff_agent.catalog import catalog
+
     keyword = (keyword or "").strip()
-    results: list[dict] = []
+    if _from_catalog(catalog):
+        return catalog.match(keyword, first), catalog.latest(latest)
+    query, variables = _search_with_latest_request(keyword, first, latest)
+    return _split_search_with_latest(keyword, storefront_query(query, variables))
 
-    # 1) 先尝试按 keyword 搜索（query 可能命中 title/product_type/tag）
-    if keyword:
-        q = f'title:*{keyword}* OR product_type:*{keyword}* OR tag:*{keyword}*'
-
-        query_search = """
-        query SearchProducts($q: String!, $first: Int!) {
-          products(first: $first, query: $q, sortKey: UPDATED_AT, reverse: true) {
-            edges {
-              node {
-                title
-                handle
-                availableForSale
-                priceRange {
-                  minVariantPrice { amount currencyCode }
-                }
-              }
-            }
-          }
-        }
-        """
-        data = storefront_query(query_search, {"q": q, "first": first})
-        edges = data.get("products", {}).get("edges", [])
-        for e in edges:
-            p = e["node"]
-            results.append({
-                "title": p["title"],
-                "handle": p["handle"],
-                "available": p["availableForSale"],
-                "price": f'{p["priceRange"]["minVariantPrice"]["amount"]} {p["priceRange"]["minVariantPrice"]["currencyCode"]}',
-                "url": f"https://foreverfurever.org/products/{p['handle']}",
-            })
-
-    # 2) 如果搜索没结果：兜底返回最新商品（不带 query）
-    if not results:
-        query_fallback = """
-        query LatestProducts($first: Int!) {
-          products(first: $first, sortKey: UPDATED_AT, reverse: true) {
-            edges {
-              node {
-                title
-                handle
-                availableForSale
-                priceRange {
-                  minVariantPrice { amount currencyCode }
-                }
-              }
-            }
-          }
-        }
-        """
-        data = storefront_query(query_fallback, {"first": first})
-        edges = data.get("products", {}).get("edges", [])
-        for e in edges:
-            p = e["node"]
-            results.append({
-                "title": p["title"],
-                "handle": p["handle"],
-                "available": p["availableForSale"],
-                "price": f'{p["priceRange"]["minVariantPrice"]["amount"]} {p["priceRange"]["minVariantPrice"]["currencyCode"]}',
-                "url": f"https://foreverfurever.org/products/{p['handle']}",
-            })
-
-    return results
+async def asearch_products_with_latest(keyword: str, first: int = 6, latest: int = 12) -> tuple[list[Product], list[Product]]:
+    from ff_agent.catalog import catalog
+
+    keyword = (keyword or "").strip()
+    if _from_catalog(catalog):
+        return catalog.match(keyword, first), catalog.latest(latest)
+    query, variables = _search_with_latest_request(keyword, first, latest)
+    return _split_search_with_latest(keyword, await astorefront_query(query, variables))
+
+def search_products(keyword: str, first: int = 6) -> list[Product]:
+    """
+    先按 keyword 搜索；如果搜不到结果，就兜底返回最新的 first 个商品（同一个请求里取回）。
+    本地商品快照（ff_agent.catalog）就绪时直接查内存，不再请求 Shopify。
+    """
+    matches, latest = search_products_with_latest(keyword, first=first, latest=first)
+    return matches or latest
 
+async def asearch_products(keyword: str, first: int = 6) -> list[Product]:
+    """search_products 的 async 版本（给 async graph 节点用）"""
+    matches, latest = await asearch_products_with_latest(keyword, first=first, latest=first)
+    return matches or latest
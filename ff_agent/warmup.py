@@ -0,0 +1,103 @@
+# ff_agent/warmup.py
+"""
+启动预热 + readiness（冷启动优化）
+
+以前 import api_server 时就导入 langgraph / langchain_openai / openai、读知识稿、编译 graph（约 1s），
+第一个真实请求还要付到 OpenAI / Shopify 的 DNS + TLS 握手。现在：
+- import 只导入 FastAPI 和轻量模块，端口马上能开（GET /health/live 可用）
+- lifespan 里启动后台预热：先在一个线程里做完重依赖的 import、构建 graph
+  （import 是纯 CPU，分几个线程并行只会抢 GIL，反而更慢），再并行预先打开 OpenAI / Shopify 连接池里的连接、拉商品快照
+- 全部完成前 GET /health 返回 503（ready=false），负载均衡不导流量；这期间进来的 /chat 等预热完成
+  （最多 WARMUP_WAIT_SECONDS），不会各自再建一遍
+
+连接预热 / 商品快照失败不影响 ready（之后照常按需建连接），只记在 stats 里；graph 构建失败则一直不 ready。
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "30"))
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class Warmup:
+    def __init__(self):
+        self.state = "cold"  # cold → warming → ready / failed
+        self.phases_ms: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.ready_after_ms: Optional[float] = None  # 从进程导入本模块算起
+        self._t0 = time.perf_counter()
+        self._event: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._event is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self, build: Callable[[], Any], connections: Dict[str, Callable[[], Awaitable[Any]]]) -> None:
+        """build：同步构建（在线程里跑，必须成功）；connections：之后并行跑的异步预热步骤，失败只记录"""
+        self._event = asyncio.Event()
+        self.state = "warming"
+        self._task = asyncio.create_task(self._run(build, connections))
+
+    async def _timed(self, name: str, step: Callable[[], Awaitable[Any]], timeout: Optional[float]) -> bool:
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.errors[name] = f"timed out after {timeout}s"
+        except Exception as e:
+            self.errors[name] = f"{type(e).__name__}: {e}"
+        finally:
+            self.phases_ms[name] = _ms(time.perf_counter() - t0)
+        return False
+
+    async def _run(self, build, connections) -> None:
+        try:
+            if not await self._timed("build", lambda: asyncio.to_thread(build), None):
+                self.state = "failed"
+                return
+            await asyncio.gather(*(
+                self._timed(name, step, WARMUP_TIMEOUT_SECONDS) for name, step in connections.items()
+            ))
+            self.state = "ready"
+            self.ready_after_ms = _ms(time.perf_counter() - self._t0)
+        finally:
+            self._event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """等预热结束（最多 timeout 秒）；返回是否 ready"""
+        if self._event is None:
+            return self.ready
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready_after_ms": self.ready_after_ms,
+            "phases_ms": dict(self.phases_ms),
+            "errors": dict(self.errors),
+        }
+
+
+warmup = Warmup()
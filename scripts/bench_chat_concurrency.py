@@ -0,0 +1,112 @@
+"""
+/chat 并发 benchmark（本地 fake OpenAI + fake Storefront，不花真实 API 费用）
+
+对比同一个 graph 的两种调用方式：
+- sync_threadpool：旧的 `def chat` —— graph.invoke 跑在 Starlette threadpool（默认 40 个 slot）
+- async：新的 `async def chat` —— await graph.ainvoke，全程不占线程
+
+用法：
+    python scripts/bench_chat_concurrency.py --concurrency 50 200 --llm-latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import anyio
+
+from fake_upstreams import spawn_upstreams
+
+MESSAGES = [
+    "I need a pet urn for ashes, it's a gift",
+    "Can you recommend a memorial keepsake gift for my friend?",
+    "What personalized engraving options do you have? It's a gift for my sister.",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def run_level(graph, mode: str, concurrency: int, total: int) -> dict:
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        payload = {"user_message": MESSAGES[i % len(MESSAGES)]}
+        config = {"configurable": {"thread_id": f"bench_{mode}_{concurrency}_{i}"}}
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                if mode == "async":
+                    await graph.ainvoke(payload, config=config)
+                else:
+                    await anyio.to_thread.run_sync(lambda: graph.invoke(payload, config=config))
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - t0
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "errors": errors,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    ap.add_argument("--requests-per-level", type=int, default=0, help="默认 = 2 × concurrency")
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0)
+    ap.add_argument("--shopify-latency-ms", type=float, default=80.0)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, args.shopify_latency_ms)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "SHOPIFY_POOL_SIZE": "50",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "CATALOG_ENABLED": "0",  # 走真实（fake）Shopify 请求路径
+    })
+
+    from ff_agent.graph import build_graph
+    graph = build_graph("You are a compassionate assistant (benchmark).")
+
+    async def run_all():
+        out = []
+        for c in args.concurrency:
+            total = args.requests_per_level or 2 * c
+            for mode in ("sync_threadpool", "async"):
+                out.append(await run_level(graph, mode, c, total))
+        return out
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        proc.terminate()
+    print(json.dumps({"args": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
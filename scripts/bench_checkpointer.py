@@ -0,0 +1,208 @@
+"""
+Checkpointer benchmark：MemorySaver vs SQLiteCheckpointer（本地 fake OpenAI + fake Storefront）
+
+每轮对话（一次 graph.invoke）里 checkpointer 的读 / 写次数、耗时和写入字节数，
+CHECKPOINT_MODE=step（每个节点后存完整 state）vs turn（一轮结束存一次，只存 profile / intent）各跑一遍，
+并确认两种模式下多轮之后的 profile 一致；
+另外起几个进程同时写同一个 SQLite 库，确认 WAL + busy_timeout 下没有 "database is locked"，
+最后检查 thread 上限的 LRU 淘汰。
+
+用法：
+    python scripts/bench_checkpointer.py --threads 200 --turns 3 --processes 4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import spawn_upstreams
+
+TURNS = [
+    "I need a pet urn for ashes under $60.",
+    "#choice:occasion=gift",
+    "Can I engrave \"Max\" on it?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def instrument(saver):
+    """包一层计时：按方法记录每次调用耗时（ms）；序列化写入的字节数记在 timings["bytes"]"""
+    timings = {"get_tuple": [], "put": [], "put_writes": []}
+    dumps = saver.serde.dumps_typed
+    written = []
+
+    def counting_dumps(obj):
+        out = dumps(obj)
+        written.append(len(out[1]))
+        return out
+
+    saver.serde.dumps_typed = counting_dumps
+    for name in timings:
+        fn = getattr(saver, name)
+
+        def timed(*a, _fn=fn, _out=timings[name], **kw):
+            t0 = time.perf_counter()
+            try:
+                return _fn(*a, **kw)
+            finally:
+                _out.append((time.perf_counter() - t0) * 1000)
+
+        setattr(saver, name, timed)
+    return timings, written
+
+
+def run_backend(backend: str, mode: str, db_path: str, threads: int, turns: int) -> dict:
+    from ff_agent import checkpointer as ckpt
+    from ff_agent import graph as graph_mod
+
+    durability = "exit" if mode == "turn" else "async"  # 和 checkpointer.CHECKPOINT_DURABILITY 同一规则
+    drop = graph_mod.TRANSIENT_FIELDS if mode == "turn" else ()
+    if backend == "memory":
+        saver = ckpt.TurnMemorySaver(drop) if drop else ckpt.MemorySaver()
+    else:
+        saver = ckpt.SQLiteCheckpointer(db_path, drop_channels=drop)
+    timings, written = instrument(saver)
+    graph_mod.make_checkpointer = lambda **_: saver
+    graph = graph_mod.build_graph("You are a compassionate assistant (benchmark).")
+
+    n_turns = 0
+    profiles = []
+    t0 = time.perf_counter()
+    for i in range(threads):
+        config = {"configurable": {"thread_id": f"bench_{backend}_{i}"}}
+        for msg in TURNS[:turns]:
+            state = graph.invoke({"user_message": msg}, config=config, durability=durability)
+            n_turns += 1
+        profiles.append(state["profile"])
+    elapsed = time.perf_counter() - t0
+
+    stored = saver.get_tuple({"configurable": {"thread_id": f"bench_{backend}_0"}}).checkpoint["channel_values"]
+    out = {
+        "backend": backend,
+        "mode": mode,
+        "turns": n_turns,
+        "turn_avg_ms": round(elapsed * 1000 / n_turns, 2),
+        "writes_per_turn": round((len(timings["put"]) + len(timings["put_writes"])) / n_turns, 1),
+        "bytes_per_turn": round(sum(written) / n_turns),
+        "stored_fields": sorted(k for k in stored if k in graph_mod.GraphState.__annotations__),
+        "final_profile": profiles[0],
+    }
+    for name, values in timings.items():
+        if not values:
+            out[name] = {"per_turn": 0.0}
+            continue
+        out[name] = {
+            "per_turn": round(len(values) / n_turns, 1),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "total_per_turn_ms": round(sum(values) / n_turns, 3),
+        }
+    if backend == "sqlite":
+        out["db_bytes"] = sum(p.stat().st_size for p in Path(db_path).parent.glob(Path(db_path).name + "*"))
+    return out
+
+
+def _writer(db_path: str, worker: int, n: int, q):
+    from ff_agent.checkpointer import SQLiteCheckpointer
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    saver = SQLiteCheckpointer(db_path)
+    errors = 0
+    for i in range(n):
+        config = {"configurable": {"thread_id": f"mp_{worker}_{i % 20}", "checkpoint_ns": ""}}
+        try:
+            cfg = saver.put(config, empty_checkpoint(), {"step": i}, {})
+            saver.put_writes(cfg, [("profile", {"i": i})], task_id=f"t{i}")
+            saver.get_tuple(config)
+        except Exception:
+            errors += 1
+    q.put(errors)
+
+
+def run_multiprocess(db_path: str, processes: int, n: int) -> dict:
+    q = mp.Queue()
+    t0 = time.perf_counter()
+    procs = [mp.Process(target=_writer, args=(db_path, w, n, q)) for w in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "processes": processes,
+        "ops_per_process": n,
+        "errors": sum(q.get() for _ in procs),
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+def run_eviction(db_path: str, max_threads: int) -> dict:
+    from ff_agent.checkpointer import SQLiteCheckpointer
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    saver = SQLiteCheckpointer(db_path, max_threads=max_threads, sweep_seconds=3600)
+    for i in range(max_threads * 3):
+        saver.put({"configurable": {"thread_id": f"lru_{i}", "checkpoint_ns": ""}}, empty_checkpoint(), {}, {})
+    saver.sweep()
+    newest = saver.get_tuple({"configurable": {"thread_id": f"lru_{max_threads * 3 - 1}"}}) is not None
+    oldest = saver.get_tuple({"configurable": {"thread_id": "lru_0"}}) is not None
+    return {"max_threads": max_threads, "threads_after": saver.stats()["threads"], "evicted": saver.evicted,
+            "newest_kept": newest, "oldest_kept": oldest}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=100, help="对话数")
+    ap.add_argument("--turns", type=int, default=3, help="每个对话轮数")
+    ap.add_argument("--processes", type=int, default=4)
+    ap.add_argument("--ops-per-process", type=int, default=500)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(0, 0)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "ANSWER_CACHE_ENABLED": "0",
+        "LLM_RPM_LIMIT": "0",  # 本地 stand-in 不限速；否则几百轮之后被客户端令牌桶拖慢，turn_avg_ms 没法比
+        "LLM_TPM_LIMIT": "0",
+    })
+
+    tmp = tempfile.mkdtemp(prefix="ckpt_bench_")
+    try:
+        results = [
+            run_backend(backend, mode, os.path.join(tmp, f"turns_{mode}.sqlite"), args.threads, args.turns)
+            for backend in ("memory", "sqlite") for mode in ("step", "turn")
+        ]
+    finally:
+        proc.terminate()
+    # 两种模式下多轮之后的 profile 应该一样（turn 模式不丢跨轮状态）
+    profiles = {json.dumps(r.pop("final_profile"), sort_keys=True) for r in results}
+
+    report = {
+        "args": vars(args),
+        "per_turn": results,
+        "profile_same_across_modes": len(profiles) == 1,
+        "multiprocess": run_multiprocess(os.path.join(tmp, "mp.sqlite"), args.processes, args.ops_per_process),
+        "eviction": run_eviction(os.path.join(tmp, "lru.sqlite"), 50),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+FAQ 快速路径 benchmark：policy 问题走预生成回答 vs 走 LLM（本地 fake OpenAI + fake Storefront）
+
+一组中英文 policy 问题（包含应该 miss 的：投诉、带订单号、多个主题、知识稿没有的），
+FAQ 关 / 开各跑一遍（answer cache 关掉，单独看快速路径），报告：
+每轮延迟 p50 / p95、每轮 LLM 调用数、快速路径命中率和 miss 原因。
+
+用法：
+    python scripts/bench_faq.py --llm-latency-ms 300 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import spawn_upstreams
+
+POLICY_QUESTIONS = [
+    "What's your return policy?",
+    "Can I get a refund if I change my mind?",
+    "How much is shipping?",
+    "Do you ship to Canada?",
+    "Where can I track my order?",
+    "退款政策是什么？",
+    "退货怎么办？",
+    "发货要多久？",
+    "怎么查物流？",
+    # 下面这些应该走 LLM
+    "My urn arrived damaged, can I get a refund?",
+    "I want a refund for order #10234",
+    "Who pays return shipping?",
+    "Do you offer a warranty?",
+    "我的订单还没到，能退款吗",
+    "What are your policies?",
+    "What is your warranty policy if the light breaks after a year?",
+    "Do you accept PayPal or Apple Pay as payment policy?",
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def run_mode(graph, request_timings, enabled: bool, rounds: int) -> dict:
+    from ff_agent import faq
+    faq.FAQ_ENABLED = enabled
+    table = faq.FaqTable.from_file()  # 新表 = 新计数
+    faq.faq_table.__dict__.update(table.__dict__)
+
+    latencies, llm_calls = [], []
+
+    async def one(i: int, msg: str):
+        timings = request_timings.start(f"faq_{enabled}_{i}")
+        t0 = time.perf_counter()
+        await graph.ainvoke({"user_message": msg}, config={"configurable": {"thread_id": f"faq_{enabled}_{i}"}})
+        latencies.append((time.perf_counter() - t0) * 1000)
+        llm_calls.append(timings.to_dict()["llm_call_count"])
+
+    n = 0
+    for _ in range(rounds):
+        for msg in POLICY_QUESTIONS:
+            await one(n, msg)
+            n += 1
+
+    stats = faq.faq_table.stats()
+    return {
+        "faq_enabled": enabled,
+        "turns": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "llm_calls_per_turn": round(sum(llm_calls) / len(llm_calls), 2),
+        "hit_rate": stats["hit_rate"] if enabled else 0.0,
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, 30)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "CHECKPOINTER": "memory",
+        "CATALOG_ENABLED": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+    })
+    from ff_agent import graph as graph_mod, request_timings
+
+    try:
+        graph = graph_mod.build_graph("You are a compassionate assistant (benchmark).")
+
+        async def run_all():
+            return [await run_mode(graph, request_timings, enabled, args.rounds) for enabled in (False, True)]
+
+        results = asyncio.run(run_all())
+    finally:
+        proc.terminate()
+    print(json.dumps({"args": vars(args), "questions": len(POLICY_QUESTIONS), "results": results},
+                     indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
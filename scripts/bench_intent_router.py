@@ -0,0 +1,98 @@
+"""
+intent 路由 micro-benchmark：旧的 `any(k in msg for k in [...])` 链 vs Aho-Corasick 自动机
+
+在真实规则表（data/intent_rules.json）上追加随机关键词（中英文各半），
+看每条消息的路由耗时随关键词表大小的变化。
+
+用法：
+    python scripts/bench_intent_router.py --sizes 0 100 1000 5000
+"""
+import argparse
+import json
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ff_agent.intent_router import INTENT_RULES_PATH, IntentRouter
+
+MESSAGES = [
+    "I need a pet urn for ashes under $60.",
+    "What’s your return policy?",
+    "Can you recommend a memorial keepsake gift for my friend?",
+    "What personalized engraving options do you have? It's a gift for my sister.",
+    "我想买一个60刀以内的纪念品",
+    "可以刻字吗？想送人",
+    "hello",
+    "My cat passed away last week and I'm looking for something to remember her by, "
+    "ideally small enough to carry when I travel, and I'd like her name on it.",
+]
+
+
+def random_keyword(rng: random.Random) -> str:
+    if rng.random() < 0.5:
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12)))
+    return "".join(chr(rng.randint(0x4E00, 0x9FFF)) for _ in range(rng.randint(2, 4)))
+
+
+def load_config(extra: int, seed: int = 0) -> dict:
+    config = json.loads(INTENT_RULES_PATH.read_text(encoding="utf-8"))
+    rng = random.Random(seed)
+    for i in range(extra):
+        config["rules"][i % len(config["rules"])]["keywords"].append(random_keyword(rng))
+    return config
+
+
+def make_linear_router(config: dict):
+    """旧实现的形状：按优先级依次 any() 扫每组关键词"""
+    groups = sorted(config["rules"], key=lambda g: -g["priority"])
+    tables = [(g["intent"], [k.lower() for k in g["keywords"]]) for g in groups]
+
+    def route(msg: str) -> str:
+        msg_lower = msg.lower()
+        for intent, keywords in tables:
+            if any(k in msg_lower for k in keywords):
+                return intent
+        return config.get("default_intent", "other")
+
+    return route
+
+
+def time_per_call_us(fn, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for m in MESSAGES:
+            fn(m)
+    return (time.perf_counter() - t0) * 1e6 / (rounds * len(MESSAGES))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[0, 100, 1000, 5000], help="追加的随机关键词数")
+    ap.add_argument("--rounds", type=int, default=500)
+    args = ap.parse_args()
+
+    results = []
+    for extra in args.sizes:
+        config = load_config(extra)
+        t0 = time.perf_counter()
+        router = IntentRouter.from_config(config)
+        build_ms = (time.perf_counter() - t0) * 1000
+        linear = make_linear_router(config)
+
+        mismatches = [m for m in MESSAGES if router.route(m) != linear(m)]
+        results.append({
+            "keywords": router.size,
+            "build_ms": round(build_ms, 1),
+            "linear_us_per_msg": round(time_per_call_us(linear, args.rounds), 2),
+            "automaton_us_per_msg": round(time_per_call_us(router.route, args.rounds), 2),
+            "mismatches": mismatches,
+        })
+    print(json.dumps({"args": vars(args), "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+投机商品搜索 benchmark（本地 fake OpenAI + fake Storefront，不花真实 API 费用）
+
+对比 product 轮次的端到端延迟：
+- sequential：PREFETCH_ENABLED=0，extract_profile（LLM）结束后 answer 才查 Shopify
+- prefetch：Shopify 搜索和 extract_profile 并行，answer 直接用投机结果
+
+走线上（fake）Shopify 路径（CATALOG_ENABLED=0），answer cache 关闭。
+
+用法：
+    python scripts/bench_prefetch.py --rounds 20 --llm-latency-ms 300 --shopify-latency-ms 150
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import spawn_upstreams
+
+# 都会走到 answer；前两条需要 LLM 抽 profile（规则抽不全），最后一条规则就够
+PRODUCT_TURNS = [
+    "Can you recommend a memorial keepsake gift for my friend?",
+    "I'm looking for an urn for ashes, it's a gift for my sister.",
+    "pet urn for ashes gift under $60",
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def run_mode(graph, graph_mod, mode: str, rounds: int) -> dict:
+    graph_mod.PREFETCH_ENABLED = mode == "prefetch"
+    per_message = {m: [] for m in PRODUCT_TURNS}
+    for i in range(rounds):
+        for j, msg in enumerate(PRODUCT_TURNS):
+            config = {"configurable": {"thread_id": f"bench_{mode}_{i}_{j}"}}
+            t0 = time.perf_counter()
+            result = await graph.ainvoke({"user_message": msg}, config=config)
+            per_message[msg].append((time.perf_counter() - t0) * 1000)
+            assert not result.get("needs_clarification"), msg
+    all_ms = [v for vs in per_message.values() for v in vs]
+    return {
+        "mode": mode,
+        "turns": len(all_ms),
+        "mean_ms": round(statistics.mean(all_ms), 1),
+        "p50_ms": round(percentile(all_ms, 50), 1),
+        "p95_ms": round(percentile(all_ms, 95), 1),
+        "per_message_mean_ms": {m: round(statistics.mean(v), 1) for m, v in per_message.items()},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=10)
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0)
+    ap.add_argument("--shopify-latency-ms", type=float, default=150.0)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, args.shopify_latency_ms)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "CATALOG_ENABLED": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+        "CHECKPOINTER": "memory",
+    })
+
+    from ff_agent import graph as graph_mod
+    graph = graph_mod.build_graph("You are a compassionate assistant (benchmark).")
+
+    async def run_all():
+        # 先热身一轮（建立连接池）
+        await run_mode(graph, graph_mod, "sequential", 1)
+        return [await run_mode(graph, graph_mod, mode, args.rounds) for mode in ("sequential", "prefetch")]
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        proc.terminate()
+
+    seq, pre = results
+    print(json.dumps({
+        "args": vars(args),
+        "results": results,
+        "saved_mean_ms": round(seq["mean_ms"] - pre["mean_ms"], 1),
+        "saved_per_message_ms": {
+            m: round(seq["per_message_mean_ms"][m] - pre["per_message_mean_ms"][m], 1) for m in PRODUCT_TURNS
+        },
+        "prefetch_stats": graph_mod.prefetch_stats(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
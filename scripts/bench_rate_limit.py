@@ -0,0 +1,141 @@
+"""
+LLM 限流 benchmark（本地 fake OpenAI 模拟账号 RPM 限额，不花真实 API 费用）
+
+N 个虚拟用户持续发需要两次 LLM 调用（extract_profile + answer）的轮次，对比：
+- no_retry：不限流、不重试（≈ 以前：撞到 429 整轮失败；现在这些轮次会降级成模板回答）
+- backoff：只在 429 时指数退避重试
+- bucket+backoff：客户端 RPM bucket 先把请求摊平（额度设为上游的 90%），再加退避重试
+
+用法：
+    python scripts/bench_rate_limit.py --users 30 --duration 15 --upstream-rpm 600
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import spawn_upstreams
+
+MESSAGES = [
+    "Can you recommend a memorial keepsake gift for my friend?",
+    "I'm looking for an urn for ashes, it's a gift for my sister.",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def configure(llm_gateway, mode: str, client_rpm: int):
+    llm_gateway.LLM_RPM_LIMIT = client_rpm if mode == "bucket+backoff" else 0
+    llm_gateway.LLM_TPM_LIMIT = 0
+    llm_gateway.LLM_RATE_BURST_SECONDS = 1.0
+    llm_gateway.LLM_MAX_RETRIES = 0 if mode == "no_retry" else 4
+    llm_gateway.gateway._limiters.clear()
+
+
+def degraded_counts(metrics) -> dict:
+    return {
+        sample.labels["node"]: sample.value
+        for family in metrics.LLM_DEGRADED.collect()
+        for sample in family.samples
+        if sample.name.endswith("_total")
+    }
+
+
+async def run_mode(graph, llm_gateway, metrics, mode: str, users: int, duration: float, client_rpm: int) -> dict:
+    configure(llm_gateway, mode, client_rpm)
+    before = degraded_counts(metrics)
+    latencies, degraded_turns, errors = [], 0, 0
+    stop_at = time.perf_counter() + duration
+
+    async def user(uid: int):
+        nonlocal degraded_turns, errors
+        n = 0
+        while time.perf_counter() < stop_at:
+            msg = MESSAGES[(uid + n) % len(MESSAGES)]
+            config = {"configurable": {"thread_id": f"rl_{mode}_{uid}_{n}"}}
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                result = await graph.ainvoke({"user_message": msg}, config=config)
+                if (result.get("tool_error") or "").startswith("LLM unavailable"):
+                    degraded_turns += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    elapsed = time.perf_counter() - t0
+
+    after = degraded_counts(metrics)
+    lim = llm_gateway.gateway.limiter(llm_gateway.DEFAULT_MODEL)
+    return {
+        "mode": mode,
+        "turns": len(latencies),
+        "throughput_tps": round(len(latencies) / elapsed, 2),
+        "answers_degraded": degraded_turns,
+        "degraded_by_node": {k: int(after.get(k, 0) - before.get(k, 0)) for k in after},
+        "errors": errors,
+        "upstream_failed_calls": lim.errors,
+        "rate_limit": lim.rate.stats(),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=30)
+    ap.add_argument("--duration", type=float, default=15.0)
+    ap.add_argument("--upstream-rpm", type=int, default=600, help="fake OpenAI 的 RPM 限额")
+    ap.add_argument("--client-rpm-share", type=float, default=0.9, help="客户端 bucket 额度占上游限额的比例")
+    ap.add_argument("--llm-latency-ms", type=float, default=200.0)
+    args = ap.parse_args()
+    client_rpm = int(args.upstream_rpm * args.client_rpm_share)
+
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "CATALOG_ENABLED": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+        "CHECKPOINTER": "memory",
+        "LLM_MAX_CONCURRENCY": "64",
+    })
+
+    results = []
+    for mode in ("no_retry", "backoff", "bucket+backoff"):
+        # 每个模式一个新的 fake OpenAI，额度从满的开始
+        proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, 30, llm_rpm_limit=args.upstream_rpm)
+        os.environ.update({"SHOPIFY_STOREFRONT_ENDPOINT": sf_url, "OPENAI_BASE_URL": openai_url})
+        try:
+            from ff_agent import graph as graph_mod, llm_gateway, metrics, shopify_storefront
+            # 指向这一轮的 fake server（ChatOpenAI 创建时读 OPENAI_BASE_URL，清掉缓存的 client 即可）
+            shopify_storefront.ENDPOINT = sf_url
+            llm_gateway.gateway._clients.clear()
+            llm_gateway.gateway._async_clients.clear()
+            graph = graph_mod.build_graph("You are a compassionate assistant (benchmark).")
+            results.append(asyncio.run(
+                run_mode(graph, llm_gateway, metrics, mode, args.users, args.duration, client_rpm)
+            ))
+        finally:
+            proc.terminate()
+
+    print(json.dumps({"args": {**vars(args), "client_rpm": client_rpm}, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
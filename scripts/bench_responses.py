@@ -0,0 +1,172 @@
+"""
+响应体积 / 序列化 benchmark：静态页面和 /chat JSON，以前的写法 vs 现在（本地 fake OpenAI + fake Storefront）
+
+1. 静态页面：以前的路由（FileResponse + StaticFiles，在本脚本里原样重建）vs 现在的 api_server.app，
+   浏览器式 Accept-Encoding 下首次访问、再次访问（带上次拿到的 ETag / Last-Modified 条件请求）的线上字节数（头 + 体），
+   以及 Cache-Control（有 max-age 时缓存期内再次访问根本不发请求）
+2. /chat：先用真实 graph 跑几类对话拿到响应 dict（商品回答、追问、FAQ、中文、带 debug timings），再比较
+   - 以前：FastAPI 处理返回的 dict（jsonable_encoder + JSONResponse），不压缩
+   - 现在：json_response（orjson + 超过阈值时 gzip / br）
+   每个响应的字节数和序列化耗时（µs，--iterations 次取平均）
+
+用法：
+    python scripts/bench_responses.py --iterations 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+
+from fake_upstreams import spawn_upstreams
+
+BROWSER_ACCEPT_ENCODING = "gzip, deflate, br"
+
+CHAT_CASES = [
+    ("product_answer", "I need a pet urn for ashes, gift, under $60.", False),
+    ("clarify", "I want something under $60.", False),
+    ("policy_faq", "What's your return policy?", False),
+    ("chinese_answer", "我想给我的狗买一个骨灰盒，送礼，60刀以内", False),
+    ("product_answer_debug", "pet urn for ashes gift under $60", True),
+]
+
+
+def wire_bytes(r: httpx.Response) -> int:
+    """状态行 + 头 + 体（未解压）的近似线上字节数"""
+    head = len(f"HTTP/1.1 {r.status_code} {r.reason_phrase}\r\n") + 2
+    head += sum(len(k) + len(v) + 4 for k, v in r.headers.raw)
+    return head + r.num_bytes_downloaded
+
+
+def legacy_app(static_dir: Path):
+    """改动之前的静态路由"""
+    from fastapi import FastAPI
+    from fastapi.responses import FileResponse
+    from fastapi.staticfiles import StaticFiles
+
+    app = FastAPI()
+
+    @app.get("/")
+    def root():
+        return FileResponse(static_dir / "chat.html")
+
+    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    return app
+
+
+async def visit(app, path: str) -> dict:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        headers = {"accept-encoding": BROWSER_ACCEPT_ENCODING}
+        first = await client.get(path, headers=headers)
+        conditional = dict(headers)
+        if first.headers.get("etag"):
+            conditional["if-none-match"] = first.headers["etag"]
+        if first.headers.get("last-modified"):
+            conditional["if-modified-since"] = first.headers["last-modified"]
+        repeat = await client.get(path, headers=conditional)
+    return {
+        "first_visit_bytes": wire_bytes(first),
+        "content_encoding": first.headers.get("content-encoding", "identity"),
+        "cache_control": first.headers.get("cache-control"),
+        "revalidate_status": repeat.status_code,
+        "revalidate_bytes": wire_bytes(repeat),
+    }
+
+
+def static_report(api_server) -> dict:
+    old, new = legacy_app(api_server.STATIC_DIR), api_server.app
+    out = {}
+    for path in ("/", "/static/chat.html"):
+        out[path] = {"before": asyncio.run(visit(old, path)), "after": asyncio.run(visit(new, path))}
+    return out
+
+
+async def chat_bodies(api_server) -> dict:
+    bodies = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_server.app), base_url="http://bench",
+                                 timeout=60) as client:
+        for name, message, debug in CHAT_CASES:
+            r = await client.post("/chat", json={"message": message, "thread_id": f"bench_{name}", "debug": debug})
+            bodies[name] = r.json()
+    return bodies
+
+
+def mean_us(fn, iterations: int) -> float:
+    samples = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        samples.append((time.perf_counter() - t0) / iterations * 1e6)
+    return round(statistics.median(samples), 1)
+
+
+def chat_report(bodies: dict, iterations: int) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from starlette.requests import Request
+
+    from ff_agent import http_responses
+
+    request = Request({"type": "http", "method": "POST", "path": "/chat", "query_string": b"",
+                       "headers": [(b"accept-encoding", BROWSER_ACCEPT_ENCODING.encode())]})
+
+    out = {}
+    for name, body in bodies.items():
+        before = JSONResponse(jsonable_encoder(body))
+        after = http_responses.json_response(request, body)
+        out[name] = {
+            "before_bytes": len(before.body),
+            "after_bytes": len(after.body),
+            "after_encoding": after.headers.get("content-encoding", "identity"),
+            "before_serialize_us": mean_us(lambda: JSONResponse(jsonable_encoder(body)), iterations),
+            "after_encode_only_us": mean_us(lambda: http_responses.dumps(body), iterations),
+            "after_total_us": mean_us(lambda: http_responses.json_response(request, body), iterations),
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=1000)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(0, 0)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "CHECKPOINTER": "memory",
+        "CATALOG_ENABLED": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+    })
+    from ff_agent import api_server, http_responses
+
+    try:
+        static = static_report(api_server)
+        bodies = asyncio.run(chat_bodies(api_server))
+    finally:
+        proc.terminate()
+
+    chat = chat_report(bodies, args.iterations)
+    print(json.dumps({
+        "args": vars(args),
+        "json_encoder": "orjson" if http_responses.orjson is not None else "json",
+        "encodings": list(http_responses.ENCODINGS),
+        "compress_min_bytes": http_responses.RESPONSE_COMPRESS_MIN_BYTES,
+        "static": static,
+        "chat": chat,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
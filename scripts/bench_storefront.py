@@ -0,0 +1,99 @@
+"""
+Storefront client benchmark（对本地 fake Storefront，不请求真实 Shopify）
+
+对比：
+1) 旧实现：每次 requests.post（每次新建连接，无 keep-alive）
+2) 共享 Session：连接池 + keep-alive
+3) async client：httpx.AsyncClient 并发
+
+用法：
+    python scripts/bench_storefront.py --calls 200 --concurrency 20 --latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import requests
+
+from fake_upstreams import start_storefront
+
+
+def bench_bare_requests(url: str, query: str, calls: int, concurrency: int) -> float:
+    """旧实现：每次调用 requests.post（无共享连接）"""
+    def one(_):
+        r = requests.post(url, json={"query": query, "variables": {"first": 6}}, timeout=20)
+        r.raise_for_status()
+        return r.json()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(one, range(calls)))
+    return time.perf_counter() - t0
+
+
+def bench_pooled_sync(sf, query: str, calls: int, concurrency: int) -> float:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(lambda _: sf.storefront_query(query, {"first": 6}), range(calls)))
+    return time.perf_counter() - t0
+
+
+def bench_async(sf, query: str, calls: int, concurrency: int) -> float:
+    async def run():
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with sem:
+                return await sf.astorefront_query(query, {"first": 6})
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(calls)))
+        elapsed = time.perf_counter() - t0
+        await sf.aclose_async_client()
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    args = ap.parse_args()
+
+    _, url = start_storefront(latency_ms=args.latency_ms)
+    os.environ["SHOPIFY_STOREFRONT_ENDPOINT"] = url
+    os.environ.setdefault("SHOPIFY_STOREFRONT_TOKEN", "bench")
+
+    from ff_agent import shopify_storefront as sf
+    sf.ENDPOINT = url
+    sf.POOL_SIZE = max(sf.POOL_SIZE, args.concurrency)
+
+    query = sf.QUERY_LATEST
+    results = {}
+    for name, fn in [
+        ("bare_requests", lambda: bench_bare_requests(url, query, args.calls, args.concurrency)),
+        ("pooled_sync", lambda: bench_pooled_sync(sf, query, args.calls, args.concurrency)),
+        ("async", lambda: bench_async(sf, query, args.calls, args.concurrency)),
+    ]:
+        elapsed = fn()
+        results[name] = {
+            "total_s": round(elapsed, 3),
+            "calls_per_s": round(args.calls / elapsed, 1),
+            "ms_per_call": round(elapsed * 1000 / args.calls, 2),
+        }
+
+    print(json.dumps({"args": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+重新生成 ff_agent/data/faq_answers.json 里的中英文回答（知识稿改了之后跑一次）
+
+每个条目：用 policy 相关的知识小节 + 条目的标准问题让 LLM 写中英文回答，写回 answer_en / answer_zh，
+并更新 source_sha256。patterns / url / label 是手工维护的，不会被改动。
+回答只能用知识稿里的内容；链接（回答里的和条目的 url）必须原样出现在知识稿里，否则整次生成失败、不写文件。
+生成后请人工看一遍 diff 再提交：这些回答会原样发给访客。
+
+用法：
+    python scripts/build_faq_answers.py            # 重新生成（调用 OPENAI，需要 OPENAI_API_KEY）
+    python scripts/build_faq_answers.py --check    # 只检查是否和知识稿同步、没有知识稿以外的链接（CI 用，不调用 LLM）
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ff_agent.faq import FAQ_ANSWERS_PATH, PROJECT_ROOT, source_sha256, unknown_urls
+
+
+def answer_prompt(context: str, entry: dict) -> str:
+    link = f"You may link to {entry['url']}.\n" if entry.get("url") else ""
+    return (
+        "You write short, warm customer-service answers for ForeverFurEver, a pet memorial store.\n"
+        "Use ONLY the store knowledge below. Never invent facts, numbers (days, prices, fees), pages or links\n"
+        "that are not in it. Do not write any URL that does not appear verbatim in the store knowledge.\n"
+        f"{link}"
+        "Plain text, no markdown headings, at most 2 short paragraphs or 4 bullets.\n\n"
+        f"Store knowledge:\n{context}\n\n"
+        f"Customer question (English): {entry['question_en']}\n"
+        f"Customer question (Chinese): {entry['question_zh']}\n\n"
+        'Return ONLY valid JSON: {"answer_en": "...", "answer_zh": "..."}'
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--check", action="store_true", help="exit 1 if the table is older than the knowledge doc")
+    ap.add_argument("--path", type=Path, default=FAQ_ANSWERS_PATH)
+    args = ap.parse_args()
+
+    data = json.loads(args.path.read_text(encoding="utf-8"))
+    source = PROJECT_ROOT / data["source"]
+    current = source_sha256(source)
+
+    source_text = source.read_text(encoding="utf-8")
+    if args.check:
+        ok = data.get("source_sha256") == current
+        print(f"{args.path.name}: {'up to date' if ok else 'STALE'} ({data['source']} sha256 {current[:12]})")
+        for entry in data["entries"]:
+            bad = unknown_urls(entry, source_text)
+            if bad:
+                ok = False
+                print(f"[{entry['id']}] links not in {data['source']}: {bad}")
+        sys.exit(0 if ok else 1)
+
+    bad = {e["id"]: unknown_urls({"url": e.get("url")}, source_text) for e in data["entries"]}
+    bad = {k: v for k, v in bad.items() if v}
+    if bad:
+        sys.exit(f"entry url not in {data['source']}: {bad}")
+
+    from ff_agent import llm_gateway
+    from ff_agent.knowledge import KnowledgeIndex
+
+    knowledge = KnowledgeIndex.from_file(source)
+    for entry in data["entries"]:
+        context = knowledge.context("policy", f"{entry['question_en']} {entry['question_zh']}")
+        resp = llm_gateway.invoke(answer_prompt(context, entry), temperature=0.2).content
+        answers = json.loads(resp)
+        entry["answer_en"] = answers["answer_en"].strip()
+        entry["answer_zh"] = answers["answer_zh"].strip()
+        print(f"[{entry['id']}]\n{entry['answer_en']}\n{entry['answer_zh']}\n")
+        bad = unknown_urls(entry, source_text)
+        if bad:
+            sys.exit(f"[{entry['id']}] the generated answer links to {bad}, which is not in {data['source']}; "
+                     f"nothing written")
+
+    data["source_sha256"] = current
+    args.path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"wrote {args.path}")
+
+
+if __name__ == "__main__":
+    main()
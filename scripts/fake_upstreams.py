@@ -0,0 +1,368 @@
+"""
+本地 stand-in 上游服务（benchmark / 压测用，不花真实 API 费用）
+
+- Fake Storefront GraphQL：返回固定的一组商品，支持 query 过滤和分页
+- Fake OpenAI：/v1/chat/completions，按 prompt 类型返回固定内容
+- 可配置延迟（latency_ms）和错误注入（error_rate → 随机返回 503）
+- fake OpenAI 可以模拟账号 RPM 限额（rpm_limit → 超出返回 429 + retry-after-ms，和 OpenAI 一样）
+
+用法：
+    python scripts/fake_upstreams.py --storefront-port 8787 --openai-port 8788 --latency-ms 80
+    SHOPIFY_STOREFRONT_ENDPOINT=http://127.0.0.1:8787/graphql.json \
+    OPENAI_BASE_URL=http://127.0.0.1:8788/v1 OPENAI_API_KEY=fake python -m ff_agent.api_server
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_PRODUCTS = [
+    {
+        "title": "Eternal Glow – A Soulful Tribute",
+        "handle": "personalized-pet-night-light-custom-relief-night-light-v2-0",
+        "availableForSale": True,
+        "productType": "Night Light",
+        "tags": ["keepsake", "memorial", "personalized"],
+        "priceRange": {"minVariantPrice": {"amount": "47.0", "currencyCode": "USD"}},
+    },
+    {
+        "title": "TravelStar Companion – Portable Pet Keepsake",
+        "handle": "travelstar-companion-portable-pet-urn-for-travel-hand-engraved-memorial-for-ashes-personalized-keepsake-for-dogs-cats",
+        "availableForSale": True,
+        "productType": "Urn",
+        "tags": ["urn", "memorial", "personalized", "engraving"],
+        "priceRange": {"minVariantPrice": {"amount": "117.0", "currencyCode": "USD"}},
+    },
+]
+
+
+def _match(p: dict, q: str) -> bool:
+    # 只模拟我们自己用到的 title:*kw* OR product_type:*kw* OR tag:*kw*
+    kws = {m.lower() for m in re.findall(r"\*([^*]+)\*", q or "")}
+    if not kws:
+        return True
+    hay = [p["title"].lower(), p["productType"].lower()] + [t.lower() for t in p["tags"]]
+    return any(kw in h for kw in kws for h in hay)
+
+
+def _products_connection(first: int, after, q: str | None) -> dict:
+    start = int(after or 0)
+    items = [p for p in FAKE_PRODUCTS if _match(p, q)] if q else list(FAKE_PRODUCTS)
+    page = items[start:start + first]
+    return {
+        "pageInfo": {"hasNextPage": start + first < len(items), "endCursor": str(start + first)},
+        "edges": [{"node": p} for p in page],
+    }
+
+
+# 顶层 products 字段（可带 alias）：`matches: products(first: $first, query: $q, ...)`
+_PRODUCTS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?products\(([^)]*)\)")
+
+
+def storefront_response(body: dict) -> dict:
+    query = body.get("query") or ""
+    variables = body.get("variables") or {}
+    if "products" not in query:
+        return {"data": {"shop": {"name": "ForeverFurEver (fake)"}}}
+    data = {}
+    for m in _PRODUCTS_FIELD.finditer(query):
+        alias, args = m.group(1) or "products", m.group(2)
+        first_var = re.search(r"first:\s*\$(\w+)", args)
+        first = int(variables.get(first_var.group(1)) if first_var else 10)
+        q = variables.get("q") if "query: $q" in args else None
+        data[alias] = _products_connection(first, variables.get("after") if "$after" in args else None, q)
+    return {"data": data}
+
+
+def _prompt_text(body: dict) -> str:
+    return "\n".join(str(m.get("content") or "") for m in body.get("messages") or [])
+
+
+def openai_reply(prompt: str) -> str:
+    """按 graph 里几种 prompt 返回固定内容（足够让流程跑通）"""
+    if "Return ONLY valid JSON" in prompt:
+        msg = prompt.rsplit("User message:", 1)[-1].lower()
+        occasion = "gift" if "gift" in msg else ("self" if "myself" in msg else None)
+        return json.dumps({
+            "budget": None, "occasion": occasion, "style": None,
+            "deadline": None, "engraving_language": None, "engraving_text": None,
+        })
+    if "clarification question" in prompt:
+        return "Is this for a gift, or for your own keepsake?"
+    p = FAKE_PRODUCTS[0]
+    return (
+        "Here is a thoughtful option within your budget:\n"
+        f"- {p['title']} — {p['priceRange']['minVariantPrice']['amount']} USD\n"
+        "Would you like to add a name or date to the engraving?"
+    )
+
+
+def openai_completion(body: dict) -> dict:
+    prompt = _prompt_text(body)
+    content = openai_reply(prompt)
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "gpt-4o-mini",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1：支持 keep-alive，才能测出连接复用的收益
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0.0
+    error_rate = 0.0
+    request_count = 0
+    _count_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # 关掉 Nagle，避免 keep-alive 下小包被 delayed ACK 拖 40ms
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, extra_headers: dict | None = None):
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (extra_headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _simulate(self) -> bool:
+        """统计请求数 + 注入延迟/错误；返回 False 表示已经回了错误"""
+        with self._count_lock:
+            type(self).request_count += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json(503, {"errors": [{"message": "injected error"}]}, {"Retry-After": "0"})
+            return False
+        return True
+
+
+class StorefrontHandler(_Handler):
+    def do_POST(self):
+        body = self._read_json()
+        if self._simulate():
+            self._send_json(200, storefront_response(body))
+
+
+class _RpmBucket:
+    """模拟 OpenAI 的 RPM 限额：每秒补 rpm/60，容量 rpm/60 × burst_seconds（OpenAI 会在更短窗口内执行限额）"""
+
+    def __init__(self, rpm: float, burst_seconds: float = 1.0):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self) -> float:
+        """拿到额度返回 0，否则返回还要等多少秒"""
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level >= 1:
+                self.level -= 1
+                return 0.0
+            self.rejected += 1
+            return (1 - self.level) / self.rate
+
+
+class OpenAIHandler(_Handler):
+    # stream=True 时相邻 token 之间的间隔
+    token_interval_ms = 15.0
+    rpm_bucket: "_RpmBucket | None" = None
+
+    def do_GET(self):
+        # GET /v1/models/{id}（llm_gateway 启动预热用来建连接）
+        if "/models/" in self.path:
+            self._send_json(200, {"id": self.path.rstrip("/").rsplit("/", 1)[-1], "object": "model",
+                                  "created": 0, "owned_by": "fake"})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self._read_json()
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        if self.rpm_bucket is not None:
+            retry_after = self.rpm_bucket.take()
+            if retry_after:
+                self._send_json(429, {"error": {
+                    "message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded",
+                }}, {"retry-after-ms": str(int(retry_after * 1000))})
+                return
+        if not self._simulate():
+            return
+        if body.get("stream"):
+            self._send_stream(body)
+        else:
+            self._send_json(200, openai_completion(body))
+
+    def _send_stream(self, body: dict):
+        """SSE：按空格切成 token 逐个发（chunked），最后 [DONE]"""
+        full = openai_completion(body)
+        content = full["choices"][0]["message"]["content"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(payload: str):
+            raw = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(raw):X}\r\n".encode() + raw + b"\r\n")
+            self.wfile.flush()
+
+        tokens = re.findall(r"\S+\s*", content) or [""]
+        for i, tok in enumerate(tokens):
+            chunk = {
+                "id": full["id"], "object": "chat.completion.chunk", "created": full["created"],
+                "model": full["model"],
+                "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}],
+            }
+            write_event(json.dumps(chunk))
+            if i < len(tokens) - 1 and self.token_interval_ms:
+                time.sleep(self.token_interval_ms / 1000)
+        last = {
+            "id": full["id"], "object": "chat.completion.chunk", "created": full["created"],
+            "model": full["model"],
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": full["usage"],
+        }
+        write_event(json.dumps(last))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 backlog 只有 5，高并发建连时会丢 SYN（1s 重传），压测结果失真
+    request_queue_size = 1024
+
+
+def start_server(handler_cls, port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0):
+    """后台线程启动一个 stand-in server，返回 (server, base_url)"""
+    handler = type(handler_cls.__name__, (handler_cls,), {
+        "latency_ms": latency_ms,
+        "error_rate": error_rate,
+        "request_count": 0,
+    })
+    server = _Server(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_storefront(port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0):
+    server, base = start_server(StorefrontHandler, port, latency_ms, error_rate)
+    return server, f"{base}/graphql.json"
+
+
+def start_openai(port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0, rpm_limit: float = 0.0):
+    server, base = start_server(OpenAIHandler, port, latency_ms, error_rate)
+    if rpm_limit:
+        server.RequestHandlerClass.rpm_bucket = _RpmBucket(rpm_limit)
+    return server, f"{base}/v1"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_upstreams(llm_latency_ms: float = 0.0, shopify_latency_ms: float = 0.0, error_rate: float = 0.0,
+                    token_interval_ms: float | None = None, llm_error_rate: float | None = None,
+                    llm_rpm_limit: float = 0.0):
+    """
+    在独立进程里启动 fake Storefront + fake OpenAI，返回 (proc, storefront_url, openai_url)。
+    压测时用这个：和被测代码在同一进程的话，server 线程会和 event loop 抢 GIL，结果失真。
+    """
+    sf_port, openai_port = _free_port(), _free_port()
+    cmd = [
+        sys.executable, __file__,
+        "--storefront-port", str(sf_port), "--openai-port", str(openai_port),
+        "--latency-ms", str(shopify_latency_ms), "--llm-latency-ms", str(llm_latency_ms),
+        "--error-rate", str(error_rate),
+    ]
+    if llm_error_rate is not None:
+        cmd += ["--llm-error-rate", str(llm_error_rate)]
+    if token_interval_ms is not None:
+        cmd += ["--token-interval-ms", str(token_interval_ms)]
+    if llm_rpm_limit:
+        cmd += ["--llm-rpm-limit", str(llm_rpm_limit)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+    deadline = time.time() + 10
+    for port in (sf_port, openai_port):
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    proc.kill()
+                    raise RuntimeError("fake upstreams did not start")
+                time.sleep(0.05)
+    return proc, f"http://127.0.0.1:{sf_port}/graphql.json", f"http://127.0.0.1:{openai_port}/v1"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storefront-port", type=int, default=8787)
+    ap.add_argument("--openai-port", type=int, default=8788)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="Storefront 延迟")
+    ap.add_argument("--llm-latency-ms", type=float, default=None, help="OpenAI 延迟（默认同 --latency-ms）")
+    ap.add_argument("--token-interval-ms", type=float, default=None)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--llm-error-rate", type=float, default=None, help="OpenAI 错误率（默认同 --error-rate）")
+    ap.add_argument("--llm-rpm-limit", type=float, default=0.0, help="模拟 OpenAI RPM 限额（0 = 不限）")
+    args = ap.parse_args()
+
+    _, url = start_storefront(args.storefront_port, args.latency_ms, args.error_rate)
+    print(f"Fake Storefront: {url}")
+    llm_latency = args.latency_ms if args.llm_latency_ms is None else args.llm_latency_ms
+    llm_error_rate = args.error_rate if args.llm_error_rate is None else args.llm_error_rate
+    openai_server, openai_url = start_openai(args.openai_port, llm_latency, llm_error_rate, args.llm_rpm_limit)
+    if args.token_interval_ms is not None:
+        openai_server.RequestHandlerClass.token_interval_ms = args.token_interval_ms
+    print(f"Fake OpenAI:     {openai_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+测试脚本共用的小工具（test_admission / test_batch / test_storefront_coalescing / test_profile_rules）
+
+- check(cond, msg)：打印 PASS / FAIL 一行，返回 cond（脚本最后 all(results) 决定退出码）
+- track_graph(api_server)：包住 graph.ainvoke，记录全局 / 每个 thread 的并发峰值和进入 graph 的消息顺序
+"""
+from typing import Dict, List, Tuple
+
+
+def check(cond: bool, msg: str):
+    print(("PASS  " if cond else "FAIL  ") + msg)
+    return cond
+
+
+class GraphTracker:
+    def __init__(self):
+        self.running = 0
+        self.peak = 0  # 全局同时在 graph 里的轮数峰值
+        self.per_thread: Dict[str, int] = {}
+        self.thread_peak: Dict[str, int] = {}  # 每个 thread 同时在跑的轮数峰值
+        self.order: List[Tuple[str, str]] = []  # (thread_id, user_message)，按进入 graph 的顺序
+
+    def entered(self, thread_id: str) -> List[str]:
+        return [m for tid, m in self.order if tid == thread_id]
+
+
+def track_graph(api_server) -> GraphTracker:
+    """包住 graph.ainvoke（实例属性，盖住类上的实现）；用完 untrack_graph 恢复"""
+    real_ainvoke = api_server.graph.ainvoke
+    tracker = GraphTracker()
+
+    async def ainvoke(payload, config=None, **kwargs):
+        tid = config["configurable"]["thread_id"]
+        tracker.running += 1
+        tracker.peak = max(tracker.peak, tracker.running)
+        tracker.per_thread[tid] = tracker.per_thread.get(tid, 0) + 1
+        tracker.thread_peak[tid] = max(tracker.thread_peak.get(tid, 0), tracker.per_thread[tid])
+        tracker.order.append((tid, payload["user_message"]))
+        try:
+            return await real_ainvoke(payload, config=config, **kwargs)
+        finally:
+            tracker.running -= 1
+            tracker.per_thread[tid] -= 1
+
+    api_server.graph.ainvoke = ainvoke
+    return tracker
+
+
+def untrack_graph(api_server) -> None:
+    api_server.graph.__dict__.pop("ainvoke", None)
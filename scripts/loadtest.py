@@ -0,0 +1,253 @@
+"""
+/chat 压测（本地 fake OpenAI + fake Storefront，不花真实 API 费用）
+
+- 独立进程启动 fake upstreams（可配延迟 / 错误注入）和 uvicorn（ff_agent.api_server:app，可多 worker）
+- 每个并发级别：固定数量的虚拟用户，每人循环跑按权重抽取的对话脚本（每段对话一个新 thread_id）
+- 输出 JSON：吞吐、p50/p95/p99、错误率、每个进程的 RSS（便于跨 commit 对比，--output 存文件）
+
+用法：
+    python scripts/loadtest.py --concurrency 10 50 --duration 20 --llm-latency-ms 300 \
+        --mix budget_gift=3 policy=1 engraving=1 --output /tmp/loadtest.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+
+from fake_upstreams import spawn_upstreams
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# 对话脚本：同一段对话里的各轮按顺序发，共用一个 thread_id
+CONVERSATIONS = {
+    "budget_gift": ["I want something under $60.", "#choice:occasion=gift"],
+    "urn_direct": ["I need a pet urn for ashes, it's a gift, under $60."],
+    "browse": ["Can you recommend a memorial keepsake gift for my friend?"],
+    "policy": ["What’s your return policy?", "How long does shipping take to Canada?"],
+    "engraving": ["I want to engrave \"Max\" on it, it's a gift for my mom."],
+    "chinese": ["我想买一个60刀以内的纪念品", "#choice:occasion=self"],
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in CONVERSATIONS:
+            raise SystemExit(f"unknown conversation {name!r}; choose from {sorted(CONVERSATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ---------- 进程 / RSS ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int):
+    out = []
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        try:
+            out += [int(c) for c in (task / "children").read_text().split()]
+        except OSError:
+            pass
+    return out
+
+
+def _rss_mb(pid: int):
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def process_rss(root_pid: int) -> dict:
+    """uvicorn 主进程 + 所有子进程（worker）的 RSS（MB）；读 /proc，仅 Linux"""
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack += _children(pid)
+    return {str(pid): _rss_mb(pid) for pid in pids}
+
+
+def start_api_server(port: int, workers: int, env: dict) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "uvicorn", "ff_agent.api_server:app",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+        "--log-level", "warning", "--no-access-log",
+    ]
+    proc = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env={**os.environ, **env})
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("api server exited during startup")
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("api server did not become healthy")
+
+
+# ---------- 压测 ----------
+async def run_level(base_url: str, endpoint: str, mix: dict, concurrency: int, duration: float,
+                    server_pid: int, level_idx: int) -> dict:
+    names, weights = list(mix), list(mix.values())
+    latencies, errors, status_counts = [], 0, {}
+    conversations = 0
+    rss_peak: dict = {}
+    stop_at = time.perf_counter() + duration
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+
+        async def user(uid: int):
+            nonlocal errors, conversations
+            rng = random.Random(f"{level_idx}-{uid}")
+            n = 0
+            while time.perf_counter() < stop_at:
+                script = CONVERSATIONS[rng.choices(names, weights)[0]]
+                thread_id = f"load_{level_idx}_{uid}_{n}"
+                n += 1
+                for message in script:
+                    t0 = time.perf_counter()
+                    ok = False
+                    try:
+                        r = await client.post(endpoint, json={"message": message, "thread_id": thread_id})
+                        status_counts[r.status_code] = status_counts.get(r.status_code, 0) + 1
+                        if r.status_code == 200:
+                            body = r.text
+                            ok = '"type": "error"' not in body if endpoint.endswith("/stream") else r.json().get("type") != "error"
+                    except httpx.HTTPError:
+                        status_counts["exception"] = status_counts.get("exception", 0) + 1
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    errors += 0 if ok else 1
+                    if not ok:
+                        break  # 对话中途出错就换下一段
+                conversations += 1
+
+        async def sample_rss():
+            while time.perf_counter() < stop_at:
+                for pid, mb in process_rss(server_pid).items():
+                    if mb is not None:
+                        rss_peak[pid] = max(rss_peak.get(pid, 0), mb)
+                await asyncio.sleep(0.5)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(sample_rss(), *(user(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    total = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "conversations": conversations,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 1) if total else None,
+        "p95_ms": round(percentile(latencies, 95), 1) if total else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if total else None,
+        "error_rate": round(errors / total, 4) if total else None,
+        "status_counts": {str(k): v for k, v in status_counts.items()},
+        "rss_mb_end": process_rss(server_pid),
+        "rss_mb_peak": rss_peak,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[10, 50])
+    ap.add_argument("--duration", type=float, default=15.0, help="每个并发级别的压测秒数")
+    ap.add_argument("--mix", nargs="+", default=[f"{name}=1" for name in CONVERSATIONS],
+                    help="name=weight，可选：" + ", ".join(CONVERSATIONS))
+    ap.add_argument("--endpoint", default="/chat", choices=["/chat", "/chat/stream"])
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn worker 进程数")
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0)
+    ap.add_argument("--shopify-latency-ms", type=float, default=80.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Storefront 注入错误率")
+    ap.add_argument("--llm-error-rate", type=float, default=None, help="OpenAI 注入错误率（默认同 --error-rate）")
+    ap.add_argument("--token-interval-ms", type=float, default=None, help="流式输出时每个 token 的间隔")
+    ap.add_argument("--env", nargs="*", default=[], help="传给 api server 的额外环境变量 KEY=VALUE")
+    ap.add_argument("--output", help="JSON 报告另存到这个文件")
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    upstreams, sf_url, openai_url = spawn_upstreams(
+        args.llm_latency_ms, args.shopify_latency_ms, args.error_rate,
+        token_interval_ms=args.token_interval_ms, llm_error_rate=args.llm_error_rate,
+    )
+    tmp = tempfile.mkdtemp(prefix="loadtest_")
+    env = {
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "loadtest",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "loadtest",
+        "CHECKPOINT_DB": os.path.join(tmp, "checkpoints.sqlite"),
+        **dict(kv.split("=", 1) for kv in args.env),
+    }
+    port = _free_port()
+    server = start_api_server(port, args.workers, env)
+
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        levels = [
+            asyncio.run(run_level(base_url, args.endpoint, mix, c, args.duration, server.pid, i))
+            for i, c in enumerate(args.concurrency)
+        ]
+        try:
+            server_stats = httpx.get(f"{base_url}/stats", timeout=5).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+    finally:
+        server.terminate()
+        server.wait(timeout=15)
+        upstreams.terminate()
+
+    report = {
+        "commit": git_commit(),
+        "args": {**vars(args), "mix": mix},
+        "levels": levels,
+        "server_stats": server_stats,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+冷启动 profiling（本地 fake OpenAI + fake Storefront，不花真实 API 费用）
+
+1. import 耗时：python -X importtime 导入 ff_agent.api_server，列出累计耗时最多的模块
+2. 每次起一个新的 uvicorn 进程，测：
+   - listen_ms：进程启动 → 端口能连上
+   - ready_ms：进程启动 → GET /health 返回 200
+   - first_chat_ms / second_chat_ms：ready 后第一轮 / 第二轮 /chat（不同 thread，同类问题）
+     两者的差 = 第一个真实请求替冷启动付的钱（建连接、懒加载）
+   本地 stand-in 是明文 HTTP，线上还要加上到 OpenAI / Shopify 的 TLS 握手（各约 100–300ms）
+
+用法：
+    python scripts/profile_cold_start.py --runs 3 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import _free_port, spawn_upstreams
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile(top: int) -> dict:
+    """-X importtime 的输出：总耗时 + 累计耗时最多的顶层依赖 / ff_agent 模块"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import ff_agent.api_server"],
+        cwd=ROOT, capture_output=True, text=True, env={**os.environ, "CATALOG_ENABLED": "0"},
+    ).stderr
+    rows = []
+    for line in out.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(2)) / 1000, len(m.group(3))))
+    total = next((ms for name, ms, _ in rows if name == "ff_agent.api_server"), None)
+    third_party = {}
+    for name, ms, _ in rows:
+        root = name.split(".")[0]
+        if root not in ("ff_agent",) and not root.startswith("_"):
+            third_party[root] = max(third_party.get(root, 0.0), ms)
+    return {
+        "api_server_import_ms": round(total, 1) if total else None,
+        "ff_agent_modules_ms": dict(sorted(((n, round(ms, 1)) for n, ms, _ in rows if n.startswith("ff_agent")),
+                                           key=lambda kv: -kv[1])[:top]),
+        "top_packages_ms": dict(sorted(((k, round(v, 1)) for k, v in third_party.items()), key=lambda kv: -kv[1])[:top]),
+    }
+
+
+def wait_for(predicate, timeout: float = 60.0, interval: float = 0.005) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def one_start(env: dict) -> dict:
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "ff_agent.api_server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        def listening():
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.05).close()
+                return True
+            except OSError:
+                return False
+
+        def ready():
+            try:
+                return httpx.get(f"{url}/health", timeout=1).status_code == 200
+            except httpx.HTTPError:
+                return False
+
+        wait_for(listening)
+        listen_ms = (time.perf_counter() - t0) * 1000
+        # 别轮询太密：每个 /health 请求都会让 event loop 和预热线程抢 GIL（平台的健康检查一般是秒级）
+        wait_for(ready, interval=0.2)
+        ready_ms = (time.perf_counter() - t0) * 1000
+        health = httpx.get(f"{url}/health").json()
+
+        chats = []
+        for i in range(2):
+            t1 = time.perf_counter()
+            r = httpx.post(f"{url}/chat", json={"message": "I'm looking for an urn for ashes, it's a gift for my sister.",
+                                                "thread_id": f"cold_{i}"}, timeout=60)
+            chats.append((time.perf_counter() - t1) * 1000)
+            assert r.status_code == 200 and r.json()["type"] != "error", r.text
+        return {
+            "listen_ms": round(listen_ms, 1),
+            "ready_ms": round(ready_ms, 1),
+            "first_chat_ms": round(chats[0], 1),
+            "second_chat_ms": round(chats[1], 1),
+            "warmup": health.get("warmup"),
+        }
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--top", type=int, default=12)
+    ap.add_argument("--llm-latency-ms", type=float, default=100.0)
+    ap.add_argument("--output", type=Path)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, 20)
+    env = {
+        **os.environ,
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "bench",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "bench",
+        "CHECKPOINTER": "memory",
+        "ANSWER_CACHE_ENABLED": "0",
+    }
+    try:
+        imports = import_profile(args.top)
+        starts = [one_start(env) for _ in range(args.runs)]
+    finally:
+        proc.terminate()
+
+    summary = {k: round(statistics.median(s[k] for s in starts), 1)
+               for k in ("listen_ms", "ready_ms", "first_chat_ms", "second_chat_ms")}
+    report = {"args": {k: str(v) for k, v in vars(args).items()}, "imports": imports,
+              "median": summary, "runs": starts}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
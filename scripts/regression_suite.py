@@ -1,13 +1,52 @@
+"""
+回归用例
+
+三种模式：
+- live（默认）：直接调用真实 OpenAI / Shopify
+- --record：照常调用真实服务，同时把每个用例的 LLM / Storefront 请求和响应存成 fixture
+  （scripts/fixtures/regression/<case_id>.json）
+- --replay：不联网，只用 fixture 回放；fixture 里没有的请求直接让用例失败
+
+用例在线程池里并发跑（--workers）；每个用例用自己的 thread_id，互不影响。
+
+用法：
+    python scripts/regression_suite.py --record
+    python scripts/regression_suite.py --replay --workers 16
+
+提交在 scripts/fixtures/regression/ 里的 fixture 是对着本地 fake upstreams（scripts/fake_upstreams.py）录的，
+不花 API 费用、结果可复现；prompt / 查询 / 用例改了之后这样重录：
+    python scripts/fake_upstreams.py --storefront-port 8787 --openai-port 8788 &
+    SHOPIFY_STOREFRONT_ENDPOINT=http://127.0.0.1:8787/graphql.json SHOPIFY_STOREFRONT_TOKEN=fake \
+    OPENAI_BASE_URL=http://127.0.0.1:8788/v1 OPENAI_API_KEY=fake \
+    python scripts/regression_suite.py --record
+"""
+import argparse
+import contextvars
+import hashlib
+import os
 import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# 用例结果不能依赖执行顺序 / 上一次运行：每次都是新的 thread state，不走 answer cache 和商品快照
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "0")
+os.environ.setdefault("CATALOG_ENABLED", "0")
+
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from langchain_core.messages import message_to_dict, messages_from_dict
+from ff_agent import llm_gateway, shopify_storefront
 from ff_agent.graph import build_graph
+from ff_agent.profile_rules import profile_stats
+from ff_agent.knowledge import KnowledgeIndex
 
 
 # ====== 1) 和 api_server.py 保持一致的 system_prompt 生成方式 ======
-from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 KNOWLEDGE_PATH = PROJECT_ROOT / "docs" / "01_store_knowledge.md"
@@ -17,18 +56,19 @@ def load_store_knowledge() -> str:
         return KNOWLEDGE_PATH.read_text(encoding="utf-8")
     return ""
 
-def build_system_prompt(store_knowledge: str) -> str:
-    return (
+def build_system_prompt(store_knowledge: str = "") -> str:
+    prompt = (
         "You are a compassionate assistant for an English-first pet memorial store (ForeverFurEver).\n"
         "Default to English unless user writes in Chinese.\n"
-        "Personalization is TEXT-ONLY.\n\n"
-        f"{store_knowledge}"
+        "Personalization is TEXT-ONLY."
     )
+    return f"{prompt}\n\n{store_knowledge}" if store_knowledge else prompt
 
 store_knowledge = load_store_knowledge()
-system_prompt = build_system_prompt(store_knowledge)
+knowledge = KnowledgeIndex(store_knowledge)
+system_prompt = build_system_prompt()
 
-graph = build_graph(system_prompt)
+graph = build_graph(system_prompt, knowledge)
 
 
 # ====== 2) 一组固定测试问题（你后续可随时加） ======
@@ -43,11 +83,22 @@ TEST_CASES: List[Dict[str, Any]] = [
         }
     },
     {
+        # 只有预算、没有用途（occasion）：按导购主线先追问 gift / self，不直接推荐
         "id": "urn_budget",
         "thread_id": "t_urn_budget",
         "message": "I need a pet urn for ashes under $60.",
         "checks": {
             "must_have_fields": ["type", "intent", "content", "products_debug","actions"],
+            "expect_type": "clarify",
+        }
+    },
+    {
+        "id": "urn_gift_budget",
+        "thread_id": "t_urn_gift_budget",
+        "message": "I need a pet urn for ashes, a gift, under $60.",
+        "checks": {
+            "must_have_fields": ["type", "intent", "content", "products_debug","actions"],
+            "expect_type": "answer",
             "must_not_invent_when_products_present": True,
             "must_have_urn_keepsake_actions": True
         }
@@ -93,6 +144,11 @@ def assert_has_fields(resp: Dict[str, Any], fields: List[str]) -> Dict[str, Any]
         return fail(f"Missing fields: {missing}")
     return ok()
 
+def assert_type(resp: Dict[str, Any], expected: str) -> Dict[str, Any]:
+    if resp.get("type") != expected:
+        return fail(f"Expected type={expected!r}, got {resp.get('type')!r}")
+    return ok()
+
 def extract_titles_from_debug(resp: Dict[str, Any]) -> List[str]:
     items = resp.get("products_debug") or []
     titles = []
@@ -134,8 +190,163 @@ def assert_has_urn_vs_keepsake_actions(resp: Dict[str, Any]) -> Dict[str, Any]:
         return ok()
     return fail("Expected quick-choice actions for Urn vs Keepsake, but not found.")
 
-# ====== 4) 运行并打印报告 ======
-def run_one(case: Dict[str, Any]) -> Dict[str, Any]:
+# ====== 4) record / replay ======
+FIXTURES_DIR = PROJECT_ROOT / "scripts" / "fixtures" / "regression"
+
+# 当前线程 / 任务在跑哪个用例（LangGraph 并行分支会复制 context，所以分支里也拿得到）
+_current_tape: contextvars.ContextVar[Optional["CaseTape"]] = contextvars.ContextVar("regression_tape", default=None)
+
+
+class ReplayMiss(RuntimeError):
+    """回放时遇到 fixture 里没有的请求（prompt / query 变了，需要重新 --record）"""
+
+
+def _exchange_key(kind: str, request: Dict[str, Any]) -> str:
+    raw = json.dumps({"kind": kind, "request": request}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class CaseTape:
+    """
+    一个用例的所有外部调用。
+    按 (kind, request) 的哈希匹配而不是按顺序：并行分支（extract_profile / prefetch）的先后不固定；
+    同一个请求出现多次时按录制顺序依次返回。
+    """
+
+    def __init__(self, case_id: str, exchanges: Optional[List[Dict[str, Any]]] = None):
+        self.case_id = case_id
+        self.exchanges: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._pending: Dict[str, deque] = defaultdict(deque)
+        self.misses: List[str] = []
+        for ex in exchanges or []:
+            self._pending[ex["key"]].append(ex)
+
+    @classmethod
+    def path(cls, case_id: str, fixtures_dir: Path = FIXTURES_DIR) -> Path:
+        return fixtures_dir / f"{case_id}.json"
+
+    @classmethod
+    def load(cls, case_id: str, fixtures_dir: Path = FIXTURES_DIR) -> "CaseTape":
+        path = cls.path(case_id, fixtures_dir)
+        if not path.exists():
+            raise FileNotFoundError(f"No fixture for case {case_id!r} ({path}); run with --record first")
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(case_id, data["exchanges"])
+
+    def save(self, case: Dict[str, Any], fixtures_dir: Path = FIXTURES_DIR):
+        fixtures_dir.mkdir(parents=True, exist_ok=True)
+        data = {"case_id": self.case_id, "message": case["message"], "exchanges": self.exchanges}
+        self.path(self.case_id, fixtures_dir).write_text(
+            json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
+        )
+
+    def record(self, kind: str, request: Dict[str, Any], response: Any = None, error: Optional[str] = None):
+        ex = {"kind": kind, "key": _exchange_key(kind, request), "request": request}
+        if error is not None:
+            ex["error"] = error
+        else:
+            ex["response"] = response
+        with self._lock:
+            self.exchanges.append(ex)
+
+    def take(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        key = _exchange_key(kind, request)
+        with self._lock:
+            pending = self._pending.get(key)
+            if not pending:
+                # 节点可能把异常吞成 tool_error，所以这里也记一笔，run_one 据此判失败
+                miss = f"no recorded {kind} exchange for {json.dumps(request, ensure_ascii=False)[:200]}"
+                self.misses.append(miss)
+                raise ReplayMiss(f"[{self.case_id}] {miss}")
+            return pending.popleft()
+
+
+def _replayed(ex: Dict[str, Any]) -> Any:
+    if "error" in ex:
+        raise RuntimeError(ex["error"])
+    return ex["response"]
+
+
+def install_tapes(mode: str):
+    """
+    在 llm_gateway / shopify_storefront 这一层拦截外部调用（graph 节点都通过这两个模块出网）。
+    record：调用真实服务并记下；replay：只从当前用例的 tape 里取。
+    """
+    live_invoke, live_ainvoke = llm_gateway.invoke, llm_gateway.ainvoke
+    live_query, live_aquery = shopify_storefront.storefront_query, shopify_storefront.astorefront_query
+
+    def llm_request(prompt, model, temperature):
+        return {"model": model, "temperature": temperature, "prompt": prompt}
+
+    def sf_request(query, variables):
+        return {"query": query, "variables": variables or {}}
+
+    def wrap_sync(kind, live, make_request, encode, decode):
+        def call(*args, **kwargs):
+            tape = _current_tape.get()
+            request = make_request(*args, **kwargs)
+            if mode == "replay":
+                return decode(_replayed(tape.take(kind, request)))
+            try:
+                resp = live(*args, **kwargs)
+            except Exception as e:
+                tape.record(kind, request, error=f"{type(e).__name__}: {e}")
+                raise
+            tape.record(kind, request, encode(resp))
+            return resp
+        return call
+
+    def wrap_async(kind, live, make_request, encode, decode):
+        async def call(*args, **kwargs):
+            tape = _current_tape.get()
+            request = make_request(*args, **kwargs)
+            if mode == "replay":
+                return decode(_replayed(tape.take(kind, request)))
+            try:
+                resp = await live(*args, **kwargs)
+            except Exception as e:
+                tape.record(kind, request, error=f"{type(e).__name__}: {e}")
+                raise
+            tape.record(kind, request, encode(resp))
+            return resp
+        return call
+
+    def llm_args(prompt, *, model=llm_gateway.DEFAULT_MODEL, temperature=0.0):
+        return llm_request(prompt, model, temperature)
+
+    encode_msg = message_to_dict
+    decode_msg = lambda d: messages_from_dict([d])[0]
+    same = lambda x: x
+
+    llm_gateway.invoke = wrap_sync("llm", live_invoke, llm_args, encode_msg, decode_msg)
+    llm_gateway.ainvoke = wrap_async("llm", live_ainvoke, llm_args, encode_msg, decode_msg)
+    shopify_storefront.storefront_query = wrap_sync("storefront", live_query, sf_request, same, same)
+    shopify_storefront.astorefront_query = wrap_async("storefront", live_aquery, sf_request, same, same)
+
+
+# ====== 5) 运行并打印报告 ======
+def run_one(case: Dict[str, Any], mode: str = "live", fixtures_dir: Path = FIXTURES_DIR) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        tape = CaseTape.load(case["id"], fixtures_dir) if mode == "replay" else CaseTape(case["id"])
+        token = _current_tape.set(tape)
+        try:
+            report = _run_case(case)
+        finally:
+            _current_tape.reset(token)
+        if tape.misses:
+            report["ok"] = False
+            report["checks"] += [fail(f"ReplayMiss: {m}") for m in tape.misses]
+        if mode == "record":
+            tape.save(case, fixtures_dir)
+    except Exception as e:
+        report = {"case_id": case["id"], "ok": False, "resp": {}, "checks": [fail(f"{type(e).__name__}: {e}")]}
+    report["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return report
+
+
+def _run_case(case: Dict[str, Any]) -> Dict[str, Any]:
     thread_id = case["thread_id"]
     msg = case["message"]
 
@@ -172,6 +383,8 @@ def run_one(case: Dict[str, Any]) -> Dict[str, Any]:
 
     if "must_have_fields" in checks:
         results.append(assert_has_fields(resp, checks["must_have_fields"]))
+    if "expect_type" in checks:
+        results.append(assert_type(resp, checks["expect_type"]))
 
     if checks.get("must_not_invent_when_products_present"):
         results.append(assert_no_invented_products(resp))
@@ -182,16 +395,35 @@ def run_one(case: Dict[str, Any]) -> Dict[str, Any]:
     return {"case_id": case["id"], "ok": ok_all, "resp": resp, "checks": results}
 
 def main():
-    reports = [run_one(c) for c in TEST_CASES]
+    ap = argparse.ArgumentParser()
+    mode_group = ap.add_mutually_exclusive_group()
+    mode_group.add_argument("--record", action="store_true", help="调用真实服务并把外部交互存成 fixture")
+    mode_group.add_argument("--replay", action="store_true", help="只用 fixture 回放，不联网")
+    ap.add_argument("--workers", type=int, default=8, help="并发跑用例的线程数")
+    ap.add_argument("--fixtures-dir", type=Path, default=FIXTURES_DIR)
+    ap.add_argument("--case", nargs="*", help="只跑这些 case id")
+    args = ap.parse_args()
+
+    mode = "record" if args.record else "replay" if args.replay else "live"
+    if mode != "live":
+        install_tapes(mode)
+    cases = [c for c in TEST_CASES if not args.case or c["id"] in args.case]
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        reports = list(pool.map(lambda c: run_one(c, mode, args.fixtures_dir), cases))
+    elapsed = time.perf_counter() - t0
     passed = sum(1 for r in reports if r["ok"])
     total = len(reports)
 
     print("\n================ Regression Suite ================\n")
+    print(f"Mode: {mode}  workers={args.workers}  elapsed={elapsed:.2f}s\n")
     print(f"Passed: {passed}/{total}\n")
+    print(f"Profile extraction: {profile_stats()}\n")
 
     for r in reports:
         status = "✅ PASS" if r["ok"] else "❌ FAIL"
-        print(f"{status}  {r['case_id']}")
+        print(f"{status}  {r['case_id']}  ({r['elapsed_ms']} ms)")
         if not r["ok"]:
             for chk in r["checks"]:
                 if not chk["ok"]:
@@ -0,0 +1,87 @@
+"""
+每个 LLM 节点的 prompt token 数：整份知识稿 vs 按 intent / 消息检索的知识小节
+
+只拼 prompt、不调用 LLM（token 数用 llm_gateway.estimate_tokens 估算）。
+
+用法：
+    python scripts/report_prompt_tokens.py
+"""
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import FAKE_PRODUCTS
+from ff_agent.graph import _answer_prompt, _clarify_prompt, _profile_prompt, route_intent
+from ff_agent.knowledge import KnowledgeIndex
+from ff_agent.llm_gateway import estimate_tokens
+from ff_agent.shopify_storefront import product_from_node
+
+KNOWLEDGE_PATH = Path(__file__).resolve().parents[1] / "docs" / "01_store_knowledge.md"
+
+MESSAGES = [
+    "I want something under $60.",
+    "I need a pet urn for ashes under $60.",
+    "What’s your return policy?",
+    "How long does shipping take?",
+    "Can I engrave my dog's name on the TravelStar?",
+    "我想买一个60刀以内的纪念品",
+    "可以退款吗？",
+    "hello",
+]
+
+
+def build_system_prompt(store_knowledge: str = "") -> str:
+    prompt = (
+        "You are a compassionate assistant for an English-first pet memorial store (ForeverFurEver).\n"
+        "Default to English unless user writes in Chinese.\n"
+        "Personalization is TEXT-ONLY."
+    )
+    return f"{prompt}\n\n{store_knowledge}" if store_knowledge else prompt
+
+
+def main():
+    index = KnowledgeIndex.from_file(KNOWLEDGE_PATH)
+    full_prompt = build_system_prompt(index.full_text)
+    base_prompt = build_system_prompt()
+    products = [product_from_node(p).to_dict() for p in FAKE_PRODUCTS]
+
+    rows = []
+    totals = {}
+    for msg in MESSAGES:
+        state = route_intent({"user_message": msg, "profile": {}})
+        state["products_debug"] = products
+        scoped_prompt = f"{base_prompt}\n\n{index.context(state['intent'], msg)}"
+
+        row = {"message": msg, "intent": state["intent"]}
+        for node, build in (
+            ("extract_profile", lambda sp: _profile_prompt(msg)),
+            ("clarify", lambda sp: _clarify_prompt(state, sp)),
+            ("answer", lambda sp: _answer_prompt(state, sp, None)),
+        ):
+            before, after = estimate_tokens(build(full_prompt)), estimate_tokens(build(scoped_prompt))
+            row[node] = {"before": before, "after": after}
+            t = totals.setdefault(node, {"before": 0, "after": 0})
+            t["before"] += before
+            t["after"] += after
+        rows.append(row)
+
+    summary = {
+        node: {
+            "avg_before": round(t["before"] / len(MESSAGES), 1),
+            "avg_after": round(t["after"] / len(MESSAGES), 1),
+            "saved_pct": round(100 * (1 - t["after"] / t["before"]), 1) if t["before"] else 0.0,
+        }
+        for node, t in totals.items()
+    }
+    print(json.dumps({
+        "knowledge": {"sections": len(index.sections), "full_tokens": index.full_tokens},
+        "per_message": rows,
+        "summary": summary,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+准入控制测试：同一个 thread_id 并发狂发 + 全局排满（本地 fake OpenAI + fake Storefront）
+
+in-process 跑 api_server.app（httpx ASGITransport，同一个 event loop 里真并发），检查：
+1. 同一 thread 的请求严格串行、按到达顺序执行（包一层 graph.ainvoke 记录并发数 / 进入顺序）
+2. 同一 thread 排队超过 ADMISSION_THREAD_MAX_PENDING 的请求立即 429 + Retry-After
+3. 全局 slot + 队列都满时立即 503 + Retry-After；/stats 里能看到拒绝数
+
+用法：
+    python scripts/test_admission.py --llm-latency-ms 100 --requests 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+
+from fake_upstreams import spawn_upstreams
+from harness import check, track_graph, untrack_graph
+
+
+async def hammer_one_thread(api_server, AdmissionController, n: int, max_pending: int) -> bool:
+    api_server.admission = AdmissionController(max_concurrent=8, max_queue=64, max_wait_seconds=30,
+                                               thread_max_pending=max_pending)
+    tracked = track_graph(api_server)
+    messages = [f"I need a pet urn for ashes, gift, under ${50 + i}." for i in range(n)]
+
+    transport = httpx.ASGITransport(app=api_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        async def send(msg):
+            t0 = time.perf_counter()
+            r = await client.post("/chat", json={"message": msg, "thread_id": "hammer"})
+            return msg, r, (time.perf_counter() - t0) * 1000
+
+        results = await asyncio.gather(*(send(m) for m in messages))
+        stats = (await client.get("/stats")).json()["admission"]
+
+    ok = [(m, r, ms) for m, r, ms in results if r.status_code == 200]
+    busy = [(m, r, ms) for m, r, ms in results if r.status_code == 429]
+    entered = tracked.entered("hammer")
+
+    print(f"\n[one thread × {n} concurrent, thread_max_pending={max_pending}]")
+    print(f"  200: {len(ok)}  429: {len(busy)}  latencies(ms): {[round(ms) for _, _, ms in ok]}")
+    print(f"  admission stats: {stats}")
+    passed = all([
+        check(tracked.thread_peak.get("hammer") == 1,
+              f"at most one turn of the thread in the graph at a time (peak={tracked.thread_peak.get('hammer')})"),
+        check(entered == [m for m, _, _ in ok], "turns entered the graph in arrival order"),
+        check(len(ok) == min(n, max_pending), f"{min(n, max_pending)} requests admitted"),
+        check(all(r.headers.get("Retry-After") and r.json()["type"] == "busy" for _, r, _ in busy),
+              "rejected requests are 429 with Retry-After and type=busy"),
+        check(all(r.json()["type"] != "error" for _, r, _ in ok), "no admitted request failed"),
+        check(stats["in_flight"] == 0 and stats["queue_depth"] == 0 and stats["active_threads"] == 0,
+              "all slots released afterwards"),
+    ])
+    untrack_graph(api_server)
+    return passed
+
+
+async def overload(api_server, AdmissionController, n: int) -> bool:
+    api_server.admission = AdmissionController(max_concurrent=2, max_queue=2, max_wait_seconds=30,
+                                               thread_max_pending=4)
+    transport = httpx.ASGITransport(app=api_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        async def send(i):
+            t0 = time.perf_counter()
+            r = await client.post("/chat", json={"message": "What’s your return policy?", "thread_id": f"burst_{i}"})
+            return r, (time.perf_counter() - t0) * 1000
+
+        results = await asyncio.gather(*(send(i) for i in range(n)))
+        stats = (await client.get("/stats")).json()["admission"]
+        metrics_text = (await client.get("/metrics")).text
+
+    ok = [ms for r, ms in results if r.status_code == 200]
+    rejected = [(r, ms) for r, ms in results if r.status_code == 503]
+    print(f"\n[{n} threads at once, max_concurrent=2, max_queue=2]")
+    print(f"  200: {len(ok)}  503: {len(rejected)}  reject latency(ms): {[round(ms, 1) for _, ms in rejected][:5]}")
+    print(f"  admission stats: {stats}")
+    return all([
+        check(len(ok) == 4 and len(rejected) == n - 4, "2 running + 2 queued admitted, the rest rejected"),
+        check(all(r.headers.get("Retry-After") for r, _ in rejected), "503 responses carry Retry-After"),
+        check(all(ms < 100 for _, ms in rejected), "rejections are immediate"),
+        check(stats["rejected"]["queue_full"] == n - 4, "rejection count exposed in /stats"),
+        check('ff_admission_rejections_total{reason="queue_full"}' in metrics_text, "rejection count exposed in /metrics"),
+    ])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=12)
+    ap.add_argument("--llm-latency-ms", type=float, default=100.0)
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, 20)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "test",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "test",
+        "CHECKPOINTER": "memory",
+        "CATALOG_ENABLED": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+    })
+    from ff_agent import api_server
+    from ff_agent.admission import AdmissionController
+
+    async def run_all():
+        return [
+            await hammer_one_thread(api_server, AdmissionController, args.requests, max_pending=args.requests),
+            await hammer_one_thread(api_server, AdmissionController, args.requests, max_pending=4),
+            await overload(api_server, AdmissionController, args.requests),
+        ]
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        proc.terminate()
+    print("\nALL PASSED" if all(results) else "\nSOME CHECKS FAILED")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+/chat/batch 测试 + 和逐条 /chat 的耗时对比（本地 fake OpenAI + fake Storefront）
+
+in-process 跑 api_server.app（httpx ASGITransport），检查：
+1. NDJSON 每条一行、全部返回、最后一行是 batch_done 汇总
+2. 同一 thread_id 的条目按输入顺序执行、不并发（多轮脚本）；批量跑的同时往同一会话发一条 /chat，也不和批量条目并发
+3. graph 同时在跑的条目数不超过 max_concurrency
+4. 每条都有 timings（queue_ms / total_ms / 节点耗时）
+然后同一批问题逐条 POST /chat，对比总耗时（这一段关掉 answer cache 和商品快照）。
+
+最后在子进程里（缓存开关是 import 时读的环境变量）打开 answer cache + 商品快照，同一批问题跑两遍，
+检查 batch_done 的 cache_hits 按层计数：
+- faq：policy 问题两遍都命中；answer：第一遍 0，第二遍每个商品问题都命中；catalog：每个要查商品的条目都走快照
+
+用法：
+    python scripts/test_batch.py --items 40 --concurrency 8 --llm-latency-ms 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+
+from fake_upstreams import spawn_upstreams
+from harness import check, track_graph, untrack_graph
+
+QUESTIONS = [
+    "Can you recommend a memorial keepsake gift for my friend?",
+    "I'm looking for an urn for ashes, it's a gift for my sister.",
+    "What’s your return policy?",
+    "Do you ship to Canada?",
+]
+SCRIPT = [  # 同一个 thread 的多轮
+    "I need a pet urn",
+    "It's for my own dog, under $150",
+    "Can you engrave the name Lucky?",
+]
+CHAT_TURN = "Does it come with a gift box?"  # 批量跑 SCRIPT 的同时，同一个 thread 上的 /chat
+CACHE_ITEMS = [  # (message, 这一条的回答来自哪层缓存：faq / answer / None = 追问，不进 answer cache)
+    ("What’s your return policy?", "faq"),
+    ("Do you ship to Canada?", "faq"),
+    ("Can you recommend a memorial keepsake gift for my friend?", "answer"),
+    ("I'm looking for an urn for ashes, it's a gift for my sister.", "answer"),
+    ("I need a pet urn", None),
+]
+
+
+async def run(api_server, n_items: int, concurrency: int) -> bool:
+    items = [{"message": QUESTIONS[i % len(QUESTIONS)]} for i in range(n_items)]
+    items += [{"message": m, "thread_id": "script"} for m in SCRIPT]
+
+    tracked = track_graph(api_server)
+    transport = httpx.ASGITransport(app=api_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        lines = []
+
+        async def batch():
+            async with client.stream("POST", "/chat/batch", json={"items": items, "max_concurrency": concurrency}) as r:
+                async for line in r.aiter_lines():
+                    if line:  # ASGITransport 会攒完整个 body，逐行到达的时序要在 uvicorn 下看
+                        lines.append(json.loads(line))
+                return r.status_code, r.headers.get("content-type", "")
+
+        async def chat_same_thread():
+            while not tracked.entered("script"):  # 等批量的第一轮进了 graph 再发
+                await asyncio.sleep(0.005)
+            return await client.post("/chat", json={"message": CHAT_TURN, "thread_id": "script"})
+
+        t0 = time.perf_counter()
+        (status, content_type), chat = await asyncio.gather(batch(), chat_same_thread())
+        batch_ms = (time.perf_counter() - t0) * 1000
+        untrack_graph(api_server)
+
+        too_big = await client.post("/chat/batch", json={"items": [{"message": "hi"}] * (api_server.BATCH_MAX_ITEMS + 1)})
+
+        t0 = time.perf_counter()
+        for i, item in enumerate(items):
+            await client.post("/chat", json={"message": item["message"], "thread_id": item.get("thread_id", f"seq_{i}")})
+        sequential_ms = (time.perf_counter() - t0) * 1000
+
+    rows, summary = lines[:-1], lines[-1]
+    script_order = tracked.entered("script")
+    print(f"\n[{len(items)} items, max_concurrency={concurrency}]")
+    print(f"  batch: {batch_ms:.0f} ms   sequential /chat: {sequential_ms:.0f} ms"
+          f"   speedup x{sequential_ms / batch_ms:.1f}")
+    print(f"  summary: {summary}")
+    print(f"  sample row timings: {json.dumps(rows[0]['timings'])[:200]}...")
+    return all([
+        check(status == 200 and content_type.startswith("application/x-ndjson"), "streams NDJSON"),
+        check(sorted(r["index"] for r in rows) == list(range(len(items))), "one line per item"),
+        check(summary.get("type") == "batch_done" and summary["items"] == len(items) and summary["errors"] == 0,
+              "last line is the batch summary, no errors"),
+        check(all(r["type"] in ("answer", "clarify") and r["content"] for r in rows), "every item answered"),
+        check([m for m in script_order if m != CHAT_TURN] == SCRIPT and max(tracked.thread_peak.values()) == 1,
+              "same-thread items run in input order, one at a time"),
+        check(chat.status_code == 200 and CHAT_TURN in script_order,
+              f"/chat on the batch's thread waits its turn (order: {script_order})"),
+        check(tracked.peak <= concurrency, f"at most max_concurrency items in the graph (peak={tracked.peak})"),
+        check(all({"queue_ms", "total_ms", "nodes_ms"} <= set(r["timings"]) for r in rows), "per-item timings"),
+        check(too_big.status_code == 413, "oversized batch rejected with 413"),
+    ])
+
+
+async def run_caches(api_server, concurrency: int) -> bool:
+    """answer cache + 商品快照打开：同一批跑两遍，看 cache_hits 的按层计数"""
+    from ff_agent.batch import CACHE_LAYERS
+    from ff_agent.catalog import catalog
+
+    loaded = catalog.refresh()  # ASGITransport 不跑 lifespan，快照手动拉一次
+    items = [{"message": m} for m, _ in CACHE_ITEMS]
+    n_faq = sum(1 for _, layer in CACHE_ITEMS if layer == "faq")
+    n_answer = sum(1 for _, layer in CACHE_ITEMS if layer == "answer")
+    n_search = len(CACHE_ITEMS) - n_faq  # FAQ 直接回答，不查商品
+
+    summaries, rows = [], []
+    transport = httpx.ASGITransport(app=api_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        for _ in range(2):
+            r = await client.post("/chat/batch", json={"items": items, "max_concurrency": concurrency})
+            lines = [json.loads(line) for line in r.text.splitlines() if line]
+            rows.append(lines[:-1])
+            summaries.append(lines[-1])
+
+    def per_row(batch_rows, name):
+        return sum(1 for row in batch_rows if row["timings"]["cache"].get(name) == "hit")
+
+    first, second = (s["cache_hits"] for s in summaries)
+    print(f"\n[caches on, {len(items)} items x 2 batches]")
+    print(f"  first batch cache_hits:  {first}")
+    print(f"  second batch cache_hits: {second}")
+    return all([
+        check(loaded, "catalog snapshot loaded"),
+        check(all(s["errors"] == 0 for s in summaries), "no errors"),
+        check(first == {"faq": n_faq, "answer": 0, "catalog": n_search},
+              f"first batch: faq={n_faq}, answer=0, catalog={n_search}"),
+        check(second == {"faq": n_faq, "answer": n_answer, "catalog": n_search},
+              f"second batch: faq={n_faq}, answer={n_answer}, catalog={n_search}"),
+        check(all(s["cache_hits"] == {layer: per_row(b, name) for layer, name in CACHE_LAYERS.items()}
+                  for s, b in zip(summaries, rows)),
+              "summary counts match the per-item timings.cache"),
+    ])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--llm-latency-ms", type=float, default=100.0)
+    ap.add_argument("--caches", action="store_true", help="只跑缓存打开的那一段（主流程在子进程里调用）")
+    args = ap.parse_args()
+
+    proc, sf_url, openai_url = spawn_upstreams(args.llm_latency_ms, 20)
+    os.environ.update({
+        "SHOPIFY_STOREFRONT_ENDPOINT": sf_url,
+        "SHOPIFY_STOREFRONT_TOKEN": "test",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "test",
+        "CHECKPOINTER": "memory",
+        "CATALOG_ENABLED": "1" if args.caches else "0",
+        "ANSWER_CACHE_ENABLED": "1" if args.caches else "0",
+        "BATCH_MAX_ITEMS": "200",
+    })
+    from ff_agent import api_server
+
+    try:
+        if args.caches:
+            passed = asyncio.run(run_caches(api_server, args.concurrency))
+        else:
+            passed = asyncio.run(run(api_server, args.items, args.concurrency))
+    finally:
+        proc.terminate()
+    if args.caches:
+        sys.exit(0 if passed else 1)
+
+    cached = subprocess.run([sys.executable, __file__, "--caches", "--concurrency", str(args.concurrency),
+                             "--llm-latency-ms", str(args.llm_latency_ms)])
+    passed = passed and cached.returncode == 0
+    print("\nALL PASSED" if passed else "\nSOME CHECKS FAILED")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+规则 profile 抽取测试（不联网，不调 LLM）
+
+1. extract_profile_rules：中英文正例（预算 / 用途 / 刻字）抽到的值和置信度
+2. 反例：缩写里的撇号不算刻字引号、天数 / 件数不算预算
+3. _apply_profile_rules：不确定的规则结果不覆盖已有字段，并且让 LLM 再判断
+
+用法：
+    python scripts/test_profile_rules.py
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import check
+
+from ff_agent.profile_rules import RULE_CONFIDENT, extract_profile_rules
+
+# (message, 期望抽到的字段；没列出的字段必须没抽到)
+POSITIVE = [
+    ("I want something under $60.", {"budget": "under $60"}),
+    ("max 70 bucks", {"budget": "under $70"}),
+    ("my budget is 80", {"budget": "under $80"}),
+    ("我想买一个60刀以内的纪念品", {"budget": "under $60"}),
+    ("不超过60刀", {"budget": "under $60"}),
+    ("It's a gift for my mom", {"occasion": "gift"}),
+    ('engrave "Max" please', {"engraving_text": "Max", "engraving_language": "English"}),
+    ("engrave 'Max' please", {"engraving_text": "Max", "engraving_language": "English"}),
+    ("engraving: 'Max's bowl'", {"engraving_text": "Max's bowl", "engraving_language": "English"}),
+    ("刻字“永远爱你”", {"engraving_text": "永远爱你", "engraving_language": "Chinese"}),
+]
+NEGATIVE = [
+    # 撇号不是引号
+    ("Can the engraving's size be bigger? It's for my dog's urn", "engraving_text"),
+    ("What text's allowed? I don't know", "engraving_text"),
+    # 数量 / 天数不是预算
+    ("under 5 days shipping?", "budget"),
+    ("Can it arrive in under 10 days?", "budget"),
+    ("up to 3 items", "budget"),
+    ("不超过3天发货", "budget"),
+]
+
+
+def main():
+    results = []
+
+    for msg, expected in POSITIVE:
+        fields, _ = extract_profile_rules(msg)
+        got = {k: fields.get(k) for k in expected}
+        results.append(check(got == expected, f"{msg!r} -> {expected}" + ("" if got == expected else f" (got {fields})")))
+
+    for msg, field in NEGATIVE:
+        fields, _ = extract_profile_rules(msg)
+        results.append(check(field not in fields, f"{msg!r} -> no {field}" + (f" (got {fields[field]!r})" if field in fields else "")))
+
+    _, confidence = extract_profile_rules("something under 60")
+    results.append(check(confidence.get("budget", 1.0) < RULE_CONFIDENT,
+                         "a bare number after 'under' is below RULE_CONFIDENT"))
+
+    from ff_agent.graph import _apply_profile_rules
+
+    profile = {"budget": "under $60", "occasion": "gift"}
+    state = {"user_message": "Will it ship in under 5 days?", "profile": dict(profile), "intent": "product"}
+    _apply_profile_rules(state)
+    results.append(check(state["profile"] == profile, "shipping days do not replace the budget"))
+
+    state = {"user_message": "maybe under 80", "profile": dict(profile), "intent": "product"}
+    need_llm = _apply_profile_rules(state)
+    results.append(check(state["profile"]["budget"] == "under $60" and need_llm,
+                         "an unsure budget keeps the existing one and asks the LLM"))
+
+    state = {"user_message": "make it under $80", "profile": dict(profile), "intent": "product"}
+    need_llm = _apply_profile_rules(state)
+    results.append(check(state["profile"]["budget"] == "under $80" and not need_llm,
+                         "a confident budget replaces the existing one without the LLM"))
+
+    print("\nALL PASSED" if all(results) else "\nSOME CHECKS FAILED")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Storefront single-flight 测试：相同 (query, variables) 的并发调用只发一个上游请求（本地 fake Storefront）
+
+fake Storefront 在本进程里跑（数得到它收到的请求数），加一点延迟让并发调用真的重叠，检查：
+1. sync：N 个线程同时 search_products("memorial") → 上游只收到 1 个请求，大家拿到同样的结果
+2. async：N 个协程同时 asearch_products("memorial") → 1 个请求
+3. 不同 variables 各发各的；variables 的 key 顺序不影响合并
+4. 请求结束后不缓存：之后的相同调用再发一次
+5. 上游失败时所有等待者都收到同一个错误（仍然只有 1 个请求）
+6. async leader 的调用方被取消，follower 照样拿到结果
+7. SHOPIFY_COALESCE=0 时每个调用各发一个请求
+
+用法：
+    python scripts/test_storefront_coalescing.py --callers 50 --latency-ms 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_upstreams import start_storefront
+from harness import check
+
+
+def same_products(lists) -> bool:
+    dicts = [[p.to_dict() for p in products] for products in lists]
+    return bool(dicts[0]) and all(d == dicts[0] for d in dicts)
+
+
+def upstream_count(server) -> int:
+    return server.RequestHandlerClass.request_count
+
+
+def concurrent_sync(n: int, fn, *args):
+    """n 个线程在 barrier 后同时调用 fn；返回 (结果列表, 异常列表)"""
+    barrier = threading.Barrier(n)
+
+    def call(_):
+        barrier.wait()
+        try:
+            return fn(*args), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(n) as pool:
+        outcomes = list(pool.map(call, range(n)))
+    return [r for r, _ in outcomes], [e for _, e in outcomes if e is not None]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--callers", type=int, default=50)
+    ap.add_argument("--latency-ms", type=float, default=200.0)
+    args = ap.parse_args()
+    n = args.callers
+
+    server, url = start_storefront(latency_ms=args.latency_ms)
+    failing, failing_url = start_storefront(latency_ms=args.latency_ms, error_rate=1.0)
+    os.environ.update({"SHOPIFY_STOREFRONT_ENDPOINT": url, "SHOPIFY_STOREFRONT_TOKEN": "test", "CATALOG_ENABLED": "0"})
+    from ff_agent import shopify_storefront as sf
+
+    results = []
+
+    # 1. sync
+    before = upstream_count(server)
+    products, errors = concurrent_sync(n, sf.search_products, "memorial")
+    sent = upstream_count(server) - before
+    print(f"\n[sync × {n}] upstream requests: {sent}")
+    results += [
+        check(sent == 1, f"{n} concurrent sync callers -> 1 upstream request"),
+        check(not errors and same_products(products),
+              "every sync caller got the same non-empty product list"),
+    ]
+
+    # 2. async
+    async def async_burst(keyword: str, count: int):
+        return await asyncio.gather(*(sf.asearch_products(keyword) for _ in range(count)))
+
+    before = upstream_count(server)
+    products = asyncio.run(async_burst("memorial", n))
+    sent = upstream_count(server) - before
+    print(f"\n[async × {n}] upstream requests: {sent}")
+    results += [
+        check(sent == 1, f"{n} concurrent async callers -> 1 upstream request"),
+        check(same_products(products), "every async caller got the same product list"),
+    ]
+
+    # 3. 不同 variables / key 顺序
+    async def mixed():
+        calls = []
+        for kw in ("urn", "collar", "frame"):
+            calls += [sf.asearch_products(kw) for _ in range(5)]
+        return await asyncio.gather(*calls)
+
+    before = upstream_count(server)
+    asyncio.run(mixed())
+    sent = upstream_count(server) - before
+    results.append(check(sent == 3, f"3 keywords x 5 callers -> 3 upstream requests (got {sent})"))
+
+    query, variables = sf._search_with_latest_request("memorial", 6, 6)
+    reordered = dict(reversed(list(variables.items())))
+    before = upstream_count(server)
+
+    async def reorder():
+        return await asyncio.gather(sf.astorefront_query(query, variables), sf.astorefront_query(query, reordered))
+
+    asyncio.run(reorder())
+    results.append(check(upstream_count(server) - before == 1, "variables with a different key order share one request"))
+
+    # 4. 不缓存
+    before = upstream_count(server)
+    sf.search_products("memorial")
+    sf.search_products("memorial")
+    results.append(check(upstream_count(server) - before == 2, "sequential identical calls each send a request (no caching)"))
+
+    # 5. 失败共享（关掉重试，单看合并）
+    sf.ENDPOINT, sf.MAX_RETRIES = failing_url, 0
+    before = upstream_count(failing)
+    _, errors = concurrent_sync(n, sf.search_products, "memorial")
+    sent = upstream_count(failing) - before
+    print(f"\n[failing upstream, sync × {n}] upstream requests: {sent}, errors: {len(errors)}")
+    results += [
+        check(sent == 1, "failing upstream still sees 1 request"),
+        check(len(errors) == n and all(isinstance(e, sf.StorefrontRetryable) for e in errors),
+              f"all {n} callers got the upstream error"),
+    ]
+    sf.ENDPOINT, sf.MAX_RETRIES = url, 3
+
+    # 6. leader 被取消
+    async def cancel_leader():
+        leader = asyncio.create_task(sf.asearch_products("keepsake"))
+        await asyncio.sleep(0)  # 让 leader 先登记
+        followers = [asyncio.create_task(sf.asearch_products("keepsake")) for _ in range(5)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(*followers), leader
+
+    before = upstream_count(server)
+    followers, leader = asyncio.run(cancel_leader())
+    results += [
+        check(leader.cancelled() and all(followers), "followers got results after the leader's caller was cancelled"),
+        check(upstream_count(server) - before == 1, "cancelled leader did not cause a second request"),
+    ]
+
+    # 7. 关掉合并
+    sf.COALESCE_ENABLED = False
+    before = upstream_count(server)
+    asyncio.run(async_burst("memorial", 10))
+    results.append(check(upstream_count(server) - before == 10, "SHOPIFY_COALESCE=0: 10 callers -> 10 requests"))
+    sf.COALESCE_ENABLED = True
+
+    print(f"\nstats: {sf.coalesce_stats()}")
+    results.append(check(sf.coalesce_stats()["in_flight"] == 0, "no flights left registered"))
+
+    server.shutdown()
+    failing.shutdown()
+    print("\nALL PASSED" if all(results) else "\nSOME CHECKS FAILED")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()